@@ -1,177 +1,326 @@
 import os
+import time
 import logging
-import nbformat
 import requests
 import json
 import re
+import hashlib
+import threading
 from typing import List, Dict, Any, Optional, Tuple
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import TextLoader, PyPDFDirectoryLoader, DirectoryLoader
-from langchain_community.vectorstores import Chroma
-from langchain.prompts import PromptTemplate
-from docx import Document as DocxDocument
-from PyPDF2 import PdfReader
-from langchain.embeddings import HuggingFaceBgeEmbeddings
-from sentence_transformers import SentenceTransformer
 from fastapi import HTTPException
+from langchain_core.documents import Document
 from dotenv import load_dotenv
+from model_registry import registry
+from tracing import METRICS, span, set_span_attributes
+from llm_scheduler import LLM_SCHEDULER, LLMOverloaded
+from llm_resilience import ResilientLLMClient, LLMUnavailable
+from embedding_backends import create_embeddings, CachedQueryEmbeddings
+from single_flight import SingleFlight
+from usage_accounting import add_llm_usage
+from document_chunking import chunk_file, CHUNKING_STRATEGY
+from vector_index import (
+    VectorIndexConfig, load_vectorstore, create_vectorstore,
+    delete_where, compact_vectorstore, directory_size, ReadWriteLock
+)
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # 1. 配置Deppseek LLM
 load_dotenv("D:/AIMaster/.env")
+# 聊天补全接口地址与模型，可指向本地 mock 服务做离线压测（见 benchmarks/mock_deepseek.py）
+DEEPSEEK_API_URL = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
+DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
+# 检索到的参考资料在提示词中的位置：end 放在最后一条用户消息中（前缀缓存友好），system 为旧版放在系统消息中
+PROMPT_CONTEXT_POSITION = os.getenv("PROMPT_CONTEXT_POSITION", "end")
+# 合并内容相同的并发 LLM 请求
+LLM_COALESCE_ENABLED = os.getenv("LLM_COALESCE_ENABLED", "1") == "1"
+
+def coalesce_key(payload: Dict[str, Any]) -> str:
+    """
+    模型、温度、工具定义和全部消息（含参考资料上下文和对话历史）都相同的请求才会合并。
+    消息内容只去掉首尾空白，中间的空白（如代码缩进）不同的请求不合并
+    """
+    key = [payload["model"], payload.get("temperature"), payload.get("tools"),
+           [[m["role"], (m.get("content") or "").strip(), m.get("tool_calls"), m.get("tool_call_id")]
+            for m in payload["messages"]]]
+    return hashlib.sha1(json.dumps(key, ensure_ascii=False).encode("utf-8")).hexdigest()
 
 class DeepSeekLLM():
     def __init__(self):
         self.api_key = os.getenv("DEEPSEEK_API_KEY")
         if not self.api_key:
             raise ValueError("DEEPSEEK_API_KEY 未配置")
-        self.api_url = "https://api.deepseek.com/v1/chat/completions"
+        self.api_url = DEEPSEEK_API_URL
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
         self.system_message = "你是一个知识渊博，乐于助人，且耐心认真帮助用户的课程问答助手"
+        # 复用连接，失败时退避重试，上游持续故障时熔断
+        self.client = ResilientLLMClient()
+        self.single_flight = SingleFlight()
 
-    def chat(self, text: str, history: List[Dict[str, str]] = None, role: str = "user", context: Optional[str] = None):
-        messages = []
+    def chat(self, text: str, history: List[Dict[str, str]] = None, role: str = "user", context: Optional[str] = None,
+             stage: str = "llm"):
+        # 上游按请求开头的 token 前缀缓存：系统提示 + 历史对话在同一会话的各轮之间保持不变，
+        # 每轮都不同的参考资料放在最后一条消息中，这样长对话的前缀可以命中缓存
+        messages = [{"role": "system", "content": self.system_message}]
+        if context and PROMPT_CONTEXT_POSITION == "system":
+            # 旧版布局：参考资料放在系统消息中，每轮的第一条消息都会变化
+            messages[0]["content"] = f"{self.system_message}\n\n以下是参考资料: \n{context}\n\n请根据以上资料和对话历史进行回答。"
 
-        # 如果有Context，将其作为系统消息的一部分
-        if context:
-            rag_system_message = f"{self.system_message}\n\n以下是参考资料: \n{context}\n\n请根据以上资料和对话历史进行回答。"
-            messages.append({"role": "system", "content": rag_system_message})
-        else:
-            messages.append({"role": "system", "content": self.system_message})
-        
         if history:
-            # 过滤掉RAG检索前用户添加的最新消息，将其视为单独的text传入
-            messages.extend(history)
+            # 会话消息中还保存了引用来源等字段，只把 role / content 发给模型
+            messages.extend({"role": m["role"], "content": m["content"]} for m in history)
 
+        if context and PROMPT_CONTEXT_POSITION != "system":
+            text = f"以下是参考资料: \n{context}\n\n请根据以上资料和对话历史回答下面的问题。\n{text}"
         messages.append({"role": role, "content": text})
+        return self.chat_messages(messages, stage=stage)["content"]
 
+    def chat_messages(self, messages: List[Dict[str, Any]], tools: Optional[List[Dict[str, Any]]] = None,
+                      stage: str = "llm") -> Dict[str, Any]:
+        """发送完整的消息列表（可附带工具定义），返回模型的 message：content，调用工具时还有 tool_calls"""
         payload ={
-            "model": "deepseek-chat",
+            "model": DEEPSEEK_MODEL,
             "messages": messages,
             "temperature": 0.7
         }
-        
-        try:
-            response = requests.post(
-                self.api_url, headers=self.headers,
-                json=payload, timeout=200
-            )
-
-            response.raise_for_status() #检查HTTP错误
-            reply = response.json()["choices"][0]["message"]["content"]
-            return reply
-        except requests.exceptions.RequestException as e:
-            print(f"Error duringAPI call: {e}")
-            raise HTTPException(status_code=500, detail="AI通信出现错误")
-        except Exception as e:
-            print(f"无法响应解析：{response.text}")
-            raise HTTPException(status_code=500, detail="AI返回了无法解析的响应")
+        if tools:
+            payload["tools"] = tools
 
-# 全局 chatbot 实例
-chatbot = DeepSeekLLM()
+        if not LLM_COALESCE_ENABLED:
+            return self._complete(payload, stage)
+        # 内容完全相同的并发请求（如课堂上多名学生同时问同一个问题）只向上游发送一次，结果共享；
+        # 被合并的调用不占用调度器名额，等待时间记入同名阶段并标记 coalesced
+        reply, shared = self.single_flight.do(
+            coalesce_key(payload), lambda: self._complete(payload, stage),
+            wait_context=lambda: span(stage, model=payload["model"], coalesced=True),
+            # 限流、排队超时只针对发起请求的用户，其他等待的用户自己重新发送
+            share_error=lambda e: not isinstance(e, LLMOverloaded)
+        )
+        if shared:
+            METRICS.inc("llm_coalesced_total", stage=stage)
+        return reply
 
-# 2. 配置可用embedding模型
-embeddings = HuggingFaceBgeEmbeddings(
-    model_name="C:\\Users\\hlw20\\bge-large-zh-v1.5-local",
-    model_kwargs={"device": "cpu"}
-)
+    def _complete(self, payload: Dict[str, Any], stage: str) -> Dict[str, Any]:
+        """向上游发送一次聊天补全请求，返回模型的 message（被合并的调用共享同一个对象，调用方不要修改）"""
+        # 经调度器排队：全局并发上限、按用户限流、交互请求优先；排队过久或超出限额时抛出 LLMOverloaded
+        with LLM_SCHEDULER.slot(stage):
+            try:
+                # stage 为该次调用在请求耗时分解中的阶段名
+                with span(stage, model=payload["model"]):
+                    response = self.client.post(self.api_url, headers=self.headers, json=payload)
 
-# 3. 文本分割和提取
-def extract_text(file):
-    filename = file.name.lower()
-    file.seek(0)
-    try:
-        if filename.endswith('.pdf'):
-            reader = PdfReader(file)
-            return "\n".join([page.extract_text() or "" for page in reader.pages])
-        elif filename.endswith('.docx'):
-            doc = DocxDocument(file)
-            return "\n".join([para.text for para in doc.paragraphs])
-        elif filename.endswith('.txt') or filename.endswith('.md'):
-            return file.read().decode('utf-8')
-        elif filename.endswith('.ipynb'):
-            nb = nbformat.read(file, as_version=4)
-            texts = []
-            for cell in nb.cells:
-                if cell.cell_type in ['markdown', 'code']:
-                    texts.append(cell.source)
-            return "\n".join(texts)
-        else:
-            return "暂不支持该类型文件"
-    except Exception as e:
-        print(f"文件解析错误: {e}")
-        return ""
+                    response.raise_for_status() #检查HTTP错误
+                    data = response.json()
+                    usage = data.get("usage") or {}
+                    set_span_attributes(**{k: v for k, v in usage.items() if isinstance(v, int)})
+                    # 计入当前请求的用户 / 会话 / 意图用量
+                    add_llm_usage(stage, usage)
+                reply = data["choices"][0]["message"]
+                if reply.get("content") is None and not reply.get("tool_calls"):
+                    raise ValueError("响应中没有回答内容")
+                return reply
+            except HTTPException:
+                # 重试用尽或熔断（LLMUnavailable），原样返回 503
+                raise
+            except requests.exceptions.RequestException as e:
+                print(f"Error duringAPI call: {e}")
+                raise HTTPException(status_code=500, detail="AI通信出现错误")
+            except Exception as e:
+                print(f"无法响应解析：{response.text}")
+                raise HTTPException(status_code=500, detail="AI返回了无法解析的响应")
+
+# 全局 chatbot 实例（首次使用时创建，缺少API密钥不会导致导入失败）
+def get_chatbot() -> DeepSeekLLM:
+    return registry.get("chatbot")
+
+# 2. 配置可用embedding模型（后端由 EMBEDDING_BACKEND 选择，见 embedding_backends.py）
+def _create_embeddings() -> CachedQueryEmbeddings:
+    # 查询向量 LRU 缓存由检索和课程语义索引共享
+    return CachedQueryEmbeddings(create_embeddings())
+
+def get_embeddings() -> CachedQueryEmbeddings:
+    return registry.get("embeddings")
+
+# 3. 文本分割和提取（按文件类型结构分块，见 document_chunking.py）
+
+RAG_ERROR_ANSWER = "对不起，处理您的请求时出现错误。请稍后重试。"
+
+# 引用来源中从文档块 metadata 透传的位置信息
+CITATION_LOCATION_FIELDS = ("page", "cell_start", "cell_end", "heading")
+
+
+def make_chunk_id(source: str, content: str, session_id: Optional[str] = None, chunk_index: Optional[int] = None) -> str:
+    key = f"{session_id or ''}\n{source}\n{'' if chunk_index is None else chunk_index}\n{content}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def chunk_id_for(doc: Document) -> str:
+    chunk_id = doc.metadata.get("chunk_id")
+    if chunk_id:
+        return chunk_id
+    # 旧版本写入的文档块没有 chunk_id，按来源和内容计算
+    return make_chunk_id(doc.metadata.get("source", ""), doc.page_content)
+
+
+def build_citations(docs: List[Document], snippet_length: int = 200) -> List[Dict[str, Any]]:
+    """把检索结果整理为引用来源：文件、位置、文档块ID、相关度和检索耗时"""
+    citations = []
+    for doc in docs:
+        citation = {
+            "chunk_id": chunk_id_for(doc),
+            "source": doc.metadata.get("source", "unknown"),
+            "score": doc.metadata.get("score"),
+            "retrieval_ms": doc.metadata.get("retrieval_ms"),
+            "snippet": doc.page_content[:snippet_length],
+        }
+        for key in CITATION_LOCATION_FIELDS:
+            if key in doc.metadata:
+                citation[key] = doc.metadata[key]
+        citations.append(citation)
+    return citations
 
 class RAGSystem:
-    def __init__(self, persist_directory="D:/AIMaster/PBL/chroma_db"):
+    def __init__(self, persist_directory="D:/AIMaster/PBL/chroma_db", embeddings=None,
+                 index_config: Optional[VectorIndexConfig] = None, chunking_strategy: str = CHUNKING_STRATEGY):
         self.persist_directory = persist_directory
+        self.chunking_strategy = chunking_strategy
         self.vectorstore = None
-        self.embeddings = embeddings
+        self.embeddings = embeddings or get_embeddings()
+        # 向量索引类型、HNSW 参数和量化精度，默认从环境变量读取
+        self.index_config = index_config or VectorIndexConfig()
+        # 知识库写锁：上传、删除和压缩依次执行，压缩重建集合期间不会有写入丢失
+        self.write_lock = threading.RLock()
+        # 检索持有读锁，压缩切换集合时持有写锁，避免检索落在已删除的集合上
+        self.search_lock = ReadWriteLock()
         self._load_or_create_vectorstore()
 
     def _load_or_create_vectorstore(self):
-        if os.path.exists(self.persist_directory) and os.listdir(self.persist_directory):
-            print("正在加载已存在的向量数据库...")
-            self.vectorstore = Chroma(
-                persist_directory=self.persist_directory,
-                embedding_function=self.embeddings,
-            )
+        self.vectorstore = load_vectorstore(self.persist_directory, self.embeddings, self.index_config)
+        if self.vectorstore:
+            print("已加载已存在的向量数据库。")
         else:
             print("未找到向量数据库，将创建一个新的。")
 
     # 构建向量数据库
-    def build_vectorstore(self, files: List[Any]):
+    def build_vectorstore(self, files: List[Any], session_id: Optional[str] = None):
         if not files:
             print("没有文件可供处理")
             return
 
         all_docs = []
         for file in files:
-            text = extract_text(file)
-            if not text or "暂不支持" in text:
+            docs_from_file = chunk_file(file, self.chunking_strategy)
+            if not docs_from_file:
                 print(f"文件 '{os.path.basename(file.name)}' 解析失败或不支持")
                 continue
 
-            splitter = RecursiveCharacterTextSplitter(chunk_size=1024, chunk_overlap=128)
-            docs_from_file = splitter.create_documents([text])
             for doc in docs_from_file:
-                doc.metadata["source"] = os.path.basename(file.name)
+                if session_id:
+                    doc.metadata["session_id"] = session_id
+                doc.metadata["chunk_id"] = make_chunk_id(
+                    doc.metadata["source"], doc.page_content, session_id, doc.metadata.get("chunk_index")
+                )
             all_docs.extend(docs_from_file)
 
         if not all_docs:
             print("所有文件解析失败或者没有可提取的文本内容")
             return
 
-        if self.vectorstore:
-            print(f"正在向现有数据库添加 {len(all_docs)} 个文档...")
-            self.vectorstore.add_documents(all_docs)
-        else:
-            self.vectorstore = Chroma.from_documents(
-                documents=all_docs,
-                embedding=self.embeddings,
-                persist_directory=self.persist_directory
-            )
-            print(f"向量数据库已创建，包含 {len(all_docs)} 个新文档块")
+        with self.write_lock:
+            if self.vectorstore:
+                print(f"正在向现有数据库添加 {len(all_docs)} 个文档...")
+                self.vectorstore.add_documents(all_docs)
+            else:
+                self.vectorstore = create_vectorstore(all_docs, self.persist_directory, self.embeddings, self.index_config)
+                print(f"向量数据库已创建，包含 {len(all_docs)} 个新文档块")
+
+    # 重新上传文件：先删除同一会话中同名文件的旧文档块再添加，整个过程持有写锁
+    def replace_files(self, files: List[Any], session_id: Optional[str] = None):
+        with self.write_lock:
+            for file in files:
+                self.delete_source(file.name, session_id=session_id)
+            self.build_vectorstore(files, session_id=session_id)
+
+    # 删除指定来源文件的全部文档块，session_id 不为空时只删除该会话上传的部分
+    def delete_source(self, source: str, session_id: Optional[str] = None) -> int:
+        if not self.vectorstore:
+            return 0
+        metadata_filter = {"source": source}
+        if session_id:
+            metadata_filter["session_id"] = session_id
+        with self.write_lock:
+            removed = delete_where(self.vectorstore, metadata_filter)
+        print(f"已从向量数据库删除 {removed} 个来自 '{source}' 的文档块")
+        return removed
+
+    # 压缩向量数据库，回收已删除文档块占用的索引和磁盘空间
+    def compact(self, probe_query: str = "课程") -> Dict[str, Any]:
+        if not self.vectorstore:
+            return {"status": "empty"}
+
+        def probe_ms() -> float:
+            start = time.perf_counter()
+            self.retrieve(probe_query)
+            return round((time.perf_counter() - start) * 1000, 2)
+
+        # 先执行一次探测查询，使查询向量进入缓存，前后两次计时只包含检索本身
+        self.retrieve(probe_query)
+        size_before = directory_size(self.persist_directory)
+        latency_before = probe_ms()
+        with self.write_lock:
+            compact_vectorstore(self.vectorstore, self.search_lock)
+        size_after = directory_size(self.persist_directory)
+        latency_after = probe_ms()
+        return {
+            "status": "done",
+            "size_bytes_before": size_before,
+            "size_bytes_after": size_after,
+            "reclaimed_bytes": size_before - size_after,
+            "probe_query_ms_before": latency_before,
+            "probe_query_ms_after": latency_after,
+        }
+
+    # 检索，返回的文档块 metadata 中附带相关度 score 和本次检索耗时 retrieval_ms
+    def retrieve(self, query: str, k: int = 5) -> List[Document]:
+        if not self.vectorstore:
+            return []
+        start = time.perf_counter()
+        with span("retrieve", k=k), self.search_lock.read():
+            results = self.vectorstore.similarity_search_with_relevance_scores(query, k=k)
+        retrieval_ms = round((time.perf_counter() - start) * 1000, 2)
+        docs = []
+        for doc, score in results:
+            # 复制 metadata，避免修改向量库内部保存的对象
+            metadata = dict(doc.metadata, score=round(float(score), 4), retrieval_ms=retrieval_ms)
+            docs.append(Document(page_content=doc.page_content, metadata=metadata))
+        return docs
 
     # RAG问答作用
-    def rag_qa(self, query: str, history: List[Dict[str, str]]) -> Tuple[str, List[str]]:
+    def rag_qa(self, query: str, history: List[Dict[str, Any]], docs: Optional[List[Document]] = None,
+               k: int = 5, recommend: bool = True,
+               search_query: Optional[str] = None) -> Tuple[str, List[str], List[Dict[str, Any]]]:
         """
         RAG问答流程。
         从向量数据库检索上下文，并使用LLM生成答案和推荐问题。
+        docs 为预取得到的检索结果时跳过检索；k 为参考资料的文档块数，recommend=False 时不生成推荐问题；
+        search_query 为模型改写后的检索问题（工具调用参数），默认用 query 检索。
         返回：
         - answer (str): LLM生成的答案。
         - recommended_questions (List[str]): 推荐问题列表。
+        - citations (List[Dict]): 答案依据的文档块，见 build_citations。
         """
         
         if not self.vectorstore:
-            return "请先上传文件并等待向量数据库构建完成", []
+            return "请先上传文件并等待向量数据库构建完成", [], []
 
-        docs = self.vectorstore.similarity_search(query, k=5)
+        if docs is None:
+            docs = self.retrieve(search_query or query, k=k)
+        docs = docs[:k]
+        citations = build_citations(docs)
         context = "\n\n".join([doc.page_content for doc in docs])
         
         print("检索到的内容:")
@@ -186,7 +335,14 @@ class RAGSystem:
             用户问题：{query}
             """.strip()
 
-            questions_response = chatbot.chat(questions_prompt)
+            chatbot = get_chatbot()
+            questions_response = ""
+            try:
+                if recommend:
+                    questions_response = chatbot.chat(questions_prompt, stage="llm_recommend")
+            except (LLMOverloaded, LLMUnavailable):
+                # 推荐问题按后台优先级排队，繁忙或上游故障时放弃，不影响回答，本轮不给推荐
+                pass
 
             recommended_questions = []
             if questions_response:
@@ -195,13 +351,24 @@ class RAGSystem:
                     q.strip().lstrip('01234. ') for q in questions_response.split('\n') if q.strip()
                 ]
             # 2.生成最终答案，并保留多轮对话和记忆
-            answer =chatbot.chat(text=query, history=history, context=context)
+            # history 的最后一条是本轮的问题本身，作为 text 单独传入，不重复发送
+            if history and history[-1].get("role") == "user" and history[-1].get("content") == query:
+                history = history[:-1]
+            answer =chatbot.chat(text=query, history=history, context=context, stage="llm_answer")
 
-            return answer, recommended_questions
-        
+            return answer, recommended_questions, citations
+
+        except (LLMOverloaded, LLMUnavailable):
+            # 回答生成被限流、排队超时或上游不可用，交给接口返回 429 / 503
+            raise
         except Exception as e:
             logging.error(f"RAG问答失败: {e}")
-            return "对不起，处理您的请求时出现错误。请稍后重试。", []
+            return RAG_ERROR_ANSWER, [], []
+
+def get_rag_system() -> RAGSystem:
+    return registry.get("rag_system")
 
-# 创建实例
-rag_system_instance = RAGSystem()
\ No newline at end of file
+# 注册共享组件：全进程只创建一个 RAGSystem，embedding 模型与向量库在首次使用或预热时加载
+registry.register("chatbot", DeepSeekLLM)
+registry.register("embeddings", _create_embeddings)
+registry.register("rag_system", RAGSystem)
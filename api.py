@@ -6,12 +6,24 @@ import datetime
 import hashlib
 import logging
 from typing import List, Dict, Any, Optional
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, status
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, status, BackgroundTasks, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
-from RAG_system import RAGSystem, chatbot
+from RAG_system import get_rag_system, get_chatbot, get_embeddings, build_citations
+from model_registry import registry
 from intent_recognition import identify_intent
+from tool_routing import LLM_ROUTING_MODE, route_message
+from user_store import UserStore
+from course_matcher import CourseMatcher, CourseSemanticIndex, COURSE_DATA_PATH
+from prefetch_cache import PrefetchCache, run_prefetch
+from session_locks import SessionLocks
+from llm_scheduler import LLM_SCHEDULER, llm_call_context
+from usage_accounting import UsageLedger, collect_usage, QUOTA_DEGRADED_TOP_K, QUOTA_DEGRADED_HISTORY_MESSAGES
+from tracing import METRICS, start_trace, span, set_trace_attributes, record_trace
 from passlib.context import CryptContext
 import secrets
 import uuid
@@ -23,19 +35,21 @@ logging.basicConfig(level=logging.DEBUG)
 MAX_FILE_SIZE_MB = 3
 ALLOWED_FILE_TYPES = ['.pdf', '.docx', '.txt', '.md', '.ipynb']
 HISTORY_FILE_PATH = "chat_history.json"
+# token 用量追加日志，每处理一条消息追加一行，启动时据此恢复用量和当天额度
+USAGE_LEDGER_PATH = "usage_ledger.jsonl"
 USER_FILE_PATH = "users.json"
+USER_DB_PATH = "users.db"
 ADMIN_FOLDER = "admin_chat_history"
+# 响应体超过该字节数且客户端接受 gzip 时压缩（会话历史、会话列表等），0 表示不压缩
+GZIP_MINIMUM_SIZE = int(os.getenv("API_GZIP_MINIMUM_SIZE", "1024"))
 
 # 临时令牌存储(生产环境应使用数据库)
 ACTIVE_TOKENS: Dict[str, str] = {}
 
-# 加载课程相关知识库
-try:
-    with open("D:\AIMaster\PBL\knowledge_base\course_data.json", "r", encoding="utf-8") as f:
-        COURSE_INFO = json.load(f)
-except FileNotFoundError:
-    logging.error("无法加载课程知识库，请检查文件路径。")
-    COURSE_INFO = {}
+# 加载课程相关知识库（预编译关键词自动机，文件修改后自动重新加载）
+COURSE_MATCHER = CourseMatcher(COURSE_DATA_PATH)
+# 关键词未命中时使用语义检索，命中阈值以上直接返回结构化答案，无需调用LLM
+registry.register("course_semantic_index", lambda: CourseSemanticIndex(get_embeddings(), COURSE_DATA_PATH))
 
 # 密码哈希上下文
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -51,27 +65,92 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if GZIP_MINIMUM_SIZE > 0:
+    app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
 
-# RAG 系统和 LLM 实例
-rag_system_instance = RAGSystem()
+# 每个请求记录各阶段耗时，通过 Server-Timing 响应头返回；消息请求另外输出 JSON 日志并计入 /metrics
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    with start_trace(f"{request.method} {request.url.path}") as trace:
+        response = await call_next(request)
+    response.headers["Server-Timing"] = trace.server_timing()
+    if "intent" in trace.attributes:
+        record_trace(trace)
+    return response
+
+# RAG 系统和 LLM 实例由共享注册表懒加载，服务开始监听后在后台预热
+WARM_UP_COMPONENTS = ["embeddings", "rag_system", "course_semantic_index", "chatbot"]
+
+# 推荐问题的检索预取缓存
+PREFETCH_CACHE = PrefetchCache()
+
+# 会话级互斥锁：同一会话的消息、文件修改依次执行，不同会话互不阻塞
+SESSION_LOCKS = SessionLocks()
+
+# 知识库压缩任务状态
+COMPACTION_STATUS: Dict[str, Any] = {"state": "idle", "started_at": None, "report": None, "error": None}
+
+def run_compaction():
+    try:
+        COMPACTION_STATUS["report"] = get_rag_system().compact()
+        COMPACTION_STATUS["state"] = "done"
+        logging.info(f"知识库压缩完成: {COMPACTION_STATUS['report']}")
+    except Exception as e:
+        logging.error(f"知识库压缩失败: {e}", exc_info=True)
+        COMPACTION_STATUS["state"] = "failed"
+        COMPACTION_STATUS["error"] = str(e)
+
+def assistant_message_with_citations(answer: str, citations: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # 引用来源随助手消息一起保存，便于回看、按文档失效缓存和离线评估
+    message = {"role": "assistant", "content": answer}
+    if citations:
+        message["citations"] = citations
+    return message
+
+@app.on_event("startup")
+async def warm_up_components():
+    registry.warm_up(WARM_UP_COMPONENTS)
 
 # --- Pydantic 模型，用于定义API请求和响应的数据结构 ---
 class MessageRequest(BaseModel):
     message: str
     session_id: str
+    # 客户端当前持有的会话版本；与服务器一致时响应只包含本轮新增的消息，为空或不一致时返回完整历史
+    base_version: Optional[int] = None
+
+class Citation(BaseModel):
+    chunk_id: str
+    source: str
+    page: Optional[int] = None
+    cell_start: Optional[int] = None
+    cell_end: Optional[int] = None
+    heading: Optional[str] = None
+    score: Optional[float] = None
+    retrieval_ms: Optional[float] = None
+    snippet: str = ""
 
 class MessageResponse(BaseModel):
     answer: str
-    history: List[Dict[str, str]]
+    # 本轮处理后的会话版本，客户端下次请求时作为 base_version 发送
+    version: int
+    # 本轮新增的消息（用户消息和助手回答），助手消息可能带有 citations 字段
+    new_messages: List[Dict[str, Any]]
+    # 完整历史，仅在客户端版本缺失或与服务器不一致（需要全量同步）时返回
+    history: Optional[List[Dict[str, Any]]] = None
     recommended_questions: List[str] = Field(default_factory=list)
+    citations: List[Citation] = Field(default_factory=list)
+    # 用户已超出当天的 token 额度，本轮为降级回答（无推荐问题、参考资料和历史更短）
+    degraded: bool = False
 
 class SessionInfo(BaseModel):
     id: str
     user_id: str
     title: str
     created_at: str
-    messages: List[Dict[str, str]] = Field(default_factory=list)
+    messages: List[Dict[str, Any]] = Field(default_factory=list)
     files: List[str] = Field(default_factory=list)
+    # 消息列表每变化一次加 1，用于消息接口的增量同步
+    version: int = 0
 
 class FileUploadResponse(BaseModel):
     status: str
@@ -109,22 +188,11 @@ def get_password_hash(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
-def load_users() -> Dict[str, Dict[str, Any]]:
-    if os.path.exists(USER_FILE_PATH):
-        with open(USER_FILE_PATH, 'r', encoding='utf-8') as f:
-            try:
-                users = json.load(f)
-                return {username: UserInDB(**data).dict() for username, data in users.items()}
-            except json.JSONDecodeError:
-                logging.warning("警告： 用户文件格式错误， 已创建新的空用户列表。")
-                return {}
-    return {}
-
-def save_users(users: Dict[str, Dict[str, Any]]):
-    with open(USER_FILE_PATH, 'w', encoding='utf-8') as f:
-        json.dump(users, f, ensure_ascii=False, indent=4)
+USER_STORE = UserStore(USER_DB_PATH)
 
-USERS_DB = load_users()
+# 首次启动时从旧版 users.json 导入已有用户
+if USER_STORE.count() == 0 and os.path.exists(USER_FILE_PATH):
+    USER_STORE.import_json(USER_FILE_PATH)
 
 # 为管理员账户生成一个哈希密码
 # from passlib.context import CryptContext
@@ -136,19 +204,18 @@ USERS_DB = load_users()
 ADMIN_USERNAME = "admin"
 ADMIN_PASSWORD_HASH = "$2b$12$J1XGV.h9bziC087BlOrc4eMvYPScJtQJbVxpjrHmvo4mCV.flpd7m" # <-- 替换为你自己的哈希值
 
-if ADMIN_USERNAME not in USERS_DB:
+if not USER_STORE.get_by_username(ADMIN_USERNAME):
     admin_user_data = {
         "id": hashlib.sha256(ADMIN_USERNAME.encode()).hexdigest()[:8],
         "username": ADMIN_USERNAME,
         "hashed_password": ADMIN_PASSWORD_HASH,
         "role": "admin"
     }
-    USERS_DB[ADMIN_USERNAME] = admin_user_data
-    save_users(USERS_DB)
+    USER_STORE.add_user(admin_user_data)
     logging.info("内置管理员账户已创建或加载。")
 
 def get_user_from_db(username: str) -> Optional[UserInDB]:
-    user_data = USERS_DB.get(username)
+    user_data = USER_STORE.get_by_username(username)
     if user_data:
         return UserInDB(**user_data)
     return None
@@ -209,8 +276,24 @@ def save_chat_history_to_file(session_data: dict):
         json.dump(session_data, f, ensure_ascii=False, indent=4)
 
 ALL_SESSIONS = load_all_sessions()
+# 每个会话的 token 用量记录在会话数据的 usage 字段中，并追加到用量日志
+USAGE_LEDGER = UsageLedger(ALL_SESSIONS, USAGE_LEDGER_PATH)
 
 # --- API 端点 ---
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 文本格式的请求延迟直方图和 token 计数"""
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/ready")
+async def readiness():
+    """就绪检查：返回各组件的加载状态与导入/加载耗时，全部就绪前返回503"""
+    ready = registry.is_ready(WARM_UP_COMPONENTS)
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"ready": ready, "components": registry.status()},
+    )
+
 @app.post("/register")
 async def register_user(form_data: OAuth2PasswordRequestForm = Depends()):
     if get_user_from_db(form_data.username):
@@ -220,8 +303,9 @@ async def register_user(form_data: OAuth2PasswordRequestForm = Depends()):
     user_id = hashlib.sha256(form_data.username.encode()).hexdigest()[:8]
     new_user = UserInDB(id=user_id, username=form_data.username, hashed_password=hashed_password, role="user")
 
-    USERS_DB[form_data.username] = new_user.dict()
-    save_users(USERS_DB)
+    # 唯一约束保证并发注册同一用户名时只有一个成功
+    if not USER_STORE.add_user(new_user.dict()):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="用户名已存在")
     return {"message": "用户注册成功"}
 
 @app.post("/login", response_model=Token)
@@ -245,33 +329,83 @@ async def read_current_user(current_user: User = Depends(get_current_user)):
 @app.get("/users", response_model=List[UserOut])
 async def get_all_users(admin: User = Depends(get_current_admin)):
     """获取所有用户列表，仅限管理员访问"""
-    return [UserOut(id=user['id'], username=user['username'], role=user['role']) for user in USERS_DB.values()]
+    return [UserOut(id=user['id'], username=user['username'], role=user['role']) for user in USER_STORE.list_users()]
 
 @app.put("/users/role", response_model=UserOut)
 async def update_user_role(update_data: UserRoleUpdate, admin: User = Depends(get_current_admin)):
     """更新用户的角色，仅限管理员访问"""
-    user_to_update = None
-    for username, user_data in USERS_DB.items():
-        if user_data['id'] == update_data.user_id:
-            user_to_update = user_data
-            break
+    user_to_update = USER_STORE.update_role(update_data.user_id, update_data.role)
     if not user_to_update:
         raise HTTPException(status_code=404, detail="用户未找到")
-    
-    user_to_update['role'] = update_data.role
-    save_users(USERS_DB)
     return UserOut(**user_to_update)
 
 # 管理员专用API端点
+@app.post("/admin/knowledge-base/compact")
+async def start_compaction(background_tasks: BackgroundTasks, admin: User = Depends(get_current_admin)):
+    """在后台压缩向量数据库，仅限管理员访问"""
+    if COMPACTION_STATUS["state"] == "running":
+        raise HTTPException(status_code=409, detail="压缩任务正在进行中")
+    COMPACTION_STATUS.update({"state": "running", "started_at": str(datetime.datetime.now()), "report": None, "error": None})
+    background_tasks.add_task(run_compaction)
+    return COMPACTION_STATUS
+
+@app.get("/admin/knowledge-base/compact")
+async def get_compaction_status(admin: User = Depends(get_current_admin)):
+    """查看最近一次压缩任务的状态和前后大小"""
+    return COMPACTION_STATUS
+
+@app.get("/admin/cache/stats")
+async def get_cache_stats(admin: User = Depends(get_current_admin)):
+    """查看缓存命中情况，仅限管理员访问"""
+    stats = {}
+    if registry.is_ready(["embeddings"]):
+        stats["query_embedding"] = get_embeddings().stats()
+    stats["prefetch"] = PREFETCH_CACHE.stats()
+    return stats
+
+@app.get("/admin/llm/scheduler")
+async def get_llm_scheduler_stats(admin: User = Depends(get_current_admin)):
+    """查看 LLM 调用调度器的在途数、排队数和被放弃的调用数，以及熔断器状态和请求合并情况，仅限管理员访问"""
+    stats = LLM_SCHEDULER.stats()
+    if registry.is_ready(["chatbot"]):
+        stats["client"] = get_chatbot().client.stats()
+        stats["coalescing"] = get_chatbot().single_flight.stats()
+    return stats
+
+@app.get("/admin/usage")
+async def get_usage_report(admin: User = Depends(get_current_admin)):
+    """查看按意图和按用户汇总的 LLM token 用量及当天是否超出额度，仅限管理员访问"""
+    report = USAGE_LEDGER.report()
+    for user in report["users"]:
+        owner = USER_STORE.get_by_id(user["user_id"])
+        user["username"] = owner["username"] if owner else "未知用户"
+    return report
+
+@app.get("/admin/usage/users/{user_id}")
+async def get_user_usage(user_id: str, admin: User = Depends(get_current_admin)):
+    """查看某名用户当天的用量和每个会话的用量明细，仅限管理员访问"""
+    owner = USER_STORE.get_by_id(user_id)
+    if not owner:
+        raise HTTPException(status_code=404, detail="用户不存在")
+    return {
+        "user_id": user_id,
+        "username": owner["username"],
+        "today_tokens": USAGE_LEDGER.tokens_today(user_id),
+        "daily_quota": USAGE_LEDGER.daily_quota,
+        "over_quota": USAGE_LEDGER.over_quota(user_id),
+        "sessions": USAGE_LEDGER.user_sessions(user_id),
+    }
+
 @app.get("/admin/sessions")
 async def get_all_sessions_for_admin(admin: User = Depends(get_current_admin)):
     sessions_data = load_all_sessions()  # 每次都重新加载
     sessions_list = []
     for session_id, session_data in sessions_data.items():
+        owner = USER_STORE.get_by_id(session_data["user_id"])
         session_info = {
             "id": session_id,
             "user_id": session_data["user_id"],
-            "username": next((u["username"] for u in USERS_DB.values() if u["id"] == session_data["user_id"]), "未知用户"),
+            "username": owner["username"] if owner else "未知用户",
             "title": session_data.get("title", f"会话 {session_id[:4]}"),
             "created_at": session_data.get("created_at", "未知时间")
         }
@@ -310,7 +444,10 @@ async def create_new_session_api(current_user: User = Depends(get_current_user))
 
     new_session_number = max_session_number + 1
     new_session_title = f"会话{new_session_number}"
-    new_session_id = hashlib.sha256(str(datetime.datetime.now()).encode()).hexdigest()[:8]
+    # 随机 ID，并发创建会话时不会像按时间戳计算那样重复
+    new_session_id = uuid.uuid4().hex[:8]
+    while new_session_id in all_sessions:
+        new_session_id = uuid.uuid4().hex[:8]
     new_session_data = SessionInfo(
         id=new_session_id,
         user_id=current_user.id,
@@ -338,107 +475,239 @@ async def upload_files_api(session_id: str, files: List[UploadFile] = File(...),
     if session_id not in ALL_SESSIONS or ALL_SESSIONS[session_id].get('user_id') != current_user.id:
         raise HTTPException(status_code=404, detail="Session not found")
 
-    session_data = ALL_SESSIONS[session_id]
-    uploaded_files_paths = session_data.get("files", [])
+    async with SESSION_LOCKS.hold(session_id):
+        session_data = ALL_SESSIONS[session_id]
+        uploaded_files_paths = session_data.get("files", [])
     
-    files_to_process = []
+        files_to_process = []
     
-    try:
-        for file in files:
-            file_ext = os.path.splitext(file.filename)[1].lower()
-            if file_ext not in ALLOWED_FILE_TYPES:
-                raise HTTPException(status_code=400, detail=f"不支持该文件格式: {file.filename}")
+        try:
+            for file in files:
+                file_ext = os.path.splitext(file.filename)[1].lower()
+                if file_ext not in ALLOWED_FILE_TYPES:
+                    raise HTTPException(status_code=400, detail=f"不支持该文件格式: {file.filename}")
             
-            file_content = await file.read()
-            file_object = BytesIO(file_content)
-            file_object.name = file.filename
-            files_to_process.append(file_object)
-            uploaded_files_paths.append(file.filename)
-        
-        rag_system_instance.build_vectorstore(files_to_process)
-        session_data["files"] = uploaded_files_paths
-        save_all_sessions(ALL_SESSIONS)
-
-    except Exception as e:
-        logging.error(f"文件处理失败: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"文件处理失败: {e}")
-    finally:
-        for f in files_to_process:
-            f.close()
-
-    return FileUploadResponse(
-        status="success",
-        message="文件已上传成功！已更新知识库。",
-        uploaded_files=uploaded_files_paths
-    )
+                file_content = await file.read()
+                file_object = BytesIO(file_content)
+                file_object.name = file.filename
+                files_to_process.append(file_object)
+                if file.filename not in uploaded_files_paths:
+                    uploaded_files_paths.append(file.filename)
+
+            # 同一会话重复上传同名文件时先删除旧的文档块，避免重复内容堆积在索引中；与压缩任务互斥。
+            # 解析和向量化在线程池中执行，不阻塞其他会话的请求
+            rag_system_instance = await run_in_threadpool(get_rag_system)
+            await run_in_threadpool(rag_system_instance.replace_files, files_to_process, session_id=session_id)
+            session_data["files"] = uploaded_files_paths
+            save_all_sessions(ALL_SESSIONS)
+
+        except Exception as e:
+            logging.error(f"文件处理失败: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"文件处理失败: {e}")
+        finally:
+            for f in files_to_process:
+                f.close()
+
+        return FileUploadResponse(
+            status="success",
+            message="文件已上传成功！已更新知识库。",
+            uploaded_files=uploaded_files_paths
+        )
 
-@app.post("/sessions/{session_id}/message", response_model=MessageResponse)
-async def process_message_api(session_id: str, request: MessageRequest, current_user: User = Depends(get_current_user)):
+@app.delete("/sessions/{session_id}/files/{file_name}", response_model=FileUploadResponse)
+async def delete_file_api(session_id: str, file_name: str, current_user: User = Depends(get_current_user)):
+    """从会话中删除文件，并从向量数据库中移除其文档块"""
     if session_id not in ALL_SESSIONS or ALL_SESSIONS[session_id].get('user_id') != current_user.id:
-        raise HTTPException(status_code=404, detail="Session not found or not owned by user")
-    
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    async with SESSION_LOCKS.hold(session_id):
+        session_data = ALL_SESSIONS[session_id]
+        uploaded_files_paths = session_data.get("files", [])
+        if file_name not in uploaded_files_paths:
+            raise HTTPException(status_code=404, detail="文件不存在")
+
+        # 其他会话也上传过同名文件时只删除本会话的文档块，否则连同旧版本未标记会话的文档块一起删除
+        shared = any(
+            file_name in data.get("files", [])
+            for sid, data in ALL_SESSIONS.items() if sid != session_id
+        )
+        try:
+            rag_system_instance = await run_in_threadpool(get_rag_system)
+            removed = await run_in_threadpool(rag_system_instance.delete_source, file_name,
+                                              session_id=session_id if shared else None)
+        except Exception as e:
+            logging.error(f"文件删除失败: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"文件删除失败: {e}")
+
+        session_data["files"] = [f for f in uploaded_files_paths if f != file_name]
+        save_all_sessions(ALL_SESSIONS)
+        return FileUploadResponse(
+            status="success",
+            message=f"文件已删除，已从知识库移除 {removed} 个文档块。",
+            uploaded_files=session_data["files"]
+        )
+
+def commit_session_messages(session_id: str, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    整体替换会话消息并把版本加 1。调用方持有会话锁，同一会话的写入依次执行；
+    版本只用于响应的增量同步（客户端据此判断是否需要完整历史）。
+    """
     session_data = ALL_SESSIONS[session_id]
-    history = session_data.get("messages", [])
-    user_message = request.message
-    intent = identify_intent(user_message)
-    history.append({"role": "user", "content": user_message})
+    session_data["messages"] = messages
+    session_data["version"] = session_data.get("version", 0) + 1
+    return session_data
 
-    answer = ""
+# 系统操作只能通过界面按钮完成，按操作类型给出提示
+SYSTEM_ACTION_ANSWERS = {
+    "new_session": "好的，请点击左侧的“新建会话”按钮来开始一个新的话题。",
+    "upload_file": "请使用“上传文件”按钮来上传您需要参考的资料。",
+    "clear_history": "如果您想清空当前聊天记录，请点击界面下方的“清空聊天”按钮。",
+    "other": "您好，系统操作（例如新建会话、上传文件）需要通过界面按钮完成。请使用相应按钮进行操作。",
+}
+
+def detect_system_action(user_message: str) -> str:
+    """按关键词判断用户要执行的系统操作（意图识别模式下使用）"""
+    user_message_lower = user_message.lower()
+    if "新建会话" in user_message_lower or "开始新会话" in user_message_lower or "创建新会话" in user_message_lower:
+        return "new_session"
+    if "上传" in user_message_lower or "上传新文件" in user_message_lower:
+        return "upload_file"
+    if "删除" in user_message_lower or "清空" in user_message_lower or "清空聊天记录" in user_message_lower:
+        return "clear_history"
+    return "other"
+
+def generate_reply(session_id: str, user_message: str, intent: str, history: List[Dict[str, Any]], prefetched,
+                   degraded: bool = False, routed_answer: Optional[str] = None,
+                   tool_arguments: Optional[Dict[str, Any]] = None):
+    """
+    按意图生成回答并把助手消息追加到 history（最后一条为本轮用户消息），返回推荐问题和引用来源。
+    包含检索和 LLM 调用等阻塞操作，在线程池中执行，不占用事件循环。
+    degraded=True（用户超出当天额度）时不生成推荐问题，只带最近几条历史和更少的参考资料。
+    工具路由模式下，routed_answer 为路由调用中模型直接给出的回答，tool_arguments 为模型调用工具时的参数。
+    """
+    history_len_before = len(history) - 1
+    tool_arguments = tool_arguments or {}
     recommended_questions = []
+    citations = []
+    # 发给模型的历史（含本轮用户消息）
+    llm_history = history[-(QUOTA_DEGRADED_HISTORY_MESSAGES + 1):] if degraded else history
+    rag_options = {"k": QUOTA_DEGRADED_TOP_K, "recommend": False} if degraded else {}
 
     if intent == "RAG_QA":
-        if rag_system_instance.vectorstore:
-            answer, recommended_questions = rag_system_instance.rag_qa(user_message, history)
-            history.append({"role": "assistant", "content": answer})
+        rag_system_instance = get_rag_system()
+        if prefetched and prefetched.answer is not None and prefetched.history_len == history_len_before:
+            answer = prefetched.answer
+            recommended_questions = [] if degraded else prefetched.recommended_questions
+            citations = build_citations(prefetched.docs)
+            history.append(assistant_message_with_citations(answer, citations))
+        elif rag_system_instance.vectorstore:
+            docs = prefetched.docs if prefetched else None
+            answer, recommended_questions, citations = rag_system_instance.rag_qa(
+                user_message, llm_history, docs=docs, search_query=tool_arguments.get("query"), **rag_options
+            )
+            history.append(assistant_message_with_citations(answer, citations))
         else:
-            answer = "您好，知识库中还没有内容，我将进行通用问答。请先上传文件。"
-            ai_response = chatbot.chat(user_message, history=history[:-1])
+            ai_response = get_chatbot().chat(user_message, history=llm_history[:-1], stage="llm_answer")
             history.append({"role": "assistant", "content": ai_response})
-            answer = ai_response
 
-    elif intent == "GENERAL_QA":
-        ai_response = chatbot.chat(user_message, history=history[:-1])
-        history.append({"role": "assistant", "content": ai_response})
-        answer = ai_response
-    
     elif intent == "COURSE_MANAGEMENT":
-        found_info = False
-        for keyword, info in COURSE_INFO.items():
-            if keyword in user_message:
-                answer = info
-                found_info = True
-                break
-        if not found_info:
-            ai_response = chatbot.chat(user_message, history=history[:-1])
+        with span("course_match"):
+            course_match = COURSE_MATCHER.match(user_message)
+            if not course_match:
+                try:
+                    course_match = registry.get("course_semantic_index").lookup(user_message)
+                except Exception as e:
+                    # 语义索引不可用（加载失败等）时与关键词未命中一样交给 LLM 回答
+                    logging.error(f"课程语义检索失败，改由LLM回答: {e}", exc_info=True)
+        if course_match:
+            history.append({"role": "assistant", "content": course_match[1]})
+        else:
+            ai_response = get_chatbot().chat(user_message, history=llm_history[:-1], stage="llm_answer")
             history.append({"role": "assistant", "content": ai_response})
-            answer = ai_response
-        if found_info:
-            history.append({"role": "assistant", "content": answer})
 
     elif intent == "SYSTEM_ACTION":
-        user_message_lower = user_message.lower()
-        if "新建会话" in user_message_lower or "开始新会话" in user_message_lower or "创建新会话" in user_message_lower:
-            answer = "好的，请点击左侧的“新建会话”按钮来开始一个新的话题。"
-        elif "上传" in user_message_lower or "上传新文件" in user_message_lower:
-            answer = "请使用“上传文件”按钮来上传您需要参考的资料。"
-        elif "删除" in user_message_lower or "清空" in user_message_lower or "清空聊天记录" in user_message_lower:
-            answer = "如果您想清空当前聊天记录，请点击界面下方的“清空聊天”按钮。"
-        else:
-            answer = "您好，系统操作（例如新建会话、上传文件）需要通过界面按钮完成。请使用相应按钮进行操作。"
-        
-        history.append({"role": "assistant", "content": answer})
-    
+        action = tool_arguments.get("action") or detect_system_action(user_message)
+        history.append({"role": "assistant", "content": SYSTEM_ACTION_ANSWERS.get(action, SYSTEM_ACTION_ANSWERS["other"])})
+
+    elif routed_answer is not None:
+        # 工具路由模式下模型没有调用工具，路由调用本身已给出回答
+        history.append({"role": "assistant", "content": routed_answer})
+
     else:
-        ai_response = chatbot.chat(user_message, history=history[:-1])
+        # GENERAL_QA 及无法识别的意图直接与 LLM 对话
+        ai_response = get_chatbot().chat(user_message, history=llm_history[:-1], stage="llm_answer")
         history.append({"role": "assistant", "content": ai_response})
-        answer = ai_response
 
-    session_data["messages"] = history
-    # save_all_sessions(ALL_SESSIONS)
-    # 为管理员保存聊天记录
-    save_chat_history_to_file(session_data)
+    return recommended_questions, citations
+
+async def prefetch_recommended(session_id: str, questions: List[str], history: List[Dict[str, Any]], user_id: str):
+    """后台预取推荐问题的检索结果；预生成答案消耗的 token 按 prefetch 计入该会话用量"""
+    with collect_usage() as llm_usage:
+        await run_in_threadpool(run_prefetch, PREFETCH_CACHE, get_rag_system(), session_id, questions, history,
+                                user_id=user_id)
+    session_data = ALL_SESSIONS.get(session_id)
+    if session_data is not None:
+        USAGE_LEDGER.record(session_data, "prefetch", llm_usage)
 
-    return MessageResponse(answer=history[-1]['content'], history=history, recommended_questions=recommended_questions)
+@app.post("/sessions/{session_id}/message", response_model=MessageResponse)
+async def process_message_api(session_id: str, request: MessageRequest, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user)):
+    if session_id not in ALL_SESSIONS or ALL_SESSIONS[session_id].get('user_id') != current_user.id:
+        raise HTTPException(status_code=404, detail="Session not found or not owned by user")
+
+    user_message = request.message
+    # 超出当天 token 额度的用户降级处理，管理员不受限制
+    degraded = current_user.role != "admin" and USAGE_LEDGER.over_quota(current_user.id)
+    if degraded:
+        METRICS.inc("usage_quota_degraded_total")
+    # 同一会话的消息按到达顺序逐条处理，不同会话并行；本请求的 LLM 调用计入该用户的限额和用量
+    with llm_call_context(user_id=current_user.id), collect_usage() as llm_usage:
+        async with SESSION_LOCKS.hold(session_id):
+            base_version = ALL_SESSIONS[session_id].get("version", 0)
+            # 在副本上生成本轮消息，提交之前其他请求读到的始终是完整的上一轮历史
+            history = list(ALL_SESSIONS[session_id].get("messages", []))
+            # 点击的推荐问题已在上一轮预取过检索结果，推荐问题源自文档内容，直接按 RAG_QA 处理
+            prefetched = PREFETCH_CACHE.pop(session_id, user_message)
+            intent = "unknown"
+            routed_answer, tool_arguments = None, None
+            try:
+                if prefetched:
+                    intent = "RAG_QA"
+                elif LLM_ROUTING_MODE == "tools":
+                    # 一次带工具定义的调用完成路由，通用问答直接得到回答，省去单独的意图识别调用
+                    route_history = history[-QUOTA_DEGRADED_HISTORY_MESSAGES:] if degraded else history
+                    with span("route"):
+                        intent, routed_answer, tool_arguments = await run_in_threadpool(
+                            route_message, user_message, route_history
+                        )
+                else:
+                    with span("intent"):
+                        intent = await run_in_threadpool(identify_intent, user_message)
+                set_trace_attributes(session_id=session_id, intent=intent, prefetched=prefetched is not None)
+                history_len_before = len(history)
+                history.append({"role": "user", "content": user_message})
+
+                recommended_questions, citations = await run_in_threadpool(
+                    generate_reply, session_id, user_message, intent, history, prefetched, degraded,
+                    routed_answer, tool_arguments
+                )
+            finally:
+                # 失败的请求同样消耗了 token，也计入会话用量
+                USAGE_LEDGER.record(ALL_SESSIONS[session_id], intent, llm_usage)
+
+            session_data = commit_session_messages(session_id, history)
+            # 为管理员保存聊天记录
+            with span("save_history"):
+                save_chat_history_to_file(session_data)
+
+    # 响应返回后在后台为推荐问题预取检索结果
+    if recommended_questions:
+        background_tasks.add_task(prefetch_recommended, session_id, recommended_questions, list(history), current_user.id)
+
+    # 客户端版本与本轮处理前的服务器版本一致时，只返回新增消息，响应大小与会话长度无关
+    in_sync = request.base_version is not None and request.base_version == base_version
+    return MessageResponse(answer=history[-1]['content'], version=base_version + 1,
+                           new_messages=history[history_len_before:], history=None if in_sync else history,
+                           recommended_questions=recommended_questions, citations=citations, degraded=degraded)
 
 if __name__ == "__main__":
     if not os.path.exists("uploaded_files"):
@@ -0,0 +1,83 @@
+import os
+from contextlib import contextmanager
+from typing import Iterator
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 建立连接的超时（秒）；后端不可达时尽快失败，不让界面一直等待
+BACKEND_CONNECT_TIMEOUT = float(os.getenv("BACKEND_CONNECT_TIMEOUT", "3.05"))
+# 普通请求（登录、会话列表、管理接口）等待响应的超时
+BACKEND_READ_TIMEOUT = float(os.getenv("BACKEND_READ_TIMEOUT", "30"))
+# 发送消息和上传文件需要等待检索、LLM 生成或向量化完成，超时更长
+BACKEND_LONG_READ_TIMEOUT = float(os.getenv("BACKEND_LONG_READ_TIMEOUT", "240"))
+# 幂等请求（GET / PUT / DELETE）在连接失败或 502/503/504 时的重试次数；POST 不重试，避免重复发送消息
+BACKEND_RETRIES = int(os.getenv("BACKEND_RETRIES", "2"))
+# 是否请求 gzip 压缩的响应（会话历史等大响应体积可减少一个数量级）
+BACKEND_COMPRESSION = os.getenv("BACKEND_COMPRESSION", "1") == "1"
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"})
+
+
+class BackendClient:
+    """
+    前端访问 FastAPI 后端的共享 HTTP 客户端，全进程一个实例，多线程共用：
+    连接池复用 keep-alive 连接（不再每次点击都重新建立 TCP 连接），所有请求都有超时，
+    幂等请求失败时按指数退避自动重试。
+    """
+
+    def __init__(self, base_url: str, pool_size: int = 10, retries: int = BACKEND_RETRIES,
+                 connect_timeout: float = BACKEND_CONNECT_TIMEOUT, read_timeout: float = BACKEND_READ_TIMEOUT,
+                 long_read_timeout: float = BACKEND_LONG_READ_TIMEOUT, compression: bool = BACKEND_COMPRESSION):
+        # pool_size 为保留的 keep-alive 连接数，应不小于并发调用的线程数，否则多出的连接用完即关闭
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.long_timeout = (connect_timeout, long_read_timeout)
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.3,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=IDEMPOTENT_METHODS,
+            # 重试用尽后返回最后一次的响应，由调用方 raise_for_status 处理
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept-Encoding"] = "gzip, deflate" if compression else "identity"
+
+    def request(self, method: str, path: str, long: bool = False, **kwargs) -> requests.Response:
+        """path 为以 / 开头的接口路径；long=True 使用较长的读取超时，其余参数同 requests"""
+        kwargs.setdefault("timeout", self.long_timeout if long else self.timeout)
+        return self.session.request(method, self.base_url + path, **kwargs)
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path: str, **kwargs) -> requests.Response:
+        return self.request("PUT", path, **kwargs)
+
+    def delete(self, path: str, **kwargs) -> requests.Response:
+        return self.request("DELETE", path, **kwargs)
+
+    @contextmanager
+    def stream(self, method: str, path: str, **kwargs) -> Iterator[requests.Response]:
+        """
+        流式读取响应（如 SSE 或大文件），用法：
+            with backend.stream("POST", "/...", long=True) as response:
+                for line in response.iter_lines(decode_unicode=True): ...
+        读取超时表示两段数据之间的最长间隔；退出时关闭响应，连接归还连接池。
+        """
+        response = self.request(method, path, stream=True, **kwargs)
+        try:
+            yield response
+        finally:
+            response.close()
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,193 @@
+"""
+分块策略评测：旧版 recursive（1024 字符）vs 结构化分块。
+
+对同一批文档分别分块，输出块数、token 总量、超过 embedding 最大长度（会被截断）的块数、
+向量化耗时，以及检索命中率 hit@k（top-k 中存在来自正确文件、且包含答案片段的块）。
+
+默认使用内置生成的课程资料（两份 md，其中一份为多个一级标题的短章节；ipynb / docx 各一份）和对应问题；PDF 需要真实文件，
+可以用 --docs 指定文档目录、--queries 指定 JSONL 问题集，每行格式:
+    {"query": "大作业什么时候交？", "source": "syllabus.md", "answer": "12月25日"}
+
+用法:
+    python benchmarks/bench_chunking.py --backend torch --k 3
+    python benchmarks/bench_chunking.py --backend hashing   # 不加载模型，仅用于快速检查流程
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from io import BytesIO
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from document_chunking import chunk_file, count_tokens
+from embedding_backends import create_embeddings
+
+# BGE 最长输入 512 token，超过的块尾部会被截断
+EMBEDDING_MAX_TOKENS = 512
+
+TOPICS = [
+    ("Python基础语法", "变量、数据类型与控制结构", "第一次作业截止日期为9月20日"),
+    ("面向对象编程", "类、对象、继承与多态", "课堂测验安排在10月8日"),
+    ("链表与栈", "顺序存储与链式存储的差异", "实验一在计算机楼302机房进行"),
+    ("队列与哈希表", "哈希冲突的开放寻址与链地址法", "第二次作业要求实现一个LRU缓存"),
+    ("树与二叉搜索树", "遍历、插入与删除", "期中考试为开卷笔试"),
+    ("图算法", "广度优先、深度优先与最短路径", "实验二使用Dijkstra算法求解校园导航"),
+    ("排序算法", "快速排序、归并排序与堆排序", "第三次作业需提交复杂度分析报告"),
+    ("动态规划", "最优子结构与重叠子问题", "助教答疑时间为每周二晚上七点"),
+    ("文本向量化", "词袋模型、TF-IDF 与稠密向量", "第四次作业使用BGE模型计算句向量"),
+    ("检索增强生成", "检索、重排与生成三个阶段", "大作业提交截止日期是12月25日"),
+    ("意图识别", "规则匹配与分类模型", "课程项目答辩安排在第十六周"),
+    ("系统部署", "容器化与服务监控", "期末考试占总成绩的百分之五十"),
+]
+
+FILLER = ("本节内容结合课堂讲解与课后练习，建议同学们在课前预习教材相关章节，"
+          "课后按时完成练习并在学习平台上提交。遇到问题可以在讨论区提问，"
+          "助教会在两个工作日内回复。")
+
+
+def section_body(title, detail, fact, repeat=3):
+    return f"本周主题是{title}，重点讲解{detail}。{FILLER * repeat}注意：{fact}。{FILLER}"
+
+
+def build_markdown():
+    lines = ["# 数据结构与智能系统课程讲义", ""]
+    for week, (title, detail, fact) in enumerate(TOPICS, start=1):
+        lines += [f"## 第{week}周：{title}", "", section_body(title, detail, fact), ""]
+        lines += ["### 练习", "", f"请结合{title}完成课后练习。", ""]
+    return "\n".join(lines).encode("utf-8")
+
+
+def build_chapters():
+    """每个主题一个一级标题的短章节：检查不同章节的小节不会被合并进同一个块"""
+    lines = []
+    for week, (title, detail, fact) in enumerate(TOPICS, start=1):
+        lines += [f"# 第{week}章 {title}", "", f"本章讲解{detail}。", ""]
+        lines += ["## 注意事项", "", f"{fact}。", ""]
+    return "\n".join(lines).encode("utf-8")
+
+
+def build_notebook():
+    import nbformat
+    nb = nbformat.v4.new_notebook()
+    for week, (title, detail, fact) in enumerate(TOPICS, start=1):
+        nb.cells.append(nbformat.v4.new_markdown_cell(f"## 第{week}周实验：{title}\n\n{detail}。{fact}。"))
+        nb.cells.append(nbformat.v4.new_code_cell(
+            "\n".join([f"def week_{week}_demo(data):", f"    # {title}示例代码"]
+                      + [f"    step_{i} = process(data, {i})" for i in range(40)]
+                      + ["    return data"])))
+        nb.cells.append(nbformat.v4.new_markdown_cell(FILLER))
+    return nbformat.writes(nb).encode("utf-8")
+
+
+def build_docx():
+    from docx import Document
+    doc = Document()
+    doc.add_heading("课程实验指导书", level=1)
+    for week, (title, detail, fact) in enumerate(TOPICS, start=1):
+        doc.add_heading(f"实验{week}：{title}", level=2)
+        doc.add_paragraph(section_body(title, detail, fact, repeat=2))
+    buffer = BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def default_dataset():
+    files = {}
+    for name, builder in [("lecture_notes.md", build_markdown), ("chapters.md", build_chapters),
+                          ("lab.ipynb", build_notebook), ("guide.docx", build_docx)]:
+        try:
+            files[name] = builder()
+        except ImportError as e:
+            print(f"跳过 {name}: {e}")
+    queries = []
+    for week, (title, detail, fact) in enumerate(TOPICS, start=1):
+        answer = fact[-6:]
+        for name in files:
+            queries.append({"query": f"{title}这部分有什么需要注意的？", "source": name, "answer": answer})
+    return files, queries
+
+
+def load_dataset(docs_dir, queries_path):
+    files = {}
+    for name in sorted(os.listdir(docs_dir)):
+        with open(os.path.join(docs_dir, name), "rb") as f:
+            files[name] = f.read()
+    with open(queries_path, "r", encoding="utf-8") as f:
+        queries = [json.loads(line) for line in f if line.strip()]
+    return files, queries
+
+
+def evaluate(strategy, files, queries, embeddings, k):
+    docs = []
+    for name, content in files.items():
+        file_object = BytesIO(content)
+        file_object.name = name
+        docs.extend(chunk_file(file_object, strategy))
+
+    tokens = [count_tokens(doc.page_content) for doc in docs]
+    start = time.perf_counter()
+    doc_vectors = np.asarray(embeddings.embed_documents([doc.page_content for doc in docs]), dtype=np.float32)
+    embed_seconds = time.perf_counter() - start
+    doc_vectors /= np.linalg.norm(doc_vectors, axis=1, keepdims=True) + 1e-12
+
+    hits = []
+    for item in queries:
+        query_vector = np.asarray(embeddings.embed_query(item["query"]), dtype=np.float32)
+        scores = doc_vectors @ query_vector
+        # 只在同一文件的块中排序，分别评估每种格式的分块效果
+        candidates = [i for i, doc in enumerate(docs) if doc.metadata["source"] == item["source"]]
+        ranked = sorted(candidates, key=lambda i: -scores[i])[:k]
+        hits.append(any(item["answer"] in docs[i].page_content for i in ranked))
+
+    return {
+        "strategy": strategy,
+        "chunks": len(docs),
+        "tokens_total": int(sum(tokens)),
+        "tokens_max": int(max(tokens)) if tokens else 0,
+        "truncated_chunks": sum(1 for t in tokens if t > EMBEDDING_MAX_TOKENS),
+        "embed_seconds": round(embed_seconds, 3),
+        f"hit@{k}": round(float(np.mean(hits)), 3) if hits else None,
+        "per_source": {
+            name: {
+                "chunks": sum(1 for doc in docs if doc.metadata["source"] == name),
+                f"hit@{k}": round(float(np.mean([h for h, q in zip(hits, queries) if q["source"] == name])), 3)
+                if any(q["source"] == name for q in queries) else None,
+            }
+            for name in files
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", default=None, help="文档目录")
+    parser.add_argument("--queries", default=None, help="JSONL 问题集，与 --docs 一起使用")
+    parser.add_argument("--backend", default="torch", help="embedding 后端：torch / onnx / small / hashing")
+    parser.add_argument("--strategies", nargs="+", default=["recursive", "structured"])
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    if args.docs:
+        files, queries = load_dataset(args.docs, args.queries)
+    else:
+        files, queries = default_dataset()
+
+    embeddings = create_embeddings(args.backend)
+
+    results = []
+    for strategy in args.strategies:
+        results.append(evaluate(strategy, files, queries, embeddings, args.k))
+        print(json.dumps(results[-1], ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
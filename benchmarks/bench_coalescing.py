@@ -0,0 +1,122 @@
+"""
+课堂集中提问压测：启动本地 mock DeepSeek 服务和 api.py，--students 名学生（各自的新会话）
+在 --spread-seconds 内几乎同时提出 --distinct 个问题之一，统计上游 LLM 请求数、被合并的调用数和消息延迟。
+
+对比开启 / 关闭请求合并：
+    python benchmarks/bench_coalescing.py --students 60 --distinct 3
+    python benchmarks/bench_coalescing.py --students 60 --distinct 3 --env LLM_COALESCE_ENABLED=0
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import datetime
+
+import httpx
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_chunking import build_markdown
+from bench_end_to_end import (QUESTIONS, add_backend_arguments, backend_env, start_backend, stop_processes,
+                              wait_ready, print_log_tail, git_revision)
+from bench_llm_fairness import login_with_sessions
+
+COALESCED_LINE = re.compile(r'^llm_coalesced_total\{stage="([^"]+)"\} (\S+)$')
+
+
+async def ask(client, headers, session_id, question, delay):
+    await asyncio.sleep(delay)
+    start = time.perf_counter()
+    response = await client.post(f"/sessions/{session_id}/message", headers=headers,
+                                 json={"message": question, "session_id": session_id})
+    return (time.perf_counter() - start) * 1000, response.status_code
+
+
+async def run(args, base_url, mock_url):
+    run_id = datetime.datetime.now().strftime("%H%M%S")
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.students * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.request_timeout, limits=limits) as client:
+        if not await wait_ready(client, args.ready_timeout):
+            raise RuntimeError("api.py 未在限定时间内就绪")
+        students = await asyncio.gather(*(login_with_sessions(client, f"class_{run_id}_{i}", 1)
+                                          for i in range(args.students)))
+        # 上传课程资料，使提问走 RAG 流程
+        headers, sessions = students[0]
+        files = [("files", ("notes.md", build_markdown(), "text/markdown"))]
+        (await client.post(f"/sessions/{sessions[0]}/files", files=files, headers=headers)).raise_for_status()
+
+        questions = QUESTIONS[:args.distinct]
+        before = (await client.get(f"{mock_url}/stats")).json()["requests"]
+        start = time.perf_counter()
+        results = await asyncio.gather(*(
+            ask(client, headers, sessions[0], rng.choice(questions), rng.uniform(0, args.spread_seconds))
+            for headers, sessions in students
+        ))
+        wall_seconds = time.perf_counter() - start
+        upstream = (await client.get(f"{mock_url}/stats")).json()["requests"] - before
+        coalesced = {}
+        for line in (await client.get("/metrics")).text.splitlines():
+            match = COALESCED_LINE.match(line)
+            if match:
+                coalesced[match.group(1)] = int(float(match.group(2)))
+
+    latencies = np.asarray([ms for ms, _ in results])
+    return {
+        "messages": len(results),
+        "errors": sum(1 for _, status in results if status != 200),
+        "wall_seconds": round(wall_seconds, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 1),
+        "upstream_requests": upstream,
+        "upstream_requests_per_message": round(upstream / len(results), 2),
+        "coalesced_by_stage": coalesced,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--students", type=int, default=60)
+    parser.add_argument("--distinct", type=int, default=3, help="不同问题的个数")
+    parser.add_argument("--spread-seconds", type=float, default=1.0, help="提问时间的随机分布范围")
+    parser.add_argument("--request-timeout", type=float, default=300.0)
+    parser.add_argument("--output", default=None)
+    add_backend_arguments(parser)
+    args = parser.parse_args()
+
+    env = backend_env(args)
+    with tempfile.TemporaryDirectory() as workdir:
+        log_path = os.path.join(workdir, "api.log")
+        with open(log_path, "w") as api_log:
+            mock, api = start_backend(args, env, workdir, api_log)
+            try:
+                stats = asyncio.run(run(args, f"http://127.0.0.1:{args.api_port}", f"http://127.0.0.1:{args.mock_port}"))
+            except Exception:
+                print_log_tail(log_path)
+                raise
+            finally:
+                stop_processes(api, mock)
+        if stats["errors"]:
+            print_log_tail(log_path)
+
+    result = {
+        "revision": git_revision(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        **stats,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
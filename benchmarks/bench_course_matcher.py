@@ -0,0 +1,78 @@
+"""
+课程关键词匹配基准：逐个关键词 `in` 扫描 vs 预编译 Aho-Corasick 自动机。
+
+用法:
+    python benchmarks/bench_course_matcher.py --modules 500 --queries 2000
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from course_matcher import CourseMatcher
+
+CHARS = "课程模块项目作业进度检索增强生成意图识别向量数据库系统实践第一二三四五六七八九十周"
+
+
+def random_text(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice(CHARS) for _ in range(length))
+
+
+def legacy_match(course_info, user_message):
+    """api.py 原有的线性扫描实现"""
+    for keyword, info in course_info.items():
+        if keyword in user_message:
+            return keyword, info
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modules", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    course_info = {}
+    while len(course_info) < args.modules:
+        course_info[random_text(rng, rng.randint(3, 8))] = random_text(rng, 40)
+    keywords = list(course_info)
+    queries = []
+    for _ in range(args.queries):
+        text = random_text(rng, rng.randint(10, 60))
+        if rng.random() < 0.5:
+            pos = rng.randint(0, len(text))
+            text = text[:pos] + rng.choice(keywords) + text[pos:]
+        queries.append(text)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = os.path.join(tmp, "course_data.json")
+        with open(data_path, "w", encoding="utf-8") as f:
+            json.dump(course_info, f, ensure_ascii=False)
+
+        start = time.perf_counter()
+        matcher = CourseMatcher(data_path)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        legacy_hits = sum(1 for q in queries if legacy_match(course_info, q))
+        legacy_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ac_hits = sum(1 for q in queries if matcher.match(q))
+        ac_s = time.perf_counter() - start
+
+    print(f"关键词数: {args.modules}, 查询数: {args.queries}, 自动机构建: {build_ms:.1f} ms")
+    print(f"线性扫描:   {legacy_s / args.queries * 1e6:8.1f} us/query, 命中 {legacy_hits}")
+    print(f"Aho-Corasick: {ac_s / args.queries * 1e6:8.1f} us/query, 命中 {ac_hits}")
+    print(f"加速比: {legacy_s / ac_s:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+embedding 后端对比：查询向量化延迟、进程内存 (RSS)，以及与 fp32 基线的一致性
+（逐句余弦偏差、top-k 检索结果重合率）。
+
+每个后端在独立子进程中加载，内存数据互不干扰。
+
+用法:
+    python benchmarks/bench_embedding_backends.py --backends torch onnx small --corpus ./docs
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import tempfile
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_CORPUS = [
+    "课程代码：CS101。本课程的授课教师为张伟。",
+    "本课程主要介绍数据结构与算法，包括链表、栈、队列、树和图。",
+    "课程要求学生熟练掌握Python编程语言，完成期末项目。",
+    "课程大作业提交截止日期是12月25日，逾期提交将扣分。",
+    "第一周：Python基础语法，变量、数据类型与控制结构。",
+    "第二周：面向对象编程，类、对象、继承与多态。",
+    "RAG系统结合文档检索和语言生成，提高回答的准确性。",
+    "意图识别通过模式匹配和机器学习识别用户的真实意图。",
+    "Chroma 向量数据库用于存储文档向量，支持语义相似度检索。",
+    "期末考试为闭卷笔试，占总成绩的百分之五十。",
+    "实验课每周四下午在计算机楼302机房进行。",
+    "助教答疑时间为每周二晚上七点到九点。",
+]
+DEFAULT_QUERIES = [
+    "这门课的老师是谁？",
+    "大作业什么时候交？",
+    "课程会讲哪些数据结构？",
+    "需要掌握什么编程语言？",
+    "第二周学什么内容？",
+    "什么是检索增强生成？",
+    "期末考试怎么考？",
+    "实验课在哪里上？",
+]
+
+
+def load_corpus(corpus_dir):
+    if not corpus_dir:
+        return DEFAULT_CORPUS
+    texts = []
+    for name in sorted(os.listdir(corpus_dir)):
+        if name.endswith((".txt", ".md")):
+            with open(os.path.join(corpus_dir, name), "r", encoding="utf-8") as f:
+                texts.extend(line.strip() for line in f if line.strip())
+    return texts
+
+
+def run_worker(backend, corpus_path, queries_path, output_path, repeats):
+    """子进程：加载单个后端并记录向量与耗时"""
+    from embedding_backends import create_embeddings
+
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        corpus = json.load(f)
+    with open(queries_path, "r", encoding="utf-8") as f:
+        queries = json.load(f)
+
+    start = time.perf_counter()
+    embeddings = create_embeddings(backend)
+    load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    doc_vectors = np.asarray(embeddings.embed_documents(corpus), dtype=np.float32)
+    ingest_seconds = time.perf_counter() - start
+
+    embeddings.embed_query(queries[0])  # 预热
+    latencies = []
+    for _ in range(repeats):
+        for query in queries:
+            start = time.perf_counter()
+            embeddings.embed_query(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+    query_vectors = np.asarray([embeddings.embed_query(q) for q in queries], dtype=np.float32)
+
+    np.savez(output_path, docs=doc_vectors, queries=query_vectors)
+    stats = {
+        "backend": backend,
+        "load_seconds": round(load_seconds, 3),
+        "ingest_docs_per_second": round(len(corpus) / ingest_seconds, 1),
+        "query_ms_p50": round(float(np.percentile(latencies, 50)), 2),
+        "query_ms_p95": round(float(np.percentile(latencies, 95)), 2),
+        # Linux 下 ru_maxrss 单位为 KB
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "dim": int(doc_vectors.shape[1]),
+    }
+    print(json.dumps(stats))
+
+
+def normalize(matrix):
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def top_k(docs, queries, k):
+    scores = normalize(queries) @ normalize(docs).T
+    return [set(row) for row in np.argsort(-scores, axis=1)[:, :k]]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx", "small"])
+    parser.add_argument("--baseline", default="torch")
+    parser.add_argument("--corpus", default=None, help="包含 .txt/.md 文件的目录，每行作为一个文档")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--worker", nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        backend, corpus_path, queries_path, output_path = args.worker
+        run_worker(backend, corpus_path, queries_path, output_path, args.repeats)
+        return
+
+    corpus = load_corpus(args.corpus)
+    backends = [args.baseline] + [b for b in args.backends if b != args.baseline]
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus_path = os.path.join(tmp, "corpus.json")
+        queries_path = os.path.join(tmp, "queries.json")
+        with open(corpus_path, "w", encoding="utf-8") as f:
+            json.dump(corpus, f, ensure_ascii=False)
+        with open(queries_path, "w", encoding="utf-8") as f:
+            json.dump(DEFAULT_QUERIES, f, ensure_ascii=False)
+
+        results = {}
+        vectors = {}
+        for backend in backends:
+            output_path = os.path.join(tmp, f"{backend}.npz")
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--repeats", str(args.repeats),
+                 "--worker", backend, corpus_path, queries_path, output_path],
+                cwd=ROOT, capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                print(f"[{backend}] 运行失败:\n{proc.stderr[-2000:]}")
+                continue
+            results[backend] = json.loads(proc.stdout.strip().splitlines()[-1])
+            vectors[backend] = dict(np.load(output_path))
+
+    if args.baseline in vectors:
+        base = vectors[args.baseline]
+        base_top = top_k(base["docs"], base["queries"], args.k)
+        for backend, data in vectors.items():
+            stats = results[backend]
+            if data["docs"].shape[1] == base["docs"].shape[1]:
+                # 同一向量空间才能逐句比较余弦
+                cosines = np.sum(normalize(data["docs"]) * normalize(base["docs"]), axis=1)
+                stats["cosine_drift_mean"] = round(float(1 - cosines.mean()), 5)
+                stats["cosine_drift_max"] = round(float(1 - cosines.min()), 5)
+            candidate_top = top_k(data["docs"], data["queries"], args.k)
+            overlap = [len(a & b) / len(a) for a, b in zip(base_top, candidate_top)]
+            stats[f"top{args.k}_overlap"] = round(float(np.mean(overlap)), 3)
+
+    for stats in results.values():
+        print(json.dumps(stats, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+端到端离线压测：启动本地 mock DeepSeek 服务和 api.py（hashing embedding，不加载模型），
+模拟多名学生并发执行 注册 → 登录 → 新建会话 → 上传文件 → 多轮提问（部分点击推荐问题），
+统计各操作的 p50/p95/p99 延迟、吞吐量、错误数、API 进程内存以及 Server-Timing 中的阶段耗时。
+
+结果保存为 JSON，可用 --baseline 与之前版本的结果对比。
+
+用法:
+    python benchmarks/bench_end_to_end.py --students 20 --messages 5 --output e2e.json
+    python benchmarks/bench_end_to_end.py --students 20 --messages 5 --baseline e2e.json
+    python benchmarks/bench_end_to_end.py --env VECTOR_INDEX=numpy --first-token-ms 800
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import datetime
+
+import httpx
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_chunking import build_markdown
+
+QUESTIONS = [
+    "第一次作业什么时候截止？",
+    "动态规划这部分讲了什么？",
+    "实验一在哪个机房？",
+    "期末考试占多少分？",
+    "课程项目答辩安排在哪一周？",
+    "什么是检索增强生成？",
+    "助教答疑时间是什么时候？",
+    "排序算法需要提交什么报告？",
+]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.stages = {}
+        # 每轮 /message 响应体大小（解压后），增量响应下不随对话轮数增长
+        self.response_bytes = []
+
+    def add(self, op, ms, ok, server_timing=None):
+        self.latencies.setdefault(op, []).append(ms)
+        if not ok:
+            self.errors[op] = self.errors.get(op, 0) + 1
+        if server_timing:
+            for item in server_timing.split(","):
+                name, _, dur = item.strip().partition(";dur=")
+                if dur:
+                    self.stages.setdefault(name, []).append(float(dur))
+
+    def summary(self):
+        operations = {}
+        for op, values in self.latencies.items():
+            values = np.asarray(values)
+            operations[op] = {
+                "count": int(len(values)),
+                "errors": self.errors.get(op, 0),
+                "mean_ms": round(float(values.mean()), 1),
+                "p50_ms": round(float(np.percentile(values, 50)), 1),
+                "p95_ms": round(float(np.percentile(values, 95)), 1),
+                "p99_ms": round(float(np.percentile(values, 99)), 1),
+            }
+        stages = {name: round(float(np.mean(values)), 1) for name, values in self.stages.items()}
+        return operations, stages
+
+
+async def timed(recorder, op, coro):
+    start = time.perf_counter()
+    try:
+        response = await coro
+        ok = response.status_code < 400
+    except httpx.HTTPError:
+        response, ok = None, False
+    ms = (time.perf_counter() - start) * 1000
+    recorder.add(op, ms, ok, response.headers.get("server-timing") if response is not None and op == "message" else None)
+    return response if ok else None
+
+
+async def student(client, recorder, index, args, run_id, rng):
+    await asyncio.sleep(rng.uniform(0, args.ramp_seconds))
+    username, password = f"bench_{run_id}_{index}", "bench-password"
+    form = {"username": username, "password": password}
+    await timed(recorder, "register", client.post("/register", data=form))
+    response = await timed(recorder, "login", client.post("/login", data=form))
+    if response is None:
+        return
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    response = await timed(recorder, "create_session", client.post("/sessions/new", headers=headers))
+    if response is None:
+        return
+    session_id = response.json()["id"]
+
+    if args.upload:
+        files = [("files", (f"notes_{index}.md", build_markdown(), "text/markdown"))]
+        await timed(recorder, "upload", client.post(f"/sessions/{session_id}/files", files=files, headers=headers))
+
+    recommended, version = [], None
+    for _ in range(args.messages):
+        await asyncio.sleep(rng.uniform(0, args.think_seconds))
+        if recommended and rng.random() < args.click_rate:
+            message = rng.choice(recommended)
+        else:
+            message = rng.choice(QUESTIONS)
+        response = await timed(recorder, "message", client.post(
+            f"/sessions/{session_id}/message",
+            json={"message": message, "session_id": session_id, "base_version": version}, headers=headers
+        ))
+        if response is None:
+            recommended = []
+            continue
+        recorder.response_bytes.append(len(response.content))
+        data = response.json()
+        recommended, version = data.get("recommended_questions", []), data.get("version")
+
+
+async def wait_ready(client, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            response = await client.get("/ready")
+            if response.status_code == 200:
+                return True
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.5)
+    return False
+
+
+async def run_load(args, base_url):
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    run_id = datetime.datetime.now().strftime("%H%M%S")
+    limits = httpx.Limits(max_connections=args.students * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.request_timeout, limits=limits) as client:
+        if not await wait_ready(client, args.ready_timeout):
+            raise RuntimeError("api.py 未在限定时间内就绪")
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            student(client, recorder, i, args, run_id, random.Random(rng.random())) for i in range(args.students)
+        ))
+        wall_seconds = time.perf_counter() - start
+    return recorder, wall_seconds
+
+
+def read_process_memory(pid):
+    """Linux 下读取 /proc/<pid>/status：VmHWM 为峰值常驻内存"""
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    memory[key.lower() + "_mb"] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        pass
+    return memory
+
+
+def print_log_tail(log_path, size=3000):
+    with open(log_path, "r", errors="replace") as f:
+        print(f"--- api.py 日志末尾 ---\n{f.read()[-size:]}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(result, baseline):
+    print(f"\n与基线 {baseline.get('revision')} 对比：")
+    changed = [k for k, v in result["config"].items() if baseline.get("config", {}).get(k) != v]
+    if changed:
+        print(f"  注意：压测参数不同 {changed}，结果不可直接比较")
+    for key in ("requests_per_second", "messages_per_second"):
+        old, new = baseline.get(key), result.get(key)
+        if old:
+            print(f"  {key}: {old} -> {new} ({(new - old) / old:+.1%})")
+    for op, stats in result["operations"].items():
+        old = baseline.get("operations", {}).get(op)
+        if not old:
+            continue
+        deltas = []
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if old[metric]:
+                deltas.append(f"{metric} {old[metric]} -> {stats[metric]} ({(stats[metric] - old[metric]) / old[metric]:+.1%})")
+        print(f"  {op}: " + ", ".join(deltas))
+
+
+def add_backend_arguments(parser):
+    """mock DeepSeek 服务和 api.py 的启动参数，其他压测脚本共用"""
+    parser.add_argument("--api-port", type=int, default=8765)
+    parser.add_argument("--mock-port", type=int, default=9765)
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--ms-per-token", type=float, default=10.0)
+    parser.add_argument("--prefill-ms-per-token", type=float, default=0.0, help="mock 未命中前缀缓存的输入 token 预填充耗时")
+    parser.add_argument("--answer-tokens", type=int, default=200)
+    parser.add_argument("--intent-mix", default="RAG_QA=0.7,GENERAL_QA=0.2,COURSE_MANAGEMENT=0.1")
+    parser.add_argument("--env", action="append", default=[], help="传给 api.py 的额外环境变量 KEY=VALUE")
+    parser.add_argument("--ready-timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def backend_env(args):
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+        "DEEPSEEK_API_URL": f"http://127.0.0.1:{args.mock_port}/v1/chat/completions",
+        "DEEPSEEK_API_KEY": "mock",
+        "EMBEDDING_BACKEND": "hashing",
+        "TRACE_LOG": "0",
+    })
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return env
+
+
+def start_backend(args, env, workdir, api_log):
+    """启动 mock DeepSeek 服务和 api.py；api.py 的数据文件（会话、用户库、向量库）都写在 workdir 中"""
+    mock_cmd = [sys.executable, os.path.join(BENCH_DIR, "mock_deepseek.py"), "--port", str(args.mock_port),
+                "--first-token-ms", str(args.first_token_ms), "--ms-per-token", str(args.ms_per_token),
+                "--prefill-ms-per-token", str(args.prefill_ms_per_token), "--answer-tokens", str(args.answer_tokens), "--intent-mix", args.intent_mix, "--seed", str(args.seed)]
+    api_cmd = [sys.executable, "-m", "uvicorn", "api:app", "--port", str(args.api_port), "--log-level", "warning"]
+    mock = subprocess.Popen(mock_cmd, env=env)
+    api = subprocess.Popen(api_cmd, cwd=workdir, env=env, stdout=api_log, stderr=subprocess.STDOUT)
+    return mock, api
+
+
+def stop_processes(*processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--students", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=5, help="每名学生的提问轮数")
+    parser.add_argument("--click-rate", type=float, default=0.3, help="点击推荐问题的概率")
+    parser.add_argument("--think-seconds", type=float, default=0.5, help="两轮提问之间的随机间隔上限")
+    parser.add_argument("--ramp-seconds", type=float, default=2.0, help="学生随机错开开始的时间上限")
+    parser.add_argument("--no-upload", dest="upload", action="store_false")
+    parser.add_argument("--request-timeout", type=float, default=300.0)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--baseline", default=None, help="之前保存的结果 JSON")
+    add_backend_arguments(parser)
+    args = parser.parse_args()
+
+    env = backend_env(args)
+    with tempfile.TemporaryDirectory() as workdir:
+        log_path = os.path.join(workdir, "api.log")
+        with open(log_path, "w") as api_log:
+            mock, api = start_backend(args, env, workdir, api_log)
+            try:
+                recorder, wall_seconds = asyncio.run(run_load(args, f"http://127.0.0.1:{args.api_port}"))
+                memory = read_process_memory(api.pid)
+            except Exception:
+                print_log_tail(log_path)
+                raise
+            finally:
+                stop_processes(api, mock)
+        if recorder.errors:
+            print_log_tail(log_path)
+
+    operations, stages = recorder.summary()
+    total_requests = sum(op["count"] for op in operations.values())
+    result = {
+        "revision": git_revision(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "wall_seconds": round(wall_seconds, 2),
+        "requests_per_second": round(total_requests / wall_seconds, 2),
+        "messages_per_second": round(operations.get("message", {}).get("count", 0) / wall_seconds, 2),
+        "operations": operations,
+        "message_stages_mean_ms": stages,
+        "message_response_bytes": {
+            "mean": round(float(np.mean(recorder.response_bytes)), 1) if recorder.response_bytes else None,
+            "max": max(recorder.response_bytes, default=None),
+        },
+        "api_memory": memory,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
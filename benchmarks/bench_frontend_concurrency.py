@@ -0,0 +1,193 @@
+"""
+Gradio 前端并发压测：启动 mock DeepSeek、api.py 和 frontend.py，
+用 gradio_client 模拟多名用户同时通过前端 注册 → 登录 → 新建会话 → 多轮提问。
+
+每个 gradio_client.Client 对应一个独立的浏览器会话（gr.State 各自一份），
+除延迟和错误数外还检查用户之间是否串号：每名用户的问题带有唯一标记，
+返回的聊天记录中出现其他用户的标记、或者提示“请先登录”都记为隔离失败。
+
+用法:
+    python benchmarks/bench_frontend_concurrency.py --users 200 --messages 3
+    python benchmarks/bench_frontend_concurrency.py --users 200 --frontend-env FRONTEND_CONCURRENCY_LIMIT=16
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import datetime
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+from gradio_client import Client
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_end_to_end import (QUESTIONS, add_backend_arguments, backend_env, start_backend, stop_processes,
+                              read_process_memory, print_log_tail, git_revision)
+
+MARKER_PATTERN = re.compile(r"\[u(\d+)\]")
+
+
+class Results:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.isolation_failures = 0
+
+    def add(self, op, ms, ok):
+        with self._lock:
+            self.latencies.setdefault(op, []).append(ms)
+            if not ok:
+                self.errors[op] = self.errors.get(op, 0) + 1
+
+    def isolation_failure(self):
+        with self._lock:
+            self.isolation_failures += 1
+
+    def summary(self):
+        operations = {}
+        for op, values in self.latencies.items():
+            values = np.asarray(values)
+            operations[op] = {
+                "count": int(len(values)),
+                "errors": self.errors.get(op, 0),
+                "p50_ms": round(float(np.percentile(values, 50)), 1),
+                "p95_ms": round(float(np.percentile(values, 95)), 1),
+                "p99_ms": round(float(np.percentile(values, 99)), 1),
+            }
+        return operations
+
+
+def timed(results, op, fn, *args, **kwargs):
+    start = time.perf_counter()
+    try:
+        output = fn(*args, **kwargs)
+        ok = True
+    except Exception as e:
+        print(f"{op} 失败: {e}")
+        output, ok = None, False
+    results.add(op, (time.perf_counter() - start) * 1000, ok)
+    return output
+
+
+def check_isolation(history, index):
+    """聊天记录中只能出现本用户的标记"""
+    markers = {int(m) for item in history or [] for m in MARKER_PATTERN.findall(str(item.get("content", "")))}
+    return markers == {index}
+
+
+def user(index, args, run_id, frontend_url, results):
+    rng = random.Random(args.seed * 100003 + index)
+    time.sleep(rng.uniform(0, args.ramp_seconds))
+    client = timed(results, "connect", Client, frontend_url, verbose=False,
+                   httpx_kwargs={"timeout": args.request_timeout})
+    if client is None:
+        return
+    username, password = f"fe_{run_id}_{index}", "bench-password"
+    timed(results, "register", client.predict, username, password, password, api_name="/register_handler")
+    if timed(results, "login", client.predict, username, password, api_name="/login_handler") is None:
+        return
+    if timed(results, "create_session", client.predict, api_name="/create_new_session_handler") is None:
+        return
+
+    history = []
+    for turn in range(args.messages):
+        time.sleep(rng.uniform(0, args.think_seconds))
+        message = f"[u{index}] {rng.choice(QUESTIONS)}"
+        output = timed(results, "message", client.predict, message, history, api_name="/process_message_handler")
+        if output is None:
+            continue
+        history = output[0]
+        if not check_isolation(history, index) or any("请先登录" in str(m.get("content")) for m in history):
+            results.isolation_failure()
+
+
+def wait_http(url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return True
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=3, help="每名用户的提问轮数")
+    parser.add_argument("--think-seconds", type=float, default=1.0, help="两轮提问之间的随机间隔上限")
+    parser.add_argument("--ramp-seconds", type=float, default=5.0, help="用户随机错开开始的时间上限")
+    parser.add_argument("--frontend-port", type=int, default=7865)
+    parser.add_argument("--request-timeout", type=float, default=300.0)
+    parser.add_argument("--frontend-env", action="append", default=[], help="传给 frontend.py 的环境变量 KEY=VALUE")
+    parser.add_argument("--output", default=None)
+    add_backend_arguments(parser)
+    args = parser.parse_args()
+
+    env = backend_env(args)
+    frontend_env = dict(env, API_URL=f"http://127.0.0.1:{args.api_port}", FRONTEND_PORT=str(args.frontend_port))
+    for item in args.frontend_env:
+        key, _, value = item.partition("=")
+        frontend_env[key] = value
+    frontend_url = f"http://127.0.0.1:{args.frontend_port}/"
+    run_id = datetime.datetime.now().strftime("%H%M%S")
+    results = Results()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        log_path = os.path.join(workdir, "api.log")
+        frontend_log_path = os.path.join(workdir, "frontend.log")
+        with open(log_path, "w") as api_log, open(frontend_log_path, "w") as frontend_log:
+            mock, api = start_backend(args, env, workdir, api_log)
+            frontend = subprocess.Popen([sys.executable, os.path.join(ROOT, "frontend.py")], cwd=workdir,
+                                        env=frontend_env, stdout=frontend_log, stderr=subprocess.STDOUT)
+            try:
+                if not (wait_http(f"http://127.0.0.1:{args.api_port}/ready", args.ready_timeout)
+                        and wait_http(frontend_url, args.ready_timeout)):
+                    raise RuntimeError("api.py 或 frontend.py 未在限定时间内就绪")
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=args.users) as pool:
+                    for i in range(args.users):
+                        pool.submit(user, i, args, run_id, frontend_url, results)
+                wall_seconds = time.perf_counter() - start
+                memory = read_process_memory(frontend.pid)
+            except Exception:
+                print_log_tail(log_path)
+                print_log_tail(frontend_log_path)
+                raise
+            finally:
+                stop_processes(frontend, api, mock)
+        if results.errors:
+            print_log_tail(frontend_log_path)
+
+    operations = results.summary()
+    result = {
+        "revision": git_revision(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "wall_seconds": round(wall_seconds, 2),
+        "messages_per_second": round(operations.get("message", {}).get("count", 0) / wall_seconds, 2),
+        "isolation_failures": results.isolation_failures,
+        "operations": operations,
+        "frontend_memory": memory,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
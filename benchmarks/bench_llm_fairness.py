@@ -0,0 +1,188 @@
+"""
+LLM 调用公平性压测：启动本地 mock DeepSeek 服务和 api.py，一名“高频用户”在多个会话中不停地连续提问
+（模拟反复点击推荐问题），同时若干普通用户按正常节奏提问。
+
+输出两类用户各自的延迟和状态码分布（200 / 429 限流 / 503 排队超时），
+mock 服务收到的上游请求数和峰值并发，以及 /metrics 中 LLM 调度器的排队时间和放弃次数。
+调度器生效时：上游峰值并发不超过 LLM_MAX_CONCURRENCY，高频用户的多余调用被限流，
+普通用户的延迟与没有高频用户时接近。
+
+用法:
+    python benchmarks/bench_llm_fairness.py --users 10 --heavy-sessions 20 --duration 30
+    # 对比：关闭并发上限和按用户限流
+    python benchmarks/bench_llm_fairness.py --env LLM_MAX_CONCURRENCY=0 --env LLM_USER_RATE_PER_MINUTE=0
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import datetime
+
+import httpx
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_chunking import build_markdown
+from bench_end_to_end import (QUESTIONS, add_backend_arguments, backend_env, start_backend, stop_processes,
+                              wait_ready, print_log_tail, git_revision)
+
+METRIC_LINE = re.compile(r'^(llm_shed_total|llm_queue_wait_seconds_sum|llm_queue_wait_seconds_count)\{(.*)\} (\S+)$')
+
+
+class Outcomes:
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+
+    def add(self, kind, ms, status):
+        self.latencies.setdefault(kind, []).append(ms)
+        counts = self.statuses.setdefault(kind, {})
+        counts[str(status)] = counts.get(str(status), 0) + 1
+
+    def summary(self):
+        result = {}
+        for kind, values in self.latencies.items():
+            values = np.asarray(values)
+            result[kind] = {
+                "requests": int(len(values)),
+                "statuses": self.statuses[kind],
+                "p50_ms": round(float(np.percentile(values, 50)), 1),
+                "p95_ms": round(float(np.percentile(values, 95)), 1),
+            }
+        return result
+
+
+async def login_with_sessions(client, username, sessions):
+    form = {"username": username, "password": "bench-password"}
+    await client.post("/register", data=form)
+    response = await client.post("/login", data=form)
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    session_ids = []
+    for _ in range(sessions):
+        response = await client.post("/sessions/new", headers=headers)
+        response.raise_for_status()
+        session_ids.append(response.json()["id"])
+    return headers, session_ids
+
+
+async def ask_until(client, outcomes, kind, headers, session_id, deadline, rng, think_seconds):
+    while time.time() < deadline:
+        start = time.perf_counter()
+        try:
+            response = await client.post(f"/sessions/{session_id}/message", headers=headers,
+                                         json={"message": rng.choice(QUESTIONS), "session_id": session_id})
+            status = response.status_code
+        except httpx.HTTPError:
+            status = "error"
+        outcomes.add(kind, (time.perf_counter() - start) * 1000, status)
+        if status == 429:
+            # 与前端一致：被限流后用户会停一会儿再点
+            await asyncio.sleep(1.0)
+        await asyncio.sleep(rng.uniform(0, think_seconds))
+
+
+def parse_scheduler_metrics(text):
+    result = {"shed": {}, "queue_wait_mean_ms": {}}
+    sums, counts = {}, {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if not match:
+            continue
+        name, labels, value = match.groups()
+        labels = dict(item.split("=", 1) for item in labels.split(","))
+        labels = {k: v.strip('"') for k, v in labels.items()}
+        if name == "llm_shed_total":
+            result["shed"][f"{labels['reason']}/{labels['priority']}"] = float(value)
+        elif name.endswith("_sum"):
+            sums[labels["priority"]] = float(value)
+        else:
+            counts[labels["priority"]] = float(value)
+    for priority, count in counts.items():
+        if count:
+            result["queue_wait_mean_ms"][priority] = round(sums.get(priority, 0.0) / count * 1000, 1)
+    return result
+
+
+async def run(args, base_url, mock_url):
+    run_id = datetime.datetime.now().strftime("%H%M%S")
+    rng = random.Random(args.seed)
+    outcomes = Outcomes()
+    limits = httpx.Limits(max_connections=(args.users + args.heavy_sessions) * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.request_timeout, limits=limits) as client:
+        if not await wait_ready(client, args.ready_timeout):
+            raise RuntimeError("api.py 未在限定时间内就绪")
+        heavy_headers, heavy_sessions = await login_with_sessions(client, f"heavy_{run_id}", args.heavy_sessions)
+        # 上传一份课程资料，使提问走 RAG 流程（推荐问题 + 回答两次 LLM 调用）
+        files = [("files", ("notes.md", build_markdown(), "text/markdown"))]
+        (await client.post(f"/sessions/{heavy_sessions[0]}/files", files=files, headers=heavy_headers)).raise_for_status()
+        normal = [await login_with_sessions(client, f"normal_{run_id}_{i}", 1) for i in range(args.users)]
+
+        deadline = time.time() + args.duration
+        tasks = [ask_until(client, outcomes, "normal", headers, sessions[0], deadline,
+                           random.Random(rng.random()), args.think_seconds) for headers, sessions in normal]
+        if not args.no_heavy:
+            tasks += [ask_until(client, outcomes, "heavy", heavy_headers, session_id, deadline,
+                                random.Random(rng.random()), 0.0) for session_id in heavy_sessions]
+        start = time.perf_counter()
+        await asyncio.gather(*tasks)
+        wall_seconds = time.perf_counter() - start
+        metrics = parse_scheduler_metrics((await client.get("/metrics")).text)
+    async with httpx.AsyncClient(timeout=10) as mock_client:
+        upstream = (await mock_client.get(f"{mock_url}/stats")).json()
+    return outcomes.summary(), wall_seconds, upstream, metrics
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10, help="普通用户数")
+    parser.add_argument("--think-seconds", type=float, default=3.0, help="普通用户两次提问之间的随机间隔上限")
+    parser.add_argument("--heavy-sessions", type=int, default=20, help="高频用户同时提问的会话数")
+    parser.add_argument("--no-heavy", action="store_true", help="只运行普通用户，作为对照")
+    parser.add_argument("--duration", type=float, default=30.0, help="压测时长（秒）")
+    parser.add_argument("--request-timeout", type=float, default=300.0)
+    parser.add_argument("--output", default=None)
+    add_backend_arguments(parser)
+    args = parser.parse_args()
+
+    env = backend_env(args)
+    with tempfile.TemporaryDirectory() as workdir:
+        log_path = os.path.join(workdir, "api.log")
+        with open(log_path, "w") as api_log:
+            mock, api = start_backend(args, env, workdir, api_log)
+            try:
+                operations, wall_seconds, upstream, metrics = asyncio.run(
+                    run(args, f"http://127.0.0.1:{args.api_port}", f"http://127.0.0.1:{args.mock_port}"))
+            except Exception:
+                print_log_tail(log_path)
+                raise
+            finally:
+                stop_processes(api, mock)
+
+    result = {
+        "revision": git_revision(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "users": operations,
+        "upstream": {
+            "requests": upstream["requests"],
+            "requests_per_second": round(upstream["requests"] / wall_seconds, 2),
+            "peak_in_flight": upstream["peak_in_flight"],
+        },
+        "scheduler": metrics,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+LLM 客户端容错测试：启动带故障注入的本地 mock DeepSeek 服务，直接调用 llm_resilience.ResilientLLMClient，
+对比“无重试、200 秒超时、无熔断”的旧行为与默认配置在各类故障下的成功率和延迟。
+
+场景（通过 mock 的 POST /faults 依次切换）：
+- flaky：20% 请求返回 500/503、10% 返回 429（Retry-After）——重试应把成功率拉回接近 100%
+- hang：5% 请求挂起不响应——读取超时 + 重试应避免个别请求卡住几十秒
+- tail：5% 请求慢 10 倍——对冲请求应降低 p99
+- outage：上游全部返回 503——熔断后调用应在毫秒级失败，恢复后熔断器应自动关闭
+
+用法:
+    python benchmarks/bench_llm_resilience.py --calls 200 --concurrency 16
+    python benchmarks/bench_llm_resilience.py --scenarios outage --breaker-reset 2
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_end_to_end import git_revision
+from llm_resilience import ResilientLLMClient, CircuitBreaker, LLMUnavailable
+
+NO_FAULTS = {"error_rate": 0, "rate_limit_rate": 0, "hang_rate": 0, "slow_rate": 0}
+SCENARIOS = {
+    "flaky": {"error_rate": 0.2, "rate_limit_rate": 0.1, "retry_after": 0.5},
+    "hang": {"hang_rate": 0.05},
+    "tail": {"slow_rate": 0.05, "slow_factor": 10},
+}
+PAYLOAD = {"model": "deepseek-chat", "temperature": 0.7,
+           "messages": [{"role": "user", "content": "什么是检索增强生成？"}]}
+
+
+def call(client, url):
+    start = time.perf_counter()
+    try:
+        ok = client.post(url, json=PAYLOAD).status_code == 200
+    except LLMUnavailable:
+        ok = False
+    except Exception as e:
+        print(f"调用失败: {e}")
+        ok = False
+    return (time.perf_counter() - start) * 1000, ok
+
+
+def run_calls(client, url, calls, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: call(client, url), range(calls)))
+    latencies = np.asarray([ms for ms, _ in results])
+    return {
+        "success_rate": round(sum(ok for _, ok in results) / len(results), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 1),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 1),
+        "max_ms": round(float(latencies.max()), 1),
+    }
+
+
+def set_faults(mock_url, faults):
+    httpx.post(f"{mock_url}/faults", json=dict(NO_FAULTS, **faults), timeout=5).raise_for_status()
+
+
+def upstream_requests(mock_url):
+    return httpx.get(f"{mock_url}/stats", timeout=5).json()["requests"]
+
+
+def clients(args):
+    """旧行为（不重试、200 秒超时、不熔断）与新默认配置；tail 场景另加开启对冲的配置"""
+    return {
+        "legacy": lambda: ResilientLLMClient(retries=0, read_timeout=200,
+                                             breaker=CircuitBreaker(failure_threshold=10 ** 9)),
+        "resilient": lambda: ResilientLLMClient(read_timeout=args.read_timeout),
+        "resilient+hedge": lambda: ResilientLLMClient(read_timeout=args.read_timeout, hedge=True),
+    }
+
+
+def run_scenario(name, args, url, mock_url):
+    result = {}
+    for label, factory in clients(args).items():
+        if label.endswith("hedge") and name != "tail":
+            continue
+        client = factory()
+        if label.endswith("hedge"):
+            # 对冲延迟取近期 p95，先用无故障请求积累延迟样本
+            set_faults(mock_url, {})
+            run_calls(client, url, 40, args.concurrency)
+        set_faults(mock_url, SCENARIOS[name])
+        before = upstream_requests(mock_url)
+        stats = run_calls(client, url, args.calls, args.concurrency)
+        stats["upstream_requests"] = upstream_requests(mock_url) - before
+        result[label] = stats
+        print(f"{name} / {label}: {stats}")
+    return result
+
+
+def run_outage(args, url, mock_url):
+    """上游宕机 → 熔断快速失败 → 恢复后探测成功、熔断器关闭"""
+    client = ResilientLLMClient(read_timeout=args.read_timeout,
+                                breaker=CircuitBreaker(failure_threshold=5, reset_seconds=args.breaker_reset))
+    set_faults(mock_url, {"error_rate": 1.0})
+    before = upstream_requests(mock_url)
+    during = [call(client, url) for _ in range(20)]
+    upstream_during = upstream_requests(mock_url) - before
+    fast_fail = [ms for ms, _ in during[10:]]
+
+    set_faults(mock_url, {})
+    time.sleep(args.breaker_reset + 0.1)
+    after = [call(client, url) for _ in range(5)]
+    result = {
+        "circuit_after_outage": "open" if not any(ok for _, ok in during) else "unexpected success",
+        "upstream_requests_for_20_calls": upstream_during,
+        "fast_fail_p50_ms": round(float(np.percentile(fast_fail, 50)), 2),
+        "recovered": all(ok for _, ok in after),
+        "circuit_after_recovery": client.breaker.state,
+    }
+    print(f"outage: {result}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", nargs="+", default=["flaky", "hang", "tail", "outage"])
+    parser.add_argument("--calls", type=int, default=200, help="每个场景、每种客户端的调用次数")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--read-timeout", type=float, default=5.0, help="新客户端的读取超时（秒）")
+    parser.add_argument("--breaker-reset", type=float, default=2.0, help="outage 场景熔断器的恢复探测间隔")
+    parser.add_argument("--mock-port", type=int, default=9766)
+    parser.add_argument("--first-token-ms", type=float, default=200.0)
+    parser.add_argument("--ms-per-token", type=float, default=2.0)
+    parser.add_argument("--hang-seconds", type=float, default=30.0)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+    url = f"{mock_url}/v1/chat/completions"
+    mock = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "mock_deepseek.py"), "--port", str(args.mock_port),
+                             "--first-token-ms", str(args.first_token_ms), "--ms-per-token", str(args.ms_per_token),
+                             "--hang-seconds", str(args.hang_seconds), "--intent-mix", "GENERAL_QA=1"])
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                httpx.get(f"{mock_url}/stats", timeout=1)
+                break
+            except httpx.HTTPError:
+                if time.time() > deadline:
+                    raise RuntimeError("mock 服务未启动")
+                time.sleep(0.2)
+        scenarios = {}
+        for name in args.scenarios:
+            scenarios[name] = run_outage(args, url, mock_url) if name == "outage" else run_scenario(name, args, url, mock_url)
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    result = {
+        "revision": git_revision(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "scenarios": scenarios,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
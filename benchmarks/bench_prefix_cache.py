@@ -0,0 +1,151 @@
+"""
+长对话前缀缓存测试：启动本地 mock DeepSeek 服务（按请求前缀模拟上游缓存，未命中的输入 token 计预填充耗时）
+和 api.py，--students 名学生各自在一个会话中连续提问 --turns 轮（全部走 RAG），
+统计回答阶段（llm_answer）的缓存命中 token、按 DeepSeek 计价方式估算的输入成本，以及前几轮与最后几轮的延迟。
+
+对比参考资料放在最后一条消息（默认）与旧版放在系统消息中：
+    python benchmarks/bench_prefix_cache.py --turns 12
+    python benchmarks/bench_prefix_cache.py --turns 12 --env PROMPT_CONTEXT_POSITION=system
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import datetime
+
+import httpx
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_chunking import TOPICS
+from bench_end_to_end import (add_backend_arguments, backend_env, start_backend, stop_processes,
+                              wait_ready, print_log_tail, git_revision)
+from bench_llm_fairness import login_with_sessions
+
+SECTIONS_PER_TOPIC = 5
+TOKENS_LINE = re.compile(r'^llm_tokens_total\{stage="llm_answer",type="([^"]+)"\} (\S+)$')
+
+
+def build_notes():
+    """
+    每个主题分若干小节、各节内容互不相同的讲义：bench_chunking 的讲义各节共用大段模板文字，
+    哈希向量下不同问题会检索到相同的块，参考资料几乎不变，无法反映真实课程资料
+    """
+    lines = ["# 课程讲义", ""]
+    for week, (title, detail, fact) in enumerate(TOPICS, start=1):
+        for part in range(1, SECTIONS_PER_TOPIC + 1):
+            lines += [f"## 第{week}周 {title}（{part}）", ""]
+            lines += [f"{title}第{part}节第{i}段：{detail}，例题{week}-{part}-{i}。" for i in range(1, 7)]
+            lines += [f"{fact}。", ""]
+    return "\n".join(lines).encode("utf-8")
+
+
+async def converse(client, headers, session_id, turns, rng):
+    """在一个会话中连续提问，返回每轮的 (耗时毫秒, 状态码)"""
+    results = []
+    version = 0
+    for turn in range(turns):
+        # 每轮问两个随机主题，检索到的参考资料随问题变化；带上轮次避免不同学生的相同问题被请求合并
+        (first, _, _), (second, _, _) = rng.sample(TOPICS, 2)
+        part = rng.randint(1, SECTIONS_PER_TOPIC)
+        question = f"{first}第{part}节和{second}第{part}节的例题有什么联系？（第{turn + 1}问）"
+        start = time.perf_counter()
+        response = await client.post(f"/sessions/{session_id}/message", headers=headers,
+                                     json={"message": question, "session_id": session_id, "base_version": version})
+        results.append(((time.perf_counter() - start) * 1000, response.status_code))
+        if response.status_code == 200:
+            version = response.json()["version"]
+    return results
+
+
+async def run(args, base_url):
+    run_id = datetime.datetime.now().strftime("%H%M%S")
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.request_timeout) as client:
+        if not await wait_ready(client, args.ready_timeout):
+            raise RuntimeError("api.py 未在限定时间内就绪")
+        students = await asyncio.gather(*(login_with_sessions(client, f"prefix_{run_id}_{i}", 1)
+                                          for i in range(args.students)))
+        # 向量库全局共享，只上传一次课程资料（每人上传一份时检索结果会是同一块的多个副本）
+        headers, sessions = students[0]
+        files = [("files", ("notes.md", build_notes(), "text/markdown"))]
+        (await client.post(f"/sessions/{sessions[0]}/files", files=files, headers=headers)).raise_for_status()
+
+        results = await asyncio.gather(*(
+            converse(client, headers, sessions[0], args.turns, random.Random(args.seed + i))
+            for i, (headers, sessions) in enumerate(students)
+        ))
+        tokens = {}
+        for line in (await client.get("/metrics")).text.splitlines():
+            match = TOKENS_LINE.match(line)
+            if match:
+                tokens[match.group(1)] = int(float(match.group(2)))
+
+    window = max(1, args.turns // 4)
+    early = np.asarray([ms for student in results for ms, _ in student[:window]])
+    late = np.asarray([ms for student in results for ms, _ in student[-window:]])
+    hit = tokens.get("prompt_cache_hit_tokens", 0)
+    miss = tokens.get("prompt_cache_miss_tokens", 0)
+    cost = (hit * args.hit_price + miss * args.miss_price) / 1e6
+    uncached_cost = (hit + miss) * args.miss_price / 1e6
+    return {
+        "messages": sum(len(student) for student in results),
+        "errors": sum(1 for student in results for _, status in student if status != 200),
+        f"first_{window}_turns_p50_ms": round(float(np.percentile(early, 50)), 1),
+        f"last_{window}_turns_p50_ms": round(float(np.percentile(late, 50)), 1),
+        "answer_prompt_tokens": tokens.get("prompt_tokens", 0),
+        "answer_cache_hit_tokens": hit,
+        "answer_cache_miss_tokens": miss,
+        "answer_cache_hit_rate": round(hit / (hit + miss), 4) if hit + miss else 0.0,
+        "answer_input_cost": round(cost, 4),
+        "answer_input_cost_without_cache": round(uncached_cost, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--students", type=int, default=5)
+    parser.add_argument("--turns", type=int, default=12, help="每名学生在同一会话中的提问轮数")
+    parser.add_argument("--hit-price", type=float, default=0.5, help="每百万缓存命中输入 token 的价格")
+    parser.add_argument("--miss-price", type=float, default=2.0, help="每百万未命中输入 token 的价格")
+    parser.add_argument("--request-timeout", type=float, default=300.0)
+    parser.add_argument("--output", default=None)
+    add_backend_arguments(parser)
+    parser.set_defaults(intent_mix="RAG_QA=1", prefill_ms_per_token=0.5)
+    args = parser.parse_args()
+
+    env = backend_env(args)
+    with tempfile.TemporaryDirectory() as workdir:
+        log_path = os.path.join(workdir, "api.log")
+        with open(log_path, "w") as api_log:
+            mock, api = start_backend(args, env, workdir, api_log)
+            try:
+                stats = asyncio.run(run(args, f"http://127.0.0.1:{args.api_port}"))
+            except Exception:
+                print_log_tail(log_path)
+                raise
+            finally:
+                stop_processes(api, mock)
+        if stats["errors"]:
+            print_log_tail(log_path)
+
+    result = {
+        "revision": git_revision(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        **stats,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
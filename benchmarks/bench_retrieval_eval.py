@@ -0,0 +1,208 @@
+"""
+检索质量 + 速度回归评测：用固定的课程资料语料（benchmarks/eval_corpus）和标注问题集，
+走与线上相同的 RAGSystem.build_vectorstore → RAGSystem.retrieve 流程。
+
+每种配置（分块策略 × 向量索引类型）输出：
+- 质量：recall@k（top-k 中存在来自正确文件、且包含答案片段的块）、MRR（首个相关块排名的倒数均值）
+- 入库：文档块数、入库耗时、吞吐量（块/秒、KB/秒）、索引目录大小
+- 查询：检索延迟 mean / p50 / p95（含查询向量化，不经过查询向量缓存）
+
+结果保存为 JSON；用 --baseline 与之前的结果对比，召回率或 MRR 下降超过 --max-quality-drop 时返回非零退出码，
+修改分块、embedding、索引参数或 k 值之前后各跑一次即可证明检索质量没有退化。
+
+默认使用 hashing embedding，不加载模型、完全离线；--backend torch 使用实际部署的 BGE 模型。
+问题集为 JSONL，每行格式与 bench_chunking.py 相同:
+    {"query": "第一次作业什么时候截止？", "source": "syllabus.md", "answer": "9 月 22 日"}
+
+用法:
+    python benchmarks/bench_retrieval_eval.py --output retrieval_before.json
+    python benchmarks/bench_retrieval_eval.py --baseline retrieval_before.json
+    python benchmarks/bench_retrieval_eval.py --backend torch --indexes chroma numpy --strategies recursive structured
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import warnings
+import datetime
+from io import BytesIO
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_chunking import load_dataset
+from bench_end_to_end import git_revision
+from embedding_backends import create_embeddings
+from vector_index import VectorIndexConfig, directory_size
+from RAG_system import RAGSystem
+
+DEFAULT_CORPUS = os.path.join(BENCH_DIR, "eval_corpus")
+# 影响分块和索引结果的环境变量，记录到结果中，对比时提示配置差异
+TRACKED_ENV = ("CHUNK_MAX_TOKENS", "CHUNK_OVERLAP_TOKENS", "CHUNK_TOKENIZER", "HASHING_EMBEDDING_DIM",
+               "HNSW_SPACE", "HNSW_M", "HNSW_EF_CONSTRUCTION", "HNSW_EF_SEARCH", "VECTOR_QUANTIZATION")
+
+
+def index_count(vectorstore):
+    if hasattr(vectorstore, "__len__"):
+        return len(vectorstore)
+    return vectorstore._collection.count()
+
+
+def as_files(files):
+    """把文件内容包装成与上传文件相同的带 name 属性的文件对象"""
+    objects = []
+    for name, content in files.items():
+        file_object = BytesIO(content)
+        file_object.name = name
+        objects.append(file_object)
+    return objects
+
+
+def first_relevant_rank(docs, item):
+    for rank, doc in enumerate(docs, start=1):
+        if doc.metadata.get("source") == item["source"] and item["answer"] in doc.page_content:
+            return rank
+    return None
+
+
+def evaluate(strategy, index_kind, files, queries, embeddings, ks, repeat):
+    max_k = max(ks)
+    with tempfile.TemporaryDirectory() as persist_directory:
+        rag = RAGSystem(persist_directory=persist_directory, embeddings=embeddings,
+                        index_config=VectorIndexConfig(kind=index_kind), chunking_strategy=strategy)
+        start = time.perf_counter()
+        rag.build_vectorstore(as_files(files))
+        ingest_seconds = time.perf_counter() - start
+        chunks = index_count(rag.vectorstore)
+        index_bytes = directory_size(persist_directory)
+
+        # 预热一次，避免首次查询的初始化开销计入延迟
+        rag.retrieve(queries[0]["query"], k=max_k)
+        ranks, latencies = [], []
+        for item in queries:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                docs = rag.retrieve(item["query"], k=max_k)
+                latencies.append((time.perf_counter() - start) * 1000)
+            ranks.append(first_relevant_rank(docs, item))
+        rag.vectorstore = None
+
+    input_kb = sum(len(content) for content in files.values()) / 1024
+    latencies = np.asarray(latencies)
+    reciprocal = [1.0 / r if r else 0.0 for r in ranks]
+    return {
+        "strategy": strategy,
+        "index": index_kind,
+        "quality": {
+            **{f"recall@{k}": round(float(np.mean([r is not None and r <= k for r in ranks])), 4) for k in ks},
+            f"mrr@{max_k}": round(float(np.mean(reciprocal)), 4),
+        },
+        "per_source": {
+            name: {
+                "queries": sum(1 for q in queries if q["source"] == name),
+                f"mrr@{max_k}": round(float(np.mean([x for x, q in zip(reciprocal, queries) if q["source"] == name])), 4),
+            }
+            for name in files if any(q["source"] == name for q in queries)
+        },
+        "ingestion": {
+            "chunks": chunks,
+            "seconds": round(ingest_seconds, 3),
+            "chunks_per_second": round(chunks / ingest_seconds, 1),
+            "kb_per_second": round(input_kb / ingest_seconds, 1),
+            "index_bytes": index_bytes,
+        },
+        "query_latency_ms": {
+            "mean": round(float(latencies.mean()), 2),
+            "p50": round(float(np.percentile(latencies, 50)), 2),
+            "p95": round(float(np.percentile(latencies, 95)), 2),
+        },
+        "misses": [q["query"] for q, r in zip(queries, ranks) if r is None],
+    }
+
+
+def compare(results, baseline, max_drop):
+    """打印与基线的差异，返回质量退化的条目"""
+    print(f"\n与基线 {baseline.get('revision')} 对比：")
+    changed = [k for k, v in baseline.get("config", {}).items() if k != "output" and results["config"].get(k) != v]
+    if changed:
+        print(f"  注意：评测参数不同 {changed}，结果不可直接比较")
+    old_runs = {(r["strategy"], r["index"]): r for r in baseline.get("runs", [])}
+    regressions = []
+    for run in results["runs"]:
+        old = old_runs.get((run["strategy"], run["index"]))
+        if not old:
+            continue
+        print(f"  [{run['strategy']} / {run['index']}]")
+        for metric, value in run["quality"].items():
+            before = old["quality"].get(metric)
+            if before is None:
+                continue
+            flag = ""
+            if before - value > max_drop:
+                flag = "  <-- 退化"
+                regressions.append(f"{run['strategy']}/{run['index']} {metric}")
+            print(f"    {metric}: {before} -> {value} ({value - before:+.4f}){flag}")
+        for group, metric in (("ingestion", "chunks_per_second"), ("ingestion", "index_bytes"),
+                              ("query_latency_ms", "p50"), ("query_latency_ms", "p95")):
+            before, value = old[group].get(metric), run[group][metric]
+            if before:
+                print(f"    {metric}: {before} -> {value} ({(value - before) / before:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="语料目录，包含 docs/ 和 questions.jsonl")
+    parser.add_argument("--backend", default="hashing", help="embedding 后端：hashing / torch / onnx / small")
+    parser.add_argument("--strategies", nargs="+", default=["structured"])
+    parser.add_argument("--indexes", nargs="+", default=["chroma", "numpy"], help="chroma / numpy / quantized")
+    parser.add_argument("--k", nargs="+", type=int, default=[1, 3, 5, 10])
+    parser.add_argument("--repeat", type=int, default=5, help="每个问题重复检索的次数，用于统计延迟")
+    parser.add_argument("--max-quality-drop", type=float, default=0.0,
+                        help="与基线相比 recall@k / MRR 允许的最大下降值")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--baseline", default=None, help="之前保存的结果 JSON")
+    args = parser.parse_args()
+
+    # 未归一化的向量在 Chroma l2 空间下相关度可能为负，LangChain 的告警会打印全部文档内容
+    warnings.filterwarnings("ignore", message="Relevance scores must be between 0 and 1")
+    files, queries = load_dataset(os.path.join(args.corpus, "docs"), os.path.join(args.corpus, "questions.jsonl"))
+    embeddings = create_embeddings(args.backend)
+
+    runs = []
+    for strategy in args.strategies:
+        for index_kind in args.indexes:
+            runs.append(evaluate(strategy, index_kind, files, queries, embeddings, args.k, args.repeat))
+            print(json.dumps(runs[-1], ensure_ascii=False))
+
+    config = {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "max_quality_drop")}
+    config["corpus"] = os.path.relpath(os.path.abspath(args.corpus), ROOT)
+    config["documents"] = len(files)
+    config["queries"] = len(queries)
+    config["env"] = {k: os.environ[k] for k in TRACKED_ENV if k in os.environ}
+    results = {
+        "revision": git_revision(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": config,
+        "runs": runs,
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.max_quality_drop)
+        if regressions:
+            print(f"\n检索质量退化: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+会话并发一致性压测：启动本地 mock DeepSeek 服务和 api.py，验证
+1. 同一会话同时发出的多条消息按顺序逐条处理，对话记录不交错、不丢失；
+2. 不同会话的消息并行处理，互不排队。
+
+两个阶段：
+- parallel：--sessions 个会话各发 1 条消息，全部同时发出。各会话并行时总耗时接近单条消息的延迟，
+  串行时接近 单条延迟 × 会话数。
+- burst：每个会话同时发出 --burst 条消息（所有会话一起发），检查每个会话最终的消息记录：
+  用户 / 助手消息严格交替、每条用户消息恰好出现一次、版本号等于消息轮数，
+  每个响应的 version 各不相同且 new_messages 与最终记录中对应位置的消息一致。
+
+发现任何不一致时返回非零退出码。
+
+用法:
+    python benchmarks/bench_session_concurrency.py --sessions 20 --burst 5
+    python benchmarks/bench_session_concurrency.py --sessions 20 --burst 5 --first-token-ms 500 --output sessions.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import datetime
+
+import httpx
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_end_to_end import (add_backend_arguments, backend_env, start_backend, stop_processes,
+                              wait_ready, print_log_tail, git_revision)
+
+
+async def create_user_session(client, run_id, index):
+    form = {"username": f"lock_{run_id}_{index}", "password": "bench-password"}
+    await client.post("/register", data=form)
+    response = await client.post("/login", data=form)
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    response = await client.post("/sessions/new", headers=headers)
+    response.raise_for_status()
+    return headers, response.json()["id"]
+
+
+async def send(client, headers, session_id, message):
+    """发送一条消息，返回 (耗时毫秒, 响应 JSON 或 None)"""
+    start = time.perf_counter()
+    response = await client.post(f"/sessions/{session_id}/message",
+                                 json={"message": message, "session_id": session_id}, headers=headers)
+    ms = (time.perf_counter() - start) * 1000
+    return ms, response.json() if response.status_code == 200 else None
+
+
+def check_session(messages, version, sent, responses):
+    """返回该会话的不一致描述列表，空列表表示一致"""
+    problems = []
+    roles = [m["role"] for m in messages]
+    if roles != ["user", "assistant"] * (len(messages) // 2) or len(messages) % 2:
+        problems.append(f"消息角色未严格交替: {roles}")
+    users = [m["content"] for m in messages if m["role"] == "user"]
+    if sorted(users) != sorted(sent):
+        problems.append(f"用户消息丢失或重复: 发送 {len(sent)} 条，记录 {len(users)} 条")
+    if version != len(users):
+        problems.append(f"版本号 {version} 与消息轮数 {len(users)} 不一致")
+    versions = [r["version"] for r in responses if r]
+    if len(set(versions)) != len(versions):
+        problems.append(f"多个响应返回了相同的版本号: {sorted(versions)}")
+    for r in responses:
+        if not r:
+            continue
+        expected = messages[2 * (r["version"] - 1):2 * r["version"]]
+        if [(m["role"], m["content"]) for m in r["new_messages"]] != [(m["role"], m["content"]) for m in expected]:
+            problems.append(f"版本 {r['version']} 的 new_messages 与会话记录不一致")
+    return problems
+
+
+async def run(args, base_url):
+    run_id = datetime.datetime.now().strftime("%H%M%S")
+    limits = httpx.Limits(max_connections=args.sessions * (args.burst + 1))
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.request_timeout, limits=limits) as client:
+        if not await wait_ready(client, args.ready_timeout):
+            raise RuntimeError("api.py 未在限定时间内就绪")
+        users = await asyncio.gather(*(create_user_session(client, run_id, i) for i in range(args.sessions)))
+
+        # 单条消息的基准延迟（无并发）
+        headers, session_id = users[0]
+        single = [(await send(client, headers, session_id, f"基准 {i}"))[0] for i in range(3)]
+
+        start = time.perf_counter()
+        parallel = await asyncio.gather(*(send(client, h, sid, f"[s{i}] 并行") for i, (h, sid) in enumerate(users)))
+        parallel_wall = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        sent = {sid: [f"[s{i}-m{j}] 第 {j} 条" for j in range(args.burst)] for i, (_, sid) in enumerate(users)}
+        burst = await asyncio.gather(*(
+            asyncio.gather(*(send(client, h, sid, message) for message in sent[sid])) for h, sid in users
+        ))
+        burst_wall = (time.perf_counter() - start) * 1000
+
+        problems = {}
+        errors = sum(1 for _, r in parallel if r is None)
+        for (h, sid), results in zip(users, burst):
+            errors += sum(1 for _, r in results if r is None)
+            session = (await client.get(f"/sessions/{sid}", headers=h)).json()
+            # 跳过基准和并行阶段的消息，只检查突发阶段写入的部分
+            offset = 2 * (session["version"] - len(sent[sid]))
+            responses = [dict(r, version=r["version"] - offset // 2) if r else None for _, r in results]
+            session_problems = check_session(session["messages"][offset:], session["version"] - offset // 2,
+                                             sent[sid], responses)
+            if session_problems:
+                problems[sid] = session_problems
+
+    single_p50 = float(np.percentile(single, 50))
+    burst_latencies = [ms for results in burst for ms, _ in results]
+    return {
+        "single_message_p50_ms": round(single_p50, 1),
+        "parallel": {
+            "sessions": args.sessions,
+            "wall_ms": round(parallel_wall, 1),
+            # 并行阶段总耗时 / 单条延迟：接近 1 表示各会话完全并行，接近会话数表示被串行化
+            "wall_over_single": round(parallel_wall / single_p50, 2),
+        },
+        "burst": {
+            "messages_per_session": args.burst,
+            "wall_ms": round(burst_wall, 1),
+            # 同一会话逐条处理，理想值接近每会话消息数
+            "wall_over_single": round(burst_wall / single_p50, 2),
+            "p50_ms": round(float(np.percentile(burst_latencies, 50)), 1),
+            "p95_ms": round(float(np.percentile(burst_latencies, 95)), 1),
+        },
+        "errors": errors,
+        "inconsistent_sessions": problems,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--burst", type=int, default=5, help="每个会话同时发出的消息数")
+    parser.add_argument("--request-timeout", type=float, default=300.0)
+    parser.add_argument("--output", default=None)
+    add_backend_arguments(parser)
+    parser.set_defaults(intent_mix="GENERAL_QA=1")
+    args = parser.parse_args()
+
+    env = backend_env(args)
+    with tempfile.TemporaryDirectory() as workdir:
+        log_path = os.path.join(workdir, "api.log")
+        with open(log_path, "w") as api_log:
+            mock, api = start_backend(args, env, workdir, api_log)
+            try:
+                result = asyncio.run(run(args, f"http://127.0.0.1:{args.api_port}"))
+            except Exception:
+                print_log_tail(log_path)
+                raise
+            finally:
+                stop_processes(api, mock)
+        if result["errors"]:
+            print_log_tail(log_path)
+
+    result = {
+        "revision": git_revision(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        **result,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if result["errors"] or result["inconsistent_sessions"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
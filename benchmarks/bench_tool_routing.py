@@ -0,0 +1,167 @@
+"""
+路由方式测试：分别以意图识别模式（LLM_ROUTING_MODE=intent）和工具调用模式（LLM_ROUTING_MODE=tools）启动 api.py，
+通过 mock DeepSeek 服务的 POST /routing 逐个固定路由（GENERAL_QA / RAG_QA / COURSE_MANAGEMENT / SYSTEM_ACTION），
+每个路由在新会话中发送 --messages 条消息，统计每条消息的上游请求数、延迟、实际意图和模型调用的工具。
+
+检查项（不满足时退出码为 1）：每条消息按预期意图处理、上游请求数不超过预期（工具模式下通用问答只需一次调用）、
+RAG 回答带引用来源、系统操作返回对应的按钮提示，工具模式下每条消息都由模型调用了对应的工具。
+
+用法:
+    python benchmarks/bench_tool_routing.py --messages 5
+    python benchmarks/bench_tool_routing.py --modes tools --first-token-ms 800
+"""
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import datetime
+
+import httpx
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_chunking import build_markdown
+from bench_end_to_end import (QUESTIONS, add_backend_arguments, backend_env, start_backend, stop_processes,
+                              wait_ready, print_log_tail, git_revision)
+from bench_llm_fairness import login_with_sessions
+from mock_deepseek import ROUTE_TOOLS
+
+ROUTE_MESSAGES = {
+    "GENERAL_QA": ["你好，什么是人工智能？", "帮我写一个Python函数。", "请教我如何使用API链接大模型。"],
+    "RAG_QA": QUESTIONS,
+    "COURSE_MANAGEMENT": ["第三周的核心模块是什么？", "意图识别系统是哪个模块的任务？", "我想咨询课程相关内容。"],
+    "SYSTEM_ACTION": ["我想新建会话。", "帮我新建会话。"],
+}
+# 每条消息的上游请求数上限：意图识别（或路由）+ 回答（+ RAG 的推荐问题）；
+# 课程信息命中课程库时不需要回答调用，未命中时回退到 LLM 回答
+EXPECTED_CALLS = {
+    "intent": {"GENERAL_QA": 2, "RAG_QA": 3, "COURSE_MANAGEMENT": 2, "SYSTEM_ACTION": 1},
+    "tools": {"GENERAL_QA": 1, "RAG_QA": 3, "COURSE_MANAGEMENT": 2, "SYSTEM_ACTION": 1},
+}
+INTENT_LINE = re.compile(r'^chat_requests_total\{intent="([^"]+)"\} (\S+)$')
+
+
+async def intent_counts(client):
+    counts = {}
+    for line in (await client.get("/metrics")).text.splitlines():
+        match = INTENT_LINE.match(line)
+        if match:
+            counts[match.group(1)] = int(float(match.group(2)))
+    return counts
+
+
+async def run_route(client, mock_url, headers, route, messages):
+    (await client.post(f"{mock_url}/routing", json={"intent_mix": f"{route}=1"})).raise_for_status()
+    session_id = (await client.post("/sessions/new", headers=headers)).json()["id"]
+    before_stats = (await client.get(f"{mock_url}/stats")).json()
+    before_intents = await intent_counts(client)
+    latencies, replies = [], []
+    version = 0
+    for i in range(messages):
+        text = ROUTE_MESSAGES[route][i % len(ROUTE_MESSAGES[route])]
+        start = time.perf_counter()
+        response = await client.post(f"/sessions/{session_id}/message", headers=headers,
+                                     json={"message": text, "session_id": session_id, "base_version": version})
+        latencies.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+        data = response.json()
+        version = data["version"]
+        replies.append(data)
+    after_stats = (await client.get(f"{mock_url}/stats")).json()
+    after_intents = await intent_counts(client)
+    tool_calls = {name: after_stats["tool_calls"][name] - before_stats["tool_calls"][name]
+                  for name in after_stats["tool_calls"]}
+    return {
+        "upstream_requests_per_message": round((after_stats["requests"] - before_stats["requests"]) / messages, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+        "intents": {k: v - before_intents.get(k, 0) for k, v in after_intents.items() if v != before_intents.get(k, 0)},
+        "tool_calls": {k: v for k, v in tool_calls.items() if v},
+        "with_citations": sum(1 for r in replies if r["citations"]),
+        "answers": sorted({r["answer"][:30] for r in replies}),
+    }
+
+
+def check_route(mode, route, stats, messages):
+    checks = {
+        "intent": stats["intents"] == {route: messages},
+        "upstream_requests": stats["upstream_requests_per_message"] <= EXPECTED_CALLS[mode][route],
+    }
+    if route == "RAG_QA":
+        checks["citations"] = stats["with_citations"] == messages
+    if route == "SYSTEM_ACTION":
+        checks["action_answer"] = all("新建会话" in answer for answer in stats["answers"])
+    if mode == "tools":
+        expected_tools = {ROUTE_TOOLS[route]: messages} if route in ROUTE_TOOLS else {}
+        checks["tool_calls"] = stats["tool_calls"] == expected_tools
+    return checks
+
+
+async def run(args, mode, base_url, mock_url):
+    run_id = datetime.datetime.now().strftime("%H%M%S")
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.request_timeout) as client:
+        if not await wait_ready(client, args.ready_timeout):
+            raise RuntimeError("api.py 未在限定时间内就绪")
+        headers, sessions = await login_with_sessions(client, f"route_{mode}_{run_id}", 1)
+        files = [("files", ("notes.md", build_markdown(), "text/markdown"))]
+        (await client.post(f"/sessions/{sessions[0]}/files", files=files, headers=headers)).raise_for_status()
+        routes = {}
+        for route in args.routes:
+            stats = await run_route(client, mock_url, headers, route, args.messages)
+            stats["checks"] = check_route(mode, route, stats, args.messages)
+            routes[route] = stats
+            print(f"{mode} / {route}: {stats}")
+        return routes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", nargs="+", default=["intent", "tools"], choices=["intent", "tools"])
+    parser.add_argument("--routes", nargs="+", default=list(ROUTE_MESSAGES), choices=list(ROUTE_MESSAGES))
+    parser.add_argument("--messages", type=int, default=5, help="每个路由发送的消息数")
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument("--output", default=None)
+    add_backend_arguments(parser)
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.modes:
+        env = backend_env(args)
+        env["LLM_ROUTING_MODE"] = mode
+        with tempfile.TemporaryDirectory() as workdir:
+            log_path = os.path.join(workdir, "api.log")
+            with open(log_path, "w") as api_log:
+                mock, api = start_backend(args, env, workdir, api_log)
+                try:
+                    results[mode] = asyncio.run(run(args, mode, f"http://127.0.0.1:{args.api_port}",
+                                                    f"http://127.0.0.1:{args.mock_port}"))
+                except Exception:
+                    print_log_tail(log_path)
+                    raise
+                finally:
+                    stop_processes(api, mock)
+
+    result = {
+        "revision": git_revision(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "modes": results,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    failed = [f"{mode}/{route}/{name}" for mode, routes in results.items() for route, stats in routes.items()
+              for name, ok in stats["checks"].items() if not ok]
+    if failed:
+        print(f"未通过的检查: {failed}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
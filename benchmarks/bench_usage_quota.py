@@ -0,0 +1,147 @@
+"""
+token 用量统计与每日额度测试：启动本地 mock DeepSeek 服务和 api.py（设置 USER_DAILY_TOKEN_QUOTA），
+一名学生在一个会话中连续提问 --turns 轮（全部走 RAG），记录每轮是否降级、推荐问题数和上游输入 token 数；
+再把另一名用户设为管理员，读取 /admin/usage，核对统计的输入 token 与 mock 服务实际收到的是否一致。
+
+检查项（不满足时退出码为 1）：达到额度后的回答被降级、降级回答没有推荐问题且输入 token 更少、
+管理员接口统计的输入 token 与上游一致。
+
+用法:
+    python benchmarks/bench_usage_quota.py --turns 10 --quota 15000
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+import datetime
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_chunking import build_markdown
+from bench_end_to_end import (QUESTIONS, add_backend_arguments, backend_env, start_backend, stop_processes,
+                              wait_ready, print_log_tail, git_revision)
+from bench_llm_fairness import login_with_sessions
+
+
+async def upstream_prompt_tokens(client, mock_url):
+    tokens = (await client.get(f"{mock_url}/stats")).json()["prompt_cache_tokens"]
+    return tokens["hit"] + tokens["miss"]
+
+
+async def login_as_admin(client, workdir, username):
+    """注册用户后直接在用户库中改为管理员，再重新登录"""
+    headers, _ = await login_with_sessions(client, username, 0)
+    with sqlite3.connect(os.path.join(workdir, "users.db")) as conn:
+        conn.execute("UPDATE users SET role = 'admin' WHERE username = ?", (username,))
+    headers, _ = await login_with_sessions(client, username, 0)
+    return headers
+
+
+async def run(args, base_url, mock_url, workdir):
+    run_id = datetime.datetime.now().strftime("%H%M%S")
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.request_timeout) as client:
+        if not await wait_ready(client, args.ready_timeout):
+            raise RuntimeError("api.py 未在限定时间内就绪")
+        headers, sessions = await login_with_sessions(client, f"quota_{run_id}", 1)
+        session_id = sessions[0]
+        files = [("files", ("notes.md", build_markdown(), "text/markdown"))]
+        (await client.post(f"/sessions/{session_id}/files", files=files, headers=headers)).raise_for_status()
+
+        start_tokens = await upstream_prompt_tokens(client, mock_url)
+        turns = []
+        version = 0
+        for turn in range(args.turns):
+            before = await upstream_prompt_tokens(client, mock_url)
+            start = time.perf_counter()
+            response = await client.post(f"/sessions/{session_id}/message", headers=headers, json={
+                "message": f"{QUESTIONS[turn % len(QUESTIONS)]}（第{turn + 1}问）",
+                "session_id": session_id, "base_version": version,
+            })
+            response.raise_for_status()
+            data = response.json()
+            version = data["version"]
+            turns.append({
+                "turn": turn + 1,
+                "degraded": data["degraded"],
+                "recommended_questions": len(data["recommended_questions"]),
+                "citations": len(data["citations"]),
+                "upstream_prompt_tokens": await upstream_prompt_tokens(client, mock_url) - before,
+                "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+            })
+            print(turns[-1])
+        upstream_total = await upstream_prompt_tokens(client, mock_url) - start_tokens
+
+        user_id = (await client.get("/me", headers=headers)).json()["id"]
+        admin_headers = await login_as_admin(client, workdir, f"quota_admin_{run_id}")
+        report = (await client.get("/admin/usage", headers=admin_headers)).json()
+        detail = (await client.get(f"/admin/usage/users/{user_id}", headers=admin_headers)).json()
+
+    user_report = next(u for u in report["users"] if u["user_id"] == user_id)
+    normal = [t for t in turns if not t["degraded"]]
+    degraded = [t for t in turns if t["degraded"]]
+    checks = {
+        "degraded_after_quota": bool(degraded) and all(t["degraded"] for t in turns[turns.index(degraded[0]):]),
+        "degraded_without_recommendations": all(t["recommended_questions"] == 0 for t in degraded),
+        "degraded_uses_fewer_tokens": bool(degraded) and bool(normal) and
+            max(t["upstream_prompt_tokens"] for t in degraded) < min(t["upstream_prompt_tokens"] for t in normal[1:] or normal),
+        "ledger_matches_upstream": user_report["total"]["prompt_tokens"] == upstream_total,
+    }
+    return {
+        "turns": turns,
+        "upstream_prompt_tokens": upstream_total,
+        "ledger_total": user_report["total"],
+        "ledger_by_intent": user_report["by_intent"],
+        "today_tokens": detail["today_tokens"],
+        "over_quota": detail["over_quota"],
+        "checks": checks,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--quota", type=int, default=15000, help="每名用户每天的 token 额度")
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument("--output", default=None)
+    add_backend_arguments(parser)
+    parser.set_defaults(intent_mix="RAG_QA=1", first_token_ms=50.0, ms_per_token=1.0)
+    args = parser.parse_args()
+    args.env.append(f"USER_DAILY_TOKEN_QUOTA={args.quota}")
+
+    env = backend_env(args)
+    with tempfile.TemporaryDirectory() as workdir:
+        log_path = os.path.join(workdir, "api.log")
+        with open(log_path, "w") as api_log:
+            mock, api = start_backend(args, env, workdir, api_log)
+            try:
+                stats = asyncio.run(run(args, f"http://127.0.0.1:{args.api_port}",
+                                        f"http://127.0.0.1:{args.mock_port}", workdir))
+            except Exception:
+                print_log_tail(log_path)
+                raise
+            finally:
+                stop_processes(api, mock)
+
+    result = {
+        "revision": git_revision(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        **stats,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if not all(stats["checks"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
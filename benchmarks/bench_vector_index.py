@@ -0,0 +1,160 @@
+"""
+向量索引召回率 / 延迟基准：在合成语料上对比 Chroma 不同 HNSW 参数，
+以及 NumPy 后端的 float32 / float16 / int8 精确检索。
+
+以 float32 精确检索作为 ground truth，输出每种配置的 recall@k、查询延迟、建索引耗时和向量内存，
+结果保存为 JSON，便于按部署规模挑选后端与参数。
+
+用法:
+    python benchmarks/bench_vector_index.py --n 10000 100000 1000000 --dim 1024 --queries 200 \\
+        --m 16 32 --ef-construction 100 200 --ef-search 10 50 100 --output index_results.json
+
+1M × 1024 维 float32 约占 4GB，内存不足时可用 --dim 缩小维度。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import itertools
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document
+from vector_index import NumpyVectorStore
+
+
+class PrecomputedEmbeddings:
+    """把合成向量按文本编号直接返回，跳过真实模型"""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed_documents(self, texts):
+        return self.vectors[[int(t) for t in texts]]
+
+
+def synthetic_corpus(n, dim, n_queries, n_clusters, seed):
+    """带簇结构的单位向量，比均匀随机向量更接近真实文本分布"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, n)
+    corpus = centers[labels] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    corpus /= np.linalg.norm(corpus, axis=1, keepdims=True)
+    q_labels = rng.integers(0, n_clusters, n_queries)
+    queries = centers[q_labels] + 0.6 * rng.standard_normal((n_queries, dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return corpus, queries
+
+
+def exact_top_k(corpus, queries, k):
+    result = []
+    for start in range(0, len(queries), 64):
+        scores = queries[start:start + 64] @ corpus.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        result.extend(set(row) for row in top)
+    return result
+
+
+def summarize(name, params, truth, found, latencies, build_seconds, memory_bytes):
+    recall = np.mean([len(t & f) / len(t) for t, f in zip(truth, found)])
+    return {
+        "index": name,
+        **params,
+        "recall": round(float(recall), 4),
+        "query_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+        "query_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+        "build_seconds": round(build_seconds, 2),
+        "memory_mb": round(memory_bytes / 2 ** 20, 1) if memory_bytes is not None else None,
+    }
+
+
+def bench_hnsw(corpus, queries, truth, k, m, ef_construction, ef_search, batch_size):
+    import chromadb
+
+    client = chromadb.EphemeralClient()
+    name = f"bench_{m}_{ef_construction}_{ef_search}_{time.time_ns()}"
+    collection = client.create_collection(name, metadata={
+        "hnsw:space": "ip", "hnsw:M": m,
+        "hnsw:construction_ef": ef_construction, "hnsw:search_ef": ef_search,
+    })
+    start = time.perf_counter()
+    for offset in range(0, len(corpus), batch_size):
+        block = corpus[offset:offset + batch_size]
+        collection.add(ids=[str(i) for i in range(offset, offset + len(block))], embeddings=block.tolist())
+    build_seconds = time.perf_counter() - start
+
+    found, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append({int(i) for i in result["ids"][0]})
+    client.delete_collection(name)
+    params = {"M": m, "ef_construction": ef_construction, "ef_search": ef_search}
+    # HNSW 图本身约占 M*2*4 字节/向量，另加 float32 原始向量
+    memory = len(corpus) * (corpus.shape[1] * 4 + m * 2 * 4)
+    return summarize("hnsw", params, truth, found, latencies, build_seconds, memory)
+
+
+def bench_numpy(corpus, queries, truth, k, precision, batch_size):
+    with tempfile.TemporaryDirectory() as tmp:
+        store = NumpyVectorStore(tmp, PrecomputedEmbeddings(corpus), precision)
+        start = time.perf_counter()
+        for offset in range(0, len(corpus), batch_size):
+            end = min(offset + batch_size, len(corpus))
+            store.add_documents([Document(page_content=str(i)) for i in range(offset, end)])
+        build_seconds = time.perf_counter() - start
+
+        found, latencies = [], []
+        for query in queries:
+            start = time.perf_counter()
+            results = store.similarity_search_by_vector_with_score(query, k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found.append({int(doc.page_content) for doc, _ in results})
+        return summarize("numpy", {"precision": precision}, truth, found, latencies,
+                         build_seconds, store.memory_bytes())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, nargs="+", default=[10000])
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--clusters", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--m", type=int, nargs="+", default=[16])
+    parser.add_argument("--ef-construction", type=int, nargs="+", default=[100])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--precision", nargs="*", default=["float32", "float16", "int8"])
+    parser.add_argument("--skip-hnsw", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    runs = []
+    for n in args.n:
+        corpus, queries = synthetic_corpus(n, args.dim, args.queries, args.clusters, args.seed)
+        truth = exact_top_k(corpus, queries, args.k)
+
+        results = []
+        if not args.skip_hnsw:
+            for m, ef_c, ef_s in itertools.product(args.m, args.ef_construction, args.ef_search):
+                results.append(bench_hnsw(corpus, queries, truth, args.k, m, ef_c, ef_s, args.batch_size))
+                print(json.dumps({"n": n, **results[-1]}))
+        for precision in args.precision:
+            results.append(bench_numpy(corpus, queries, truth, args.k, precision, args.batch_size))
+            print(json.dumps({"n": n, **results[-1]}))
+        runs.append({"n": n, "dim": args.dim, "k": args.k, "results": results})
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(runs, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""
+本地 mock DeepSeek 聊天补全服务（OpenAI 兼容的 /v1/chat/completions），用于离线压测。
+
+按请求内容返回三类结果：意图识别提示词返回 JSON 意图，推荐问题提示词返回问题列表，
+其余返回固定长度的答案。延迟 = 首 token 延迟 + 未命中缓存的输入 token 数 × 每 token 预填充耗时
++ 输出 token 数 × 每 token 耗时（可加抖动），stream=true 时以 SSE 逐块返回。
+
+工具调用：请求带 tools 时按 --intent-mix 随机选择路由（RAG_QA → search_course_docs，COURSE_MANAGEMENT →
+lookup_course_info，SYSTEM_ACTION → system_action，GENERAL_QA → 直接回答），返回 tool_calls；
+运行中可通过 POST /routing 修改 intent_mix，以便逐个路由测试。
+
+前缀缓存：与 DeepSeek 一样按请求开头的前缀缓存，以消息为边界记录出现过的前缀，
+命中部分按 64 token 取整，usage 中返回 prompt_cache_hit_tokens / prompt_cache_miss_tokens。
+
+故障注入（按比例随机发生，可通过 POST /faults 在运行中修改，例如 {"error_rate": 1.0} 模拟上游宕机）：
+--error-rate 返回 500/503，--rate-limit-rate 返回 429 和 Retry-After，
+--hang-rate 挂起 --hang-seconds 秒不响应，--slow-rate 按 --slow-factor 倍延迟返回（长尾）。
+
+用法:
+    python benchmarks/mock_deepseek.py --port 9000 --first-token-ms 400 --ms-per-token 20
+    DEEPSEEK_API_URL=http://127.0.0.1:9000/v1/chat/completions DEEPSEEK_API_KEY=mock python api.py
+"""
+import json
+import time
+import uuid
+import random
+import asyncio
+import hashlib
+import argparse
+from collections import OrderedDict
+from typing import List, Dict, Any
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+ANSWER_TEXT = ("根据课程资料，本周的主要内容包括基础概念的讲解、课堂练习和课后作业。"
+               "请按时完成作业并在学习平台提交，如有疑问可以在答疑时间联系助教。")
+RECOMMENDED_QUESTIONS = [
+    "这部分内容的作业截止日期是什么时候？",
+    "课堂练习需要提交吗？",
+    "有哪些推荐的参考资料？",
+]
+
+
+def parse_intent_mix(text: str) -> List[tuple]:
+    """"RAG_QA=0.7,GENERAL_QA=0.3" -> [("RAG_QA", 0.7), ("GENERAL_QA", 0.3)]"""
+    mix = []
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        mix.append((name.strip(), float(weight or 1)))
+    return mix
+
+
+def count_tokens(text: str) -> int:
+    # 粗略估计：中文每字一个 token
+    return max(1, len(text))
+
+
+class MockConfig:
+    def __init__(self, args):
+        self.first_token_ms = args.first_token_ms
+        self.ms_per_token = args.ms_per_token
+        self.jitter = args.jitter
+        self.answer_tokens = args.answer_tokens
+        self.intent_mix = parse_intent_mix(args.intent_mix)
+        self.rng = random.Random(args.seed)
+        self.error_rate = args.error_rate
+        self.rate_limit_rate = args.rate_limit_rate
+        self.retry_after = args.retry_after
+        self.hang_rate = args.hang_rate
+        self.hang_seconds = args.hang_seconds
+        self.slow_rate = args.slow_rate
+        self.slow_factor = args.slow_factor
+        self.prefill_ms_per_token = args.prefill_ms_per_token
+        self.prefix_cache_size = args.prefix_cache_size
+
+
+FAULT_FIELDS = ("error_rate", "rate_limit_rate", "retry_after", "hang_rate", "hang_seconds", "slow_rate", "slow_factor")
+
+
+CACHE_UNIT_TOKENS = 64
+
+
+class PrefixCache:
+    """按消息边界记录出现过的请求前缀（LRU），返回新请求与已有前缀重合的 token 数"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._prefixes: "OrderedDict[str, None]" = OrderedDict()
+
+    def lookup_and_store(self, messages: List[Dict[str, Any]]) -> int:
+        digest = hashlib.sha1()
+        hit_tokens = tokens = 0
+        matching = True
+        for message in messages:
+            digest.update(json.dumps([message.get("role"), message.get("content")], ensure_ascii=False).encode("utf-8"))
+            tokens += count_tokens(message.get("content") or "")
+            key = digest.hexdigest()
+            if matching and key in self._prefixes:
+                self._prefixes.move_to_end(key)
+                hit_tokens = tokens
+            else:
+                matching = False
+                self._prefixes[key] = None
+                if len(self._prefixes) > self.max_entries:
+                    self._prefixes.popitem(last=False)
+        return hit_tokens // CACHE_UNIT_TOKENS * CACHE_UNIT_TOKENS
+
+
+ROUTE_TOOLS = {"RAG_QA": "search_course_docs", "COURSE_MANAGEMENT": "lookup_course_info", "SYSTEM_ACTION": "system_action"}
+
+
+def choose_intent(config: MockConfig) -> str:
+    names, weights = zip(*config.intent_mix)
+    return config.rng.choices(names, weights)[0]
+
+
+def system_action_for(text: str) -> str:
+    if "新建" in text or "新会话" in text:
+        return "new_session"
+    if "上传" in text:
+        return "upload_file"
+    if "清空" in text or "删除" in text:
+        return "clear_history"
+    return "other"
+
+
+def build_tool_call(config: MockConfig, payload: Dict[str, Any]):
+    """带工具定义的请求：按 intent_mix 选择调用的工具，返回 tool_calls；选中 GENERAL_QA 或没有对应工具时返回 None（直接回答）"""
+    messages = payload.get("messages", [])
+    text = messages[-1].get("content") or "" if messages else ""
+    available = {tool.get("function", {}).get("name") for tool in payload.get("tools", [])}
+    name = ROUTE_TOOLS.get(choose_intent(config))
+    if name not in available:
+        return None
+    arguments = {"action": system_action_for(text)} if name == "system_action" else {"query": text}
+    return [{"id": f"call_{uuid.uuid4().hex[:8]}", "type": "function",
+             "function": {"name": name, "arguments": json.dumps(arguments, ensure_ascii=False)}}]
+
+
+def build_reply(config: MockConfig, messages: List[Dict[str, Any]]) -> str:
+    prompt = messages[-1].get("content") or "" if messages else ""
+    if "意图" in prompt and "intent" in prompt:
+        intent = choose_intent(config)
+        return "```json\n" + json.dumps({"intent": intent, "reason": "mock"}, ensure_ascii=False) + "\n```"
+    if "问题推荐生成器" in prompt:
+        return "\n".join(f"{i}. {q}" for i, q in enumerate(RECOMMENDED_QUESTIONS, start=1))
+    repeat = config.answer_tokens // len(ANSWER_TEXT) + 1
+    return (ANSWER_TEXT * repeat)[:config.answer_tokens]
+
+
+def create_app(config: MockConfig) -> FastAPI:
+    app = FastAPI()
+    app.state.requests = 0
+    app.state.faults = {"error": 0, "rate_limit": 0, "hang": 0, "slow": 0}
+    # 同时在处理的请求数及其峰值，用于验证调用方的并发上限
+    app.state.in_flight = 0
+    app.state.peak_in_flight = 0
+    app.state.prefix_cache = PrefixCache(config.prefix_cache_size)
+    app.state.cache_tokens = {"hit": 0, "miss": 0}
+    app.state.tool_calls = {name: 0 for name in ROUTE_TOOLS.values()}
+
+    def enter():
+        app.state.in_flight += 1
+        app.state.peak_in_flight = max(app.state.peak_in_flight, app.state.in_flight)
+
+    def leave():
+        app.state.in_flight -= 1
+
+    def delay_seconds(tokens: int, prefill_tokens: int = 0) -> float:
+        base = config.first_token_ms + config.prefill_ms_per_token * prefill_tokens + config.ms_per_token * tokens
+        if config.rng.random() < config.slow_rate:
+            app.state.faults["slow"] += 1
+            base *= config.slow_factor
+        return max(0.0, base * (1 + config.rng.uniform(-config.jitter, config.jitter))) / 1000
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": app.state.requests, "in_flight": app.state.in_flight,
+                "peak_in_flight": app.state.peak_in_flight, "faults": app.state.faults,
+                "prompt_cache_tokens": app.state.cache_tokens, "tool_calls": app.state.tool_calls}
+
+    @app.get("/routing")
+    async def get_routing():
+        return {"intent_mix": ",".join(f"{name}={weight:g}" for name, weight in config.intent_mix)}
+
+    @app.post("/routing")
+    async def set_routing(request: Request):
+        body = await request.json()
+        if "intent_mix" in body:
+            config.intent_mix = parse_intent_mix(body["intent_mix"])
+        return await get_routing()
+
+    @app.get("/faults")
+    async def get_faults():
+        return {name: getattr(config, name) for name in FAULT_FIELDS}
+
+    @app.post("/faults")
+    async def set_faults(request: Request):
+        for name, value in (await request.json()).items():
+            if name in FAULT_FIELDS:
+                setattr(config, name, float(value))
+        return {name: getattr(config, name) for name in FAULT_FIELDS}
+
+    async def inject_fault():
+        """按配置的比例返回错误响应或挂起；不注入故障时返回 None"""
+        roll = config.rng.random()
+        if roll < config.error_rate:
+            app.state.faults["error"] += 1
+            await asyncio.sleep(config.first_token_ms / 1000 * config.rng.random())
+            status = config.rng.choice([500, 503])
+            return JSONResponse({"error": {"message": "mock upstream error"}}, status_code=status)
+        roll -= config.error_rate
+        if roll < config.rate_limit_rate:
+            app.state.faults["rate_limit"] += 1
+            return JSONResponse({"error": {"message": "rate limited"}}, status_code=429,
+                                headers={"Retry-After": f"{config.retry_after:g}"})
+        roll -= config.rate_limit_rate
+        if roll < config.hang_rate:
+            app.state.faults["hang"] += 1
+            enter()
+            try:
+                await asyncio.sleep(config.hang_seconds)
+            finally:
+                leave()
+            return JSONResponse({"error": {"message": "hung request"}}, status_code=504)
+        return None
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        app.state.requests += 1
+        fault = await inject_fault()
+        if fault is not None:
+            return fault
+        messages = payload.get("messages", [])
+        tool_calls = build_tool_call(config, payload) if payload.get("tools") else None
+        if tool_calls:
+            app.state.tool_calls[tool_calls[0]["function"]["name"]] += 1
+            reply = None
+            # 模型生成的只有函数名和参数
+            completion_tokens = sum(count_tokens(c["function"]["name"] + c["function"]["arguments"]) for c in tool_calls)
+        else:
+            reply = build_reply(config, messages)
+            completion_tokens = count_tokens(reply)
+        message = {"role": "assistant", "content": reply}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        prompt_tokens = sum(count_tokens(m.get("content") or "") for m in messages)
+        hit_tokens = min(prompt_tokens, app.state.prefix_cache.lookup_and_store(messages))
+        miss_tokens = prompt_tokens - hit_tokens
+        app.state.cache_tokens["hit"] += hit_tokens
+        app.state.cache_tokens["miss"] += miss_tokens
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens,
+                 "prompt_cache_hit_tokens": hit_tokens, "prompt_cache_miss_tokens": miss_tokens}
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = payload.get("model", "deepseek-chat")
+
+        # 工具调用只以非流式返回
+        if not payload.get("stream") or tool_calls:
+            enter()
+            try:
+                await asyncio.sleep(delay_seconds(completion_tokens, miss_tokens))
+            finally:
+                leave()
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+                "usage": usage,
+            })
+
+        async def stream():
+            enter()
+            try:
+                await asyncio.sleep(delay_seconds(0, miss_tokens))
+                step = 8
+                for start in range(0, len(reply), step):
+                    await asyncio.sleep(config.ms_per_token * step / 1000)
+                    chunk = {"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                             "choices": [{"index": 0, "delta": {"content": reply[start:start + step]}, "finish_reason": None}]}
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            finally:
+                leave()
+            final = {"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+            yield f"data: {json.dumps(final, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--first-token-ms", type=float, default=300.0, help="首 token 延迟（毫秒）")
+    parser.add_argument("--ms-per-token", type=float, default=10.0, help="每个输出 token 的生成耗时（毫秒）")
+    parser.add_argument("--prefill-ms-per-token", type=float, default=0.0,
+                        help="每个未命中前缀缓存的输入 token 的预填充耗时（毫秒）")
+    parser.add_argument("--prefix-cache-size", type=int, default=10000, help="前缀缓存保留的前缀条数")
+    parser.add_argument("--jitter", type=float, default=0.2, help="延迟的相对抖动幅度")
+    parser.add_argument("--answer-tokens", type=int, default=200, help="普通回答的长度")
+    parser.add_argument("--intent-mix", default="RAG_QA=0.7,GENERAL_QA=0.2,COURSE_MANAGEMENT=0.1")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500/503 的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 的比例")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 响应的 Retry-After（秒）")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="挂起不响应的比例")
+    parser.add_argument("--hang-seconds", type=float, default=120.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="长尾慢请求的比例")
+    parser.add_argument("--slow-factor", type=float, default=10.0, help="慢请求的延迟倍数")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    uvicorn.run(create_app(MockConfig(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import deque
+from typing import List, Dict, Tuple, Optional, Iterator, Any
+
+import numpy as np
+
+# 课程知识库默认路径
+COURSE_DATA_PATH = "D:/AIMaster/PBL/knowledge_base/course_data.json"
+# 课程条目向量缓存目录
+COURSE_VECTOR_CACHE_DIR = "course_vector_cache"
+# 语义匹配阈值（余弦相似度），高于该值直接返回结构化答案
+COURSE_SEMANTIC_THRESHOLD = 0.75
+
+
+class AhoCorasick:
+    """多模式串匹配自动机，构建一次后单次扫描即可找出文本中的全部关键词"""
+
+    def __init__(self, patterns: List[str]):
+        self.patterns = patterns
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+        for index, pattern in enumerate(patterns):
+            if pattern:
+                self._insert(pattern, index)
+        self._build_fail_links()
+
+    def _insert(self, pattern: str, index: int):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append(index)
+
+    def _build_fail_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                # 合并后缀状态的输出，匹配时无需再沿失败链回溯
+                self._output[next_state].extend(self._output[self._fail[next_state]])
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int]]:
+        """逐个产出 (起始位置, 模式串下标)"""
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for index in self._output[state]:
+                yield position - len(self.patterns[index]) + 1, index
+
+
+class CourseMatcher:
+    """
+    COURSE_INFO 关键词匹配器。
+    加载 course_data.json 时预编译自动机，文件修改后在下一次查询时自动重新加载。
+    """
+
+    def __init__(self, data_path: str = COURSE_DATA_PATH):
+        self.data_path = data_path
+        # (自动机, 关键词列表, 课程信息) 作为一个整体替换，查询时不会读到新旧混合的状态
+        self._snapshot: Tuple[AhoCorasick, List[str], Dict[str, str]] = (AhoCorasick([]), [], {})
+        self._mtime: Optional[float] = None
+        self._missing = False
+        self._lock = threading.Lock()
+        self._reload_if_changed()
+
+    @property
+    def course_info(self) -> Dict[str, str]:
+        self._reload_if_changed()
+        return self._snapshot[2]
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.stat(self.data_path).st_mtime
+        except FileNotFoundError:
+            if not self._missing:
+                logging.error("无法加载课程知识库，请检查文件路径。")
+                self._missing = True
+            return
+        self._missing = False
+
+        if mtime == self._mtime:
+            return
+
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            try:
+                with open(self.data_path, "r", encoding="utf-8") as f:
+                    course_info = json.load(f)
+            except json.JSONDecodeError as e:
+                # 保留上一版本，避免编辑到一半的文件导致知识库清空
+                logging.error(f"课程知识库格式错误，继续使用旧版本: {e}")
+                return
+            keywords = list(course_info.keys())
+            self._snapshot = (AhoCorasick(keywords), keywords, course_info)
+            self._mtime = mtime
+            logging.info(f"课程知识库已加载，共 {len(keywords)} 个关键词。")
+
+    def match_all(self, text: str) -> List[Tuple[str, str]]:
+        """返回文本中命中的全部 (关键词, 信息)，越长越具体的关键词越靠前，同长度按出现位置排序"""
+        self._reload_if_changed()
+        automaton, keywords, course_info = self._snapshot
+
+        first_seen: Dict[int, int] = {}
+        for start, index in automaton.iter_matches(text):
+            if index not in first_seen:
+                first_seen[index] = start
+        ordered = sorted(first_seen, key=lambda i: (-len(keywords[i]), first_seen[i]))
+        return [(keywords[i], course_info[keywords[i]]) for i in ordered]
+
+    def match(self, text: str) -> Optional[Tuple[str, str]]:
+        """返回最长（最具体）的命中项，没有命中时返回 None"""
+        matches = self.match_all(text)
+        return matches[0] if matches else None
+
+
+class CourseSemanticIndex:
+    """
+    course_data.json 的语义检索索引。
+    启动时将每个课程条目向量化一次并按文件哈希缓存到磁盘，
+    查询时只需嵌入问题并与归一化矩阵做一次点积。
+    """
+
+    def __init__(self, embeddings: Any, data_path: str = COURSE_DATA_PATH,
+                 cache_dir: str = COURSE_VECTOR_CACHE_DIR, threshold: float = COURSE_SEMANTIC_THRESHOLD):
+        self.embeddings = embeddings
+        self.data_path = data_path
+        self.cache_dir = cache_dir
+        self.threshold = threshold
+        # (关键词列表, 课程信息, 归一化向量矩阵)
+        self._snapshot: Tuple[List[str], Dict[str, str], np.ndarray] = ([], {}, np.zeros((0, 0), dtype=np.float32))
+        self._file_hash: Optional[str] = None
+        self._mtime: Optional[float] = None
+        self._lock = threading.Lock()
+        self._reload_if_changed()
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def _cache_path(self, file_hash: str) -> str:
+        # 不同后端（fp32 / int8 ONNX 等）即使模型路径相同，向量也不完全一致，需分开缓存
+        model_name = f"{type(self.embeddings).__name__}:{getattr(self.embeddings, 'model_name', '')}"
+        model_key = hashlib.sha256(model_name.encode()).hexdigest()[:8]
+        return os.path.join(self.cache_dir, f"course_vectors_{file_hash[:16]}_{model_key}.npy")
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.stat(self.data_path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            with open(self.data_path, "rb") as f:
+                raw = f.read()
+            file_hash = hashlib.sha256(raw).hexdigest()
+            if file_hash == self._file_hash:
+                self._mtime = mtime
+                return
+            try:
+                course_info = json.loads(raw.decode("utf-8"))
+            except json.JSONDecodeError as e:
+                logging.error(f"课程知识库格式错误，语义索引继续使用旧版本: {e}")
+                return
+
+            keywords = list(course_info.keys())
+            cache_path = self._cache_path(file_hash)
+            matrix = None
+            if os.path.exists(cache_path):
+                matrix = np.load(cache_path)
+                if matrix.shape[0] != len(keywords):
+                    matrix = None
+            if matrix is None and not keywords:
+                # 课程知识库为空：没有可匹配的条目，search 直接返回空结果
+                matrix = np.zeros((0, 0), dtype=np.float32)
+            elif matrix is None:
+                texts = [f"{keyword}: {course_info[keyword]}" for keyword in keywords]
+                vectors = self.embeddings.embed_documents(texts)
+                matrix = self._normalize(np.asarray(vectors, dtype=np.float32).reshape(len(keywords), -1))
+                os.makedirs(self.cache_dir, exist_ok=True)
+                np.save(cache_path, matrix)
+                logging.info(f"课程条目向量已生成并缓存: {cache_path}")
+
+            self._snapshot = (keywords, course_info, matrix)
+            self._file_hash = file_hash
+            self._mtime = mtime
+
+    def search(self, query: str, k: int = 1) -> List[Tuple[str, str, float]]:
+        """返回相似度最高的 k 个 (关键词, 信息, 相似度)"""
+        self._reload_if_changed()
+        keywords, course_info, matrix = self._snapshot
+        if not keywords:
+            return []
+        query_vector = self._normalize(np.asarray(self.embeddings.embed_query(query), dtype=np.float32))
+        scores = matrix @ query_vector
+        k = min(k, len(keywords))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(keywords[i], course_info[keywords[i]], float(scores[i])) for i in top]
+
+    def lookup(self, query: str) -> Optional[Tuple[str, str, float]]:
+        """相似度高于阈值时返回最佳条目，否则返回 None"""
+        results = self.search(query, k=1)
+        if results and results[0][2] >= self.threshold:
+            return results[0]
+        return None
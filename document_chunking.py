@@ -0,0 +1,316 @@
+import os
+import re
+import logging
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Callable
+
+import nbformat
+from docx import Document as DocxDocument
+from PyPDF2 import PdfReader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+# 分块策略：
+#   structured - 按文档结构分块（ipynb 按单元格、md/docx 按标题、pdf 按页），默认
+#   recursive  - 旧版：整篇文本拼成一个字符串后按 1024 字符递归切分
+CHUNKING_STRATEGY = os.getenv("CHUNKING_STRATEGY", "structured")
+# 单个文档块的最大 token 数；BGE 最长输入 512 token（含特殊符号），超出部分会被截断而不参与向量化
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "480"))
+# 超长单元（页、章节、单元格）内部切分时的重叠 token 数；不同结构单元之间不重叠
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "48"))
+# 计算 token 数使用的分词器路径，为空时使用近似估计（中文按字、英文按词）
+CHUNK_TOKENIZER = os.getenv("CHUNK_TOKENIZER", "")
+
+UNSUPPORTED_TEXT = "暂不支持该类型文件"
+
+_TOKEN_PATTERN = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]|[A-Za-z]+|\d+|\S")
+_MD_HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+_DOCX_HEADING_PATTERN = re.compile(r"^(?:Heading|标题)\s*(\d+)$", re.IGNORECASE)
+
+_tokenizer = None
+
+
+def _approx_token_count(text: str) -> int:
+    # 与 BERT 类中文分词器接近：每个汉字一个 token，长英文单词和数字会被切成多个子词
+    count = 0
+    for token in _TOKEN_PATTERN.findall(text):
+        if token[0].isascii() and token[0].isalpha():
+            count += 1 + len(token) // 8
+        elif token[0].isdigit():
+            count += 1 + len(token) // 3
+        else:
+            count += 1
+    return count
+
+
+def count_tokens(text: str) -> int:
+    global _tokenizer
+    if not CHUNK_TOKENIZER:
+        return _approx_token_count(text)
+    if _tokenizer is None:
+        from transformers import AutoTokenizer
+        _tokenizer = AutoTokenizer.from_pretrained(CHUNK_TOKENIZER)
+    return len(_tokenizer.encode(text, add_special_tokens=False))
+
+
+@dataclass
+class Section:
+    """文档的一个结构单元（页、章节或单元格），是分块的最小边界"""
+    text: str
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    # 单元所在的标题路径；与上一块的路径相同或位于其下的相邻小单元可以并入该块，None 表示不与其他单元合并
+    group: Optional[str] = None
+    code: bool = False
+
+
+def _heading_path(stack: List[str]) -> str:
+    # 跳过的标题级别在栈中留下空位，不写入路径
+    return " > ".join(p for p in stack if p)
+
+
+def _pdf_sections(file) -> List[Section]:
+    reader = PdfReader(file)
+    sections = []
+    for number, page in enumerate(reader.pages, start=1):
+        text = page.extract_text() or ""
+        if text.strip():
+            sections.append(Section(text, {"page": number}))
+    return sections
+
+
+def _heading_sections(blocks: List[tuple]) -> List[Section]:
+    """
+    blocks 为 (标题级别, 原文, 标题文字) 序列，级别为 0 表示正文段落。
+    每个标题开始一个新章节，章节文本包含标题本身；小章节只会并入其上级标题开始的块，同级章节不合并。
+    """
+    sections = []
+    stack: List[str] = []
+    lines: List[str] = []
+
+    def flush():
+        text = "\n".join(lines).strip()
+        if text:
+            heading = _heading_path(stack)
+            sections.append(Section(text, {"heading": heading} if heading else {}, group=heading))
+        lines.clear()
+
+    for level, text, title in blocks:
+        if level:
+            flush()
+            del stack[level - 1:]
+            stack.extend([""] * (level - 1 - len(stack)))
+            stack.append(title.strip())
+        lines.append(text)
+    flush()
+    return sections
+
+
+def _markdown_sections(text: str) -> List[Section]:
+    blocks = []
+    in_fence = False
+    for line in text.splitlines():
+        if line.lstrip().startswith(("```", "~~~")):
+            in_fence = not in_fence
+        match = None if in_fence else _MD_HEADING_PATTERN.match(line)
+        blocks.append((len(match.group(1)), line, match.group(2)) if match else (0, line, ""))
+    return _heading_sections(blocks)
+
+
+def _docx_sections(file) -> List[Section]:
+    doc = DocxDocument(file)
+    blocks = []
+    for para in doc.paragraphs:
+        style = para.style.name if para.style is not None else ""
+        match = _DOCX_HEADING_PATTERN.match(style.strip())
+        if match and para.text.strip():
+            blocks.append((min(int(match.group(1)), 6), para.text, para.text))
+        elif style.strip().lower() == "title" and para.text.strip():
+            blocks.append((1, para.text, para.text))
+        else:
+            blocks.append((0, para.text, ""))
+    return _heading_sections(blocks)
+
+
+def _notebook_sections(file) -> List[Section]:
+    nb = nbformat.read(file, as_version=4)
+    sections = []
+    stack: List[str] = []
+    for index, cell in enumerate(nb.cells):
+        if cell.cell_type not in ("markdown", "code") or not cell.source.strip():
+            continue
+        if cell.cell_type == "markdown":
+            for line in cell.source.splitlines():
+                match = _MD_HEADING_PATTERN.match(line)
+                if match:
+                    level = len(match.group(1))
+                    del stack[level - 1:]
+                    stack.extend([""] * (level - 1 - len(stack)))
+                    stack.append(match.group(2))
+        metadata = {"cell_start": index, "cell_end": index, "cell_type": cell.cell_type}
+        if stack:
+            metadata["heading"] = _heading_path(stack)
+        # 同一标题下的相邻单元格可以合并
+        sections.append(Section(cell.source, metadata, group=_heading_path(stack),
+                                code=cell.cell_type == "code"))
+    return sections
+
+
+def extract_sections(file) -> List[Section]:
+    """按文件类型解析出结构单元；不支持的格式返回空列表"""
+    filename = file.name.lower()
+    file.seek(0)
+    try:
+        if filename.endswith('.pdf'):
+            return _pdf_sections(file)
+        elif filename.endswith('.docx'):
+            return _docx_sections(file)
+        elif filename.endswith('.md'):
+            return _markdown_sections(file.read().decode('utf-8'))
+        elif filename.endswith('.txt'):
+            text = file.read().decode('utf-8')
+            return [Section(text, group="")] if text.strip() else []
+        elif filename.endswith('.ipynb'):
+            return _notebook_sections(file)
+        return []
+    except Exception as e:
+        print(f"文件解析错误: {e}")
+        return []
+
+
+def extract_text(file) -> str:
+    """把文件内容拼成单个字符串（旧版 recursive 分块使用）"""
+    filename = file.name.lower()
+    file.seek(0)
+    try:
+        if filename.endswith('.pdf'):
+            reader = PdfReader(file)
+            return "\n".join([page.extract_text() or "" for page in reader.pages])
+        elif filename.endswith('.docx'):
+            doc = DocxDocument(file)
+            return "\n".join([para.text for para in doc.paragraphs])
+        elif filename.endswith('.txt') or filename.endswith('.md'):
+            return file.read().decode('utf-8')
+        elif filename.endswith('.ipynb'):
+            nb = nbformat.read(file, as_version=4)
+            texts = []
+            for cell in nb.cells:
+                if cell.cell_type in ['markdown', 'code']:
+                    texts.append(cell.source)
+            return "\n".join(texts)
+        else:
+            return UNSUPPORTED_TEXT
+    except Exception as e:
+        print(f"文件解析错误: {e}")
+        return ""
+
+
+def _within_group(group: Optional[str], parent: Optional[str]) -> bool:
+    """
+    group 是否与 parent 相同或位于 parent 之下。空路径（第一个标题之前的内容、txt 全文）只与空路径匹配，
+    不是所有标题的上级，不同一级标题下的章节不会合并
+    """
+    if group is None or parent is None:
+        return False
+    if not parent:
+        return not group
+    return group == parent or group.startswith(parent + " > ")
+
+
+def _merge_metadata(first: Dict[str, Any], second: Dict[str, Any]) -> Dict[str, Any]:
+    merged = dict(first)
+    if "cell_end" in second:
+        merged["cell_end"] = second["cell_end"]
+        if merged.get("cell_type") != second.get("cell_type"):
+            merged["cell_type"] = "mixed"
+    if merged.get("heading") != second.get("heading"):
+        # 合并了多个章节时，用共同的上级标题表示
+        common = []
+        for a, b in zip(merged.get("heading", "").split(" > "), second.get("heading", "").split(" > ")):
+            if a != b:
+                break
+            common.append(a)
+        if any(common):
+            merged["heading"] = _heading_path(common)
+        else:
+            merged.pop("heading", None)
+    return merged
+
+
+class StructuredChunker:
+    """按结构单元分块：小单元在同组内合并，超过 token 上限的单元在内部递归切分"""
+
+    def __init__(self, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                 length_function: Callable[[str], int] = count_tokens):
+        self.max_tokens = max_tokens
+        self.length_function = length_function
+        self.text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=max_tokens, chunk_overlap=overlap_tokens, length_function=length_function,
+            separators=["\n\n", "\n", "。", "！", "？", "；", ". ", " ", ""], keep_separator="end",
+        )
+        self.code_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=max_tokens, chunk_overlap=overlap_tokens, length_function=length_function,
+            separators=["\nclass ", "\ndef ", "\n\n", "\n", " ", ""],
+        )
+
+    def _pack(self, sections: List[Section]) -> List[Section]:
+        packed: List[Section] = []
+        packed_tokens: List[int] = []
+        for section in sections:
+            tokens = self.length_function(section.text)
+            if packed:
+                last = packed[-1]
+                if _within_group(section.group, last.group) and packed_tokens[-1] + tokens <= self.max_tokens:
+                    packed[-1] = Section(last.text + "\n\n" + section.text,
+                                         _merge_metadata(last.metadata, section.metadata),
+                                         group=last.group, code=last.code and section.code)
+                    packed_tokens[-1] = self.length_function(packed[-1].text)
+                    continue
+            packed.append(section)
+            packed_tokens.append(tokens)
+        return packed
+
+    def split_sections(self, sections: List[Section]) -> List[Document]:
+        docs = []
+        for section in self._pack(sections):
+            if self.length_function(section.text) <= self.max_tokens:
+                pieces = [section.text]
+            else:
+                splitter = self.code_splitter if section.code else self.text_splitter
+                pieces = splitter.split_text(section.text)
+            for piece in pieces:
+                if piece.strip():
+                    docs.append(Document(page_content=piece.strip(), metadata=dict(section.metadata)))
+        return docs
+
+
+_structured_chunker: Optional[StructuredChunker] = None
+# 旧版分块器，只创建一次，供 recursive 策略和评测对比使用
+_recursive_splitter = RecursiveCharacterTextSplitter(chunk_size=1024, chunk_overlap=128)
+
+
+def get_structured_chunker() -> StructuredChunker:
+    global _structured_chunker
+    if _structured_chunker is None:
+        _structured_chunker = StructuredChunker()
+    return _structured_chunker
+
+
+def chunk_file(file, strategy: str = CHUNKING_STRATEGY) -> List[Document]:
+    """把上传的文件切分为文档块，metadata 中包含 source 以及页码 / 单元格 / 标题等位置信息"""
+    source = os.path.basename(file.name)
+    if strategy == "recursive":
+        text = extract_text(file)
+        if not text or UNSUPPORTED_TEXT in text:
+            return []
+        docs = _recursive_splitter.create_documents([text])
+    elif strategy == "structured":
+        docs = get_structured_chunker().split_sections(extract_sections(file))
+    else:
+        raise ValueError(f"未知的分块策略: {strategy}")
+
+    for index, doc in enumerate(docs):
+        doc.metadata["source"] = source
+        doc.metadata["chunk_index"] = index
+    if not docs:
+        logging.info(f"文件 '{source}' 没有可分块的内容")
+    return docs
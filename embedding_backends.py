@@ -0,0 +1,206 @@
+import os
+import re
+import zlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any
+
+from langchain_core.embeddings import Embeddings
+from model_registry import registry
+from tracing import span, set_span_attributes
+
+# 可选的 embedding 后端：
+#   torch - HuggingFaceBgeEmbeddings 加载完整 fp32 模型（默认）
+#   onnx  - ONNX Runtime + int8 动态量化，适合纯CPU部署
+#   small - 体积更小的蒸馏模型（bge-small-zh），仍走 PyTorch
+#   hashing - 字符 n-gram 哈希向量，不加载任何模型，只用于离线压测和流程检查
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_MODEL_PATH = "C:\\Users\\hlw20\\bge-large-zh-v1.5-local"
+SMALL_EMBEDDING_MODEL_PATH = os.getenv("SMALL_EMBEDDING_MODEL_PATH", "BAAI/bge-small-zh-v1.5")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "bge-large-zh-onnx")
+HASHING_EMBEDDING_DIM = int(os.getenv("HASHING_EMBEDDING_DIM", "512"))
+# 查询向量 LRU 缓存容量
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+
+# 与 HuggingFaceBgeEmbeddings 对中文模型使用的查询指令保持一致，保证各后端检索结果可比
+BGE_QUERY_INSTRUCTION_ZH = "为这个句子生成表示以用于检索相关文章："
+
+
+class OnnxBgeEmbeddings(Embeddings):
+    """
+    基于 ONNX Runtime 的 BGE embedding，接口与 HuggingFaceBgeEmbeddings 一致。
+    首次使用时从原始模型导出 ONNX 并做 int8 动态量化，结果缓存在 onnx_dir 中。
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_PATH, onnx_dir: str = ONNX_MODEL_DIR,
+                 quantize: bool = True, batch_size: int = 32, max_length: int = 512,
+                 query_instruction: str = BGE_QUERY_INSTRUCTION_ZH):
+        onnxruntime = registry.timed_import("onnxruntime")
+        AutoTokenizer = registry.timed_import("transformers").AutoTokenizer
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.query_instruction = query_instruction
+
+        model_path = self._prepare_model(model_name, onnx_dir, quantize)
+        self.tokenizer = AutoTokenizer.from_pretrained(onnx_dir)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+    @staticmethod
+    def _prepare_model(model_name: str, onnx_dir: str, quantize: bool) -> str:
+        fp32_path = os.path.join(onnx_dir, "model.onnx")
+        int8_path = os.path.join(onnx_dir, "model_int8.onnx")
+        if not os.path.exists(fp32_path):
+            from optimum.onnxruntime import ORTModelForFeatureExtraction
+            from transformers import AutoTokenizer
+            logging.info(f"正在导出 ONNX 模型到 {onnx_dir} ...")
+            ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(onnx_dir)
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(onnx_dir)
+        if not quantize:
+            return fp32_path
+        if not os.path.exists(int8_path):
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            logging.info("正在对 ONNX 模型进行 int8 动态量化...")
+            quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        return int8_path
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        import numpy as np
+
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            encoded = self.tokenizer(batch, padding=True, truncation=True,
+                                     max_length=self.max_length, return_tensors="np")
+            inputs = {name: value for name, value in encoded.items() if name in self._input_names}
+            last_hidden_state = self.session.run(None, inputs)[0]
+            # BGE 使用 [CLS] 向量并做 L2 归一化
+            cls = last_hidden_state[:, 0]
+            cls = cls / np.linalg.norm(cls, axis=1, keepdims=True)
+            vectors.extend(cls.tolist())
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        texts = [t.replace("\n", " ") for t in texts]
+        return self._embed(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([self.query_instruction + text.replace("\n", " ")])[0]
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    把字符一元组和二元组哈希到固定维度并做 L2 归一化。
+    没有语义能力，但速度快、结果确定，用于在没有模型的环境中压测整条链路。
+    """
+
+    def __init__(self, dim: int = HASHING_EMBEDDING_DIM):
+        self.dim = dim
+        self.model_name = f"hashing-{dim}"
+
+    def _embed(self, text: str) -> List[float]:
+        import numpy as np
+
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for n in (1, 2):
+            for i in range(len(text) - n + 1):
+                vector[zlib.crc32(text[i:i + n].encode("utf-8")) % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def create_embeddings(backend: str = EMBEDDING_BACKEND) -> Embeddings:
+    """按配置创建 embedding 后端，所有后端都实现 embed_documents / embed_query"""
+    if backend == "onnx":
+        return OnnxBgeEmbeddings()
+    if backend == "hashing":
+        return HashingEmbeddings()
+
+    # langchain 的 embeddings 会连带导入 torch / sentence_transformers
+    HuggingFaceBgeEmbeddings = registry.timed_import("langchain.embeddings").HuggingFaceBgeEmbeddings
+    if backend == "small":
+        model_name = SMALL_EMBEDDING_MODEL_PATH
+    elif backend == "torch":
+        model_name = EMBEDDING_MODEL_PATH
+    else:
+        raise ValueError(f"未知的 embedding 后端: {backend}")
+    return HuggingFaceBgeEmbeddings(
+        model_name=model_name,
+        model_kwargs={"device": "cpu"}
+    )
+
+
+def normalize_query(text: str) -> str:
+    """查询归一化：去掉首尾空白并合并连续空白，作为缓存键"""
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    在任意 embedding 后端外包一层查询向量 LRU 缓存。
+    embed_documents 直接透传；embed_query 按归一化后的查询命中缓存，
+    检索、课程语义索引等组件共享同一个实例即可共享缓存。
+    """
+
+    def __init__(self, embeddings: Embeddings, max_size: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self.embeddings = embeddings
+        self.max_size = max_size
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        # model_name 等属性透传给底层后端
+        if name == "embeddings":
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = normalize_query(text)
+        with span("embed_query"):
+            with self._lock:
+                vector = self._cache.get(key)
+                if vector is not None:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    set_span_attributes(cache_hit=True)
+                    return list(vector)
+                self.misses += 1
+
+            set_span_attributes(cache_hit=False)
+            vector = self.embeddings.embed_query(key)
+            self._store(key, vector)
+            return list(vector)
+
+    def _store(self, key: str, vector: List[float]):
+        with self._lock:
+            self._cache[key] = vector
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._cache),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
@@ -8,12 +8,13 @@ from typing import List, Any, Dict, Tuple, Optional
 import mimetypes
 from collections import defaultdict
 import pandas as pd
+from backend_client import BackendClient
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # FastAPI 后端 URL
-API_URL = "http://127.0.0.1:8000"
+API_URL = os.getenv("API_URL", "http://127.0.0.1:8000")
 
 MAX_FILE_SIZE_MB = 3
 ALLOWED_FILE_TYPES = ['.pdf', '.docx', '.txt', '.md', '.ipynb']
@@ -23,57 +24,104 @@ CUSTOM_MIME_TYPES = {
     '.md': 'text/markdown',
 }
 
-# 全局状态变量
-current_session_id_state = None
-all_sessions_cache = {}
+# 队列并发：每个事件同时处理的请求数上限、排队请求数上限（超出时直接提示繁忙），
+# 以及执行同步处理函数的线程数（应不小于消息事件的并发上限）
+FRONTEND_CONCURRENCY_LIMIT = int(os.getenv("FRONTEND_CONCURRENCY_LIMIT", "64"))
+FRONTEND_QUEUE_MAX_SIZE = int(os.getenv("FRONTEND_QUEUE_MAX_SIZE", "1024"))
+FRONTEND_MAX_THREADS = int(os.getenv("FRONTEND_MAX_THREADS", "160"))
+FRONTEND_PORT = int(os.getenv("FRONTEND_PORT", "7860"))
 
-# 用户管理认证
-access_token: Optional[str] = None
-current_user_role: Optional[str] = None
-current_username: Optional[str] = None
+# 所有处理函数共用的后端客户端（连接池、超时、重试），每个处理线程最多占用一个连接
+backend = BackendClient(API_URL, pool_size=FRONTEND_MAX_THREADS)
+
+def new_user_state() -> Dict[str, Any]:
+    """
+    每个浏览器会话独立的用户状态，保存在 gr.State 中（不能用模块全局变量，否则多名用户会互相覆盖登录信息）：
+    - access_token / role / username: 登录信息
+    - sessions: 会话 ID -> 会话信息，用于按标题查找会话
+    - session_versions: 会话 ID -> 当前界面显示内容对应的会话版本，发送消息时据此只接收新增消息
+    """
+    return {"access_token": None, "role": None, "username": None, "sessions": {}, "session_versions": {}}
+
+def auth_headers(user_state: Dict[str, Any]) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {user_state['access_token']}"}
 
 def get_content_type(filename):
     """根据文件名获取 MIME 类型"""
     ext = os.path.splitext(filename)[1].lower()
     return CUSTOM_MIME_TYPES.get(ext, mimetypes.guess_type(filename)[0] or 'application/octet-stream')
 
-def login_handler(username, password):
-    """处理用户登录"""
-    global access_token, current_user_role, current_username
+def format_citation_location(citation: Dict[str, Any]) -> str:
+    """把页码 / 单元格 / 标题拼成简短的位置描述"""
+    parts = []
+    if citation.get("page") is not None:
+        parts.append(f"第{citation['page']}页")
+    if citation.get("cell_start") is not None:
+        start, end = citation["cell_start"], citation.get("cell_end", citation["cell_start"])
+        parts.append(f"单元格 {start}" if start == end else f"单元格 {start}-{end}")
+    if citation.get("heading"):
+        parts.append(citation["heading"])
+    return "，".join(parts)
+
+def format_history_for_display(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """把后端消息转换为 Chatbot 显示格式，带引用来源的回答后追加一个可折叠的来源列表"""
+    display = []
+    for message in messages:
+        display.append({"role": message["role"], "content": message["content"]})
+        citations = message.get("citations")
+        if not citations:
+            continue
+        lines = []
+        for i, citation in enumerate(citations, start=1):
+            location = format_citation_location(citation)
+            header = f"{i}. **{citation['source']}**"
+            if location:
+                header += f"（{location}）"
+            if citation.get("score") is not None:
+                header += f"，相关度 {citation['score']:.2f}"
+            snippet = citation.get("snippet", "").replace("\n", " ")[:120]
+            lines.append(f"{header}  \n   > {snippet}")
+        retrieval_ms = citations[0].get("retrieval_ms")
+        title = f"📚 参考来源（{len(citations)}）" + (f" · 检索 {retrieval_ms:.0f} ms" if retrieval_ms is not None else "")
+        display.append({"role": "assistant", "content": "\n".join(lines), "metadata": {"title": title}})
+    return display
+
+def login_handler(username, password, user_state: Dict[str, Any]):
+    """处理用户登录，登录信息只写入当前浏览器会话的 user_state"""
+    login_failed = (gr.update(visible=True), gr.update(visible=False), gr.update(visible=False), user_state)
     try:
-        response = requests.post(f"{API_URL}/login", data={"username": username, "password": password})
+        response = backend.post("/login", data={"username": username, "password": password})
         response.raise_for_status()
 
         token_data = response.json()
-        access_token = token_data['access_token']
-        current_username = username
+        user_state = dict(new_user_state(), access_token=token_data['access_token'], username=username)
 
         # 获取用户信息以确定角色
-        user_response = requests.get(f"{API_URL}/me", headers={"Authorization": f"Bearer {access_token}"})
+        user_response = backend.get("/me", headers=auth_headers(user_state))
         user_response.raise_for_status()
         user_data = user_response.json()
-        current_user_role = user_data['role']
+        user_state["role"] = user_data['role']
 
         gr.Info(f"登陆成功！欢迎, {username}!")
 
         # 登录成功后，根据角色返回界面状态
-        if current_user_role == 'admin':
+        if user_state["role"] == 'admin':
             # 隐藏主界面，仅显示管理员界面
-            return gr.update(visible=False), gr.update(visible=False), gr.update(visible=True)
+            return gr.update(visible=False), gr.update(visible=False), gr.update(visible=True), user_state
         else:
             # 普通用户显示主界面
-            return gr.update(visible=False), gr.update(visible=True), gr.update(visible=False)
+            return gr.update(visible=False), gr.update(visible=True), gr.update(visible=False), user_state
     
     except requests.exceptions.HTTPError as e:
         error_detail = e.response.json().get("detail", "未知错误")
         gr.Warning(f"登陆失败: {error_detail}")
-        return gr.update(visible=True), gr.update(visible=False)
+        return login_failed
     except requests.exceptions.RequestException as e:
         gr.Warning(f"无法连接到后端服务: {e}")
-        return gr.update(visible=True), gr.update(visible=False)
+        return login_failed
     except Exception as e:
         gr.Warning(f"登陆失败: {e}")
-        return gr.update(visible=True), gr.update(visible=False)
+        return login_failed
 
 def register_handler(username, password, confirm_password):
     """处理用户注册，并返回界面更新命令"""
@@ -81,7 +129,7 @@ def register_handler(username, password, confirm_password):
         gr.Warning("两次输入的密码不一致！")
         return gr.update(visible=True) # 注册失败，保持表单可见
     try:
-        response = requests.post(f"{API_URL}/register", data={"username": username, "password": password})
+        response = backend.post("/register", data={"username": username, "password": password})
         response.raise_for_status()
 
         # 注册成功
@@ -98,20 +146,19 @@ def register_handler(username, password, confirm_password):
         gr.Warning(f"注册失败: {e}")
         return gr.update(visible=True) # 注册失败，保持表单可见
 
-def get_session_lists():
-    """从API获取当前用户的所有会话，并按时间分组"""
-    global all_sessions_cache, access_token
-    if not access_token:
+def get_session_lists(user_state: Dict[str, Any]):
+    """从API获取当前用户的所有会话，并按时间分组；会话信息缓存在 user_state["sessions"] 中"""
+    if not user_state.get("access_token"):
         return [], [], []
     try:
-        response = requests.get(
-            f"{API_URL}/sessions",
-            headers={"Authorization": f"Bearer {access_token}"}
+        response = backend.get(
+            "/sessions",
+            headers=auth_headers(user_state)
         )
         response.raise_for_status()
         sessions = response.json()
         
-        all_sessions_cache = {s['id']: s for s in sessions}
+        user_state["sessions"] = {s['id']: s for s in sessions}
 
         today = datetime.datetime.now().date()
         yesterday = today - datetime.timedelta(days=1)
@@ -140,23 +187,22 @@ def get_session_lists():
         print(f"无法连接到后端API: {e}")
         return [], [], []
 
-def create_new_session_handler():
+def create_new_session_handler(user_state: Dict[str, Any]):
     """通过API创建新会话，并清空所有状态"""
-    global current_session_id_state, access_token
-    if not access_token:
+    if not user_state.get("access_token"):
         gr.Warning("请先登录！")
-        return None, [], "#### 已上传文件: \n- 暂无文件", gr.update(value="请先登录"), [], None, None, None, None
+        return None, [], "#### 已上传文件: \n- 暂无文件", gr.update(value="请先登录"), [], None, None, None, None, user_state
     
     try:
-        response = requests.post(
-            f"{API_URL}/sessions/new",
-            headers={"Authorization": f"Bearer {access_token}"}
+        response = backend.post(
+            "/sessions/new",
+            headers=auth_headers(user_state)
         )
         response.raise_for_status()
         new_session = response.json()
-        current_session_id_state = new_session['id']
+        user_state["session_versions"][new_session['id']] = new_session.get('version', 0)
         
-        today_sessions, yesterday_sessions, older_sessions = get_session_lists()
+        today_sessions, yesterday_sessions, older_sessions = get_session_lists(user_state)
         
         # 确保新会话标题在选项列表中
         today_choices = [s[0] for s in today_sessions]
@@ -173,34 +219,34 @@ def create_new_session_handler():
             gr.update(choices=[s[0] for s in yesterday_sessions]),
             gr.update(choices=[s[0] for s in older_sessions]),
             gr.update(visible=False, choices=[], value=None), # 清空并隐藏推荐问题
+            user_state,
         )
     except requests.exceptions.RequestException as e:
         print(f"创建新会话失败: {e}")
         gr.Warning(f"创建新会话失败: {e}")
-        return None, [], "#### 已上传文件: \n- 暂无文件", gr.update(value="创建新会话失败"), [], None, None, None, None
+        return None, [], "#### 已上传文件: \n- 暂无文件", gr.update(value="创建新会话失败"), [], None, None, None, None, user_state
 
-def select_session_handler(session_name: str):
+def select_session_handler(session_name: str, current_session_id: Optional[str], user_state: Dict[str, Any]):
     """通过API切换到选定的会话，并加载其历史记录"""
-    global current_session_id_state, all_sessions_cache, access_token
-    if not access_token:
+    if not user_state.get("access_token"):
         gr.Warning("请先登录！")
-        return current_session_id_state, [], "#### 已上传文件: \n- 暂无文件", gr.update(value="会话加载失败"), [], gr.update(visible=False, choices=[], value=None)
+        return current_session_id, [], "#### 已上传文件: \n- 暂无文件", gr.update(value="会话加载失败"), [], gr.update(visible=False, choices=[], value=None), user_state
     
     session_id = None
-    for sid, data in all_sessions_cache.items():
+    for sid, data in user_state["sessions"].items():
         if data.get("title") == session_name:
             session_id = sid
             break
     
     if not session_id:
         gr.Warning("会话加载失败，找不到匹配的ID。")
-        return current_session_id_state, [], "#### 已上传文件: \n- 暂无文件", gr.update(value="会话加载失败"), [], gr.update(visible=False, choices=[], value=None)
+        return current_session_id, [], "#### 已上传文件: \n- 暂无文件", gr.update(value="会话加载失败"), [], gr.update(visible=False, choices=[], value=None), user_state
 
     try:
-        response = requests.get(f"{API_URL}/sessions/{session_id}", headers={"Authorization": f"Bearer {access_token}"})
+        response = backend.get(f"/sessions/{session_id}", headers=auth_headers(user_state))
         response.raise_for_status()
         session_data = response.json()
-        current_session_id_state = session_id
+        user_state["session_versions"][session_id] = session_data.get('version', 0)
 
         # 构造已上传文件的Markdown字符串
         uploaded_files = session_data.get("files", [])
@@ -208,21 +254,21 @@ def select_session_handler(session_name: str):
         
         return (
             session_id,
-            session_data['messages'],
+            format_history_for_display(session_data['messages']),
             uploaded_files_md_str,
             gr.update(value=f"当前会话: {session_data['title']}"),
             uploaded_files,
             gr.update(visible=False, choices=[], value=None), # 切换会话时隐藏推荐问题
+            user_state,
         )
     except requests.exceptions.RequestException as e:
         print(f"加载会话失败: {e}")
         gr.Warning("加载会话失败，请检查后端服务。")
-        return current_session_id_state, [], "#### 已上传文件: \n- 暂无文件", gr.update(value="会话加载失败"), [], gr.update(visible=False, choices=[], value=None)
+        return current_session_id, [], "#### 已上传文件: \n- 暂无文件", gr.update(value="会话加载失败"), [], gr.update(visible=False, choices=[], value=None), user_state
 
-def handle_file_upload_handler(files: List[Any], session_id: str):
+def handle_file_upload_handler(files: List[Any], session_id: str, user_state: Dict[str, Any]):
     """通过API上传文件并更新知识库"""
-    global access_token
-    if not access_token:
+    if not user_state.get("access_token"):
         gr.Warning("请先登录！")
         return "请先登录", [], "#### 已上传文件: \n- 暂无文件"
     
@@ -243,10 +289,11 @@ def handle_file_upload_handler(files: List[Any], session_id: str):
                 content_type = get_content_type(filename)
                 files_to_upload.append(('files', (filename, file_handle.read(), content_type)))
         
-        response = requests.post(
-            f"{API_URL}/sessions/{session_id}/files",
+        response = backend.post(
+            f"/sessions/{session_id}/files",
             files=files_to_upload,
-            headers={"Authorization": f"Bearer {access_token}"}
+            headers=auth_headers(user_state),
+            long=True
         )
         response.raise_for_status()
         
@@ -265,57 +312,81 @@ def handle_file_upload_handler(files: List[Any], session_id: str):
         gr.Warning(f"文件上传处理异常: {e}")
         return f"文件上传处理异常: {e}", [], "#### 已上传文件：\n- 暂无文件"
 
-def process_message_handler(message: str, history: List[Dict[str, str]], session_id: str):
+def process_message_handler(message: str, history: List[Dict[str, str]], session_id: str, user_state: Dict[str, Any]):
     """处理用户消息，返回AI回答。"""
-    global access_token
-    if not access_token:
+    if not user_state.get("access_token"):
         error_msg = "请先登录！"
-        yield history + [{"role": "user", "content": message}], error_msg, gr.update(visible=False, choices=[], value=None)
+        yield history + [{"role": "user", "content": message}], error_msg, gr.update(visible=False, choices=[], value=None), user_state
         return
     
     if not session_id:
         error_msg = "请先创建一个新会话或选择一个会话。"
-        yield history + [{"role": "user", "content": message}], error_msg, gr.update(visible=False, choices=[], value=None)
+        yield history + [{"role": "user", "content": message}], error_msg, gr.update(visible=False, choices=[], value=None), user_state
         return
 
     if not message.strip():
-        yield history, "", gr.update(visible=False, choices=[], value=None)
+        yield history, "", gr.update(visible=False, choices=[], value=None), user_state
         return
     
     # 将用户新消息添加到历史记录中
     history = history + [{"role": "user", "content": message}]
     
     # 在前端即时显示用户消息
-    yield history, "", gr.update(visible=False, choices=[], value=None)
+    yield history, "", gr.update(visible=False, choices=[], value=None), user_state
     
     try:
-        payload = {"message": message, "session_id": session_id}
-        response = requests.post(
-            f"{API_URL}/sessions/{session_id}/message",
+        # 带上当前显示内容对应的会话版本，版本一致时后端只返回本轮新增的消息
+        session_versions = user_state.setdefault("session_versions", {})
+        payload = {"message": message, "session_id": session_id, "base_version": session_versions.get(session_id)}
+        response = backend.post(
+            f"/sessions/{session_id}/message",
             json=payload,
-            headers={"Authorization": f"Bearer {access_token}"}
+            headers=auth_headers(user_state),
+            long=True
         )
         response.raise_for_status()
         
         response_data = response.json()
         recommended_questions = response_data.get('recommended_questions', [])
-        
-        # 将后端返回的字典列表转换为 Gradio 的元组列表
-        yield response_data['history'], "", gr.update(visible=True, choices=recommended_questions, value=None)
+        session_versions[session_id] = response_data['version']
+        if response_data.get('degraded'):
+            gr.Info("今日提问额度已用完，回答将不再提供推荐问题，参考资料也会更少。")
+
+        if response_data.get('history') is not None:
+            # 本地版本与后端不一致（如在其他页面中发过消息），用完整历史重新渲染
+            display = format_history_for_display(response_data['history'])
+        else:
+            # 用户消息已在本地显示，只追加新的助手回答
+            new_replies = [m for m in response_data['new_messages'] if m['role'] != 'user']
+            display = history + format_history_for_display(new_replies)
+        yield display, "", gr.update(visible=True, choices=recommended_questions, value=None), user_state
     
+    except requests.exceptions.Timeout as e:
+        print(f"消息处理超时: {e}")
+        error_msg = "后端响应超时，请稍后再试。"
+        history.append({"role": "assistant", "content": error_msg})
+        gr.Warning(error_msg)
+        yield history, "", gr.update(visible=False, choices=[], value=None), user_state
     except requests.exceptions.RequestException as e:
         print(f"消息处理失败: {e}")
-        error_msg = "对不起，消息处理失败，请稍后再试。"
+        status_code = e.response.status_code if e.response is not None else None
+        # 后端对 LLM 调用限流（429）或排队超时（503）时提示稍后再试
+        if status_code == 429:
+            error_msg = "提问过于频繁，请稍后再试。"
+        elif status_code == 503:
+            error_msg = "当前提问人数较多，请稍后再试。"
+        else:
+            error_msg = "对不起，消息处理失败，请稍后再试。"
         # 在前端历史记录中显示错误
         history.append({"role": "assistant", "content": error_msg})
         gr.Warning(error_msg)
-        yield history, "", gr.update(visible=False, choices=[], value=None)
+        yield history, "", gr.update(visible=False, choices=[], value=None), user_state
     except (KeyError, IndexError) as e:
         print(f"解析后端响应失败: {e}")
         error_msg = "后端返回了无法解析的响应。"
         history.append({"role": "assistant", "content": error_msg})
         gr.Warning(error_msg)
-        yield history, "", gr.update(visible=False, choices=[], value=None)
+        yield history, "", gr.update(visible=False, choices=[], value=None), user_state
 
 def select_recommended_question(question: str):
     """当用户点击推荐问题时，将问题填充到输入框"""
@@ -328,23 +399,26 @@ def clear_chat_handler():
     gr.Info("已清空聊天记录")
     return [], "#### 已上传文件: \n- 暂无文件", [], gr.update(visible=False, choices=[], value=None)
 
-def post_login_init_user_view():
+def post_login_init_user_view(user_state: Dict[str, Any]):
     """在登陆成功后调用， 用于初始化会话列表和界面"""
-    global current_session_id_state, access_token
+    if user_state.get("role") == 'admin':
+        # 管理员只使用管理员面板
+        return (gr.update(visible=False), [], "", "", [], gr.update(choices=[]), gr.update(choices=[]),
+                gr.update(choices=[]), None, user_state)
 
-    today_sessions, yesterday_sessions, older_sessions = get_session_lists()
+    today_sessions, yesterday_sessions, older_sessions = get_session_lists(user_state)
 
     # 如果有会话，加载最新的一个
     if today_sessions:
         session_name, session_id = today_sessions[0]
-        current_session_id_state = session_id
         try:
-            response = requests.get(
-                f"{API_URL}/sessions/{session_id}",
-                headers={"Authorization": f"Bearer {access_token}"}
+            response = backend.get(
+                f"/sessions/{session_id}",
+                headers=auth_headers(user_state)
             )
             response.raise_for_status()
             session_data = response.json()
+            user_state["session_versions"][session_id] = session_data.get('version', 0)
         except requests.exceptions.RequestException:
             session_data = {"messages": [], "title": "加载失败", "files": []}
             gr.Warning(f"加载最新会话失败。")
@@ -353,14 +427,16 @@ def post_login_init_user_view():
         uploaded_files_md_str = "#### 已上传文件: \n" + "\n".join([f"- {f}" for f in uploaded_files]) if uploaded_files else "#### 已上传文件: \n- 暂无文件"
 
         return (
-            gr.update(visible=(current_user_role == 'admin')),
-            session_data['messages'],
+            gr.update(visible=True),
+            format_history_for_display(session_data['messages']),
             uploaded_files_md_str,
             f"当前会话: {session_data['title']}",
             uploaded_files,
             gr.update(choices=[s[0] for s in today_sessions], value=session_name),
             gr.update(choices=[s[0] for s in yesterday_sessions]),
-            gr.update(choices=[s[0] for s in older_sessions])
+            gr.update(choices=[s[0] for s in older_sessions]),
+            session_id,
+            user_state,
         )
     else:
         # 如果没有对话，显示欢迎信息
@@ -372,18 +448,18 @@ def post_login_init_user_view():
             [],
             gr.update(choices=[]),
             gr.update(choices=[]),
-            gr.update(choices=[])
+            gr.update(choices=[]),
+            None,
+            user_state,
         )
 
-def get_all_users_for_admin():
+def get_all_users_for_admin(user_state: Dict[str, Any]):
     """管理员获取所有用户列表，并返回一个 Gradio DataFrame"""
-    global access_token
-    if not access_token:
-        gr.Warning("请先登录！")
+    if user_state.get("role") != 'admin':
         return pd.DataFrame()
     
     try:
-        response = requests.get(f"{API_URL}/users", headers={"Authorization": f"Bearer {access_token}"})
+        response = backend.get("/users", headers=auth_headers(user_state))
         response.raise_for_status()
         users = response.json()
         df = pd.DataFrame(users)
@@ -392,36 +468,33 @@ def get_all_users_for_admin():
         gr.Warning(f"获取用户列表失败: {e}")
         return pd.DataFrame()
     
-def update_user_role_for_admin(user_id: str, new_role: str):
+def update_user_role_for_admin(user_id: str, new_role: str, user_state: Dict[str, Any]):
     """管理员修改用户角色"""
-    global access_token
-    if not access_token:
+    if not user_state.get("access_token"):
         gr.Warning("请先登录！")
-        return get_all_users_for_admin()
+        return get_all_users_for_admin(user_state)
     
     if new_role not in ["admin", "user"]:
         gr.Warning("角色只能是 'admin' 或 'user'。")
-        return get_all_users_for_admin()
+        return get_all_users_for_admin(user_state)
     
     try:
         payload = {"user_id": user_id, "role": new_role}
-        response = requests.put(f"{API_URL}/users/role", data=payload, headers={"Authorization": f"Bearer {access_token}"})
+        response = backend.put("/users/role", data=payload, headers=auth_headers(user_state))
         response.raise_for_status()
         gr.Info(f"用户 {user_id} 的角色已更新为 {new_role}")
     except requests.exceptions.RequestException as e:
         gr.Warning(f"更新角色失败: {e}")
     
-    return get_all_users_for_admin()
+    return get_all_users_for_admin(user_state)
 
-def get_all_sessions_for_admin():
+def get_all_sessions_for_admin(user_state: Dict[str, Any]):
     """管理员获取所有用户的所有会话（用后端专用接口）"""
-    global access_token
-    if not access_token:
-        gr.Warning("请先登录！")
+    if user_state.get("role") != 'admin':
         return gr.update(choices=[]), gr.update(choices=[]), {}, gr.update(value="")
 
     try:
-        response = requests.get(f"{API_URL}/admin/sessions", headers={"Authorization": f"Bearer {access_token}"})
+        response = backend.get("/admin/sessions", headers=auth_headers(user_state))
         response.raise_for_status()
         sessions = response.json()
         # sessions: [{id, user_id, username, title, created_at}]
@@ -434,20 +507,19 @@ def get_all_sessions_for_admin():
         gr.Warning(f"获取所有会话失败: {e}")
         return gr.update(choices=[]), gr.update(choices=[]), {}, gr.update(value="加载失败")
 
-def filter_sessions_by_user(user_name: str, user_sessions: dict):
+def filter_sessions_by_user(user_name: str, user_sessions: dict, user_state: Dict[str, Any]):
     """根据选择的用户名，更新会话下拉菜单"""
     if not user_name or user_name not in user_sessions:
         return gr.update(choices=[], value=None), gr.update(value="请选择会话")
     session_titles = [s[0] for s in user_sessions[user_name]]
     if session_titles:
         # 自动选中第一个会话并自动显示聊天记录
-        return gr.update(choices=session_titles, value=session_titles[0]), get_admin_session_history(session_titles[0], user_sessions, user_name)
+        return gr.update(choices=session_titles, value=session_titles[0]), get_admin_session_history(session_titles[0], user_sessions, user_name, user_state)
     else:
         return gr.update(choices=[], value=None), gr.update(value="请选择会话")
 
-def get_admin_session_history(session_title: str, user_sessions: dict, user_name: str):
+def get_admin_session_history(session_title: str, user_sessions: dict, user_name: str, user_state: Dict[str, Any]):
     """管理员获取特定会话的聊天记录"""
-    global access_token
     
     print(f"Debug: session_title={session_title}, user_name={user_name}")
     print(f"Debug: user_sessions keys={list(user_sessions.keys())}")
@@ -467,9 +539,9 @@ def get_admin_session_history(session_title: str, user_sessions: dict, user_name
         return gr.update(value="会话ID未找到")
     
     try:
-        response = requests.get(
-            f"{API_URL}/admin/sessions/{session_id}", 
-            headers={"Authorization": f"Bearer {access_token}"}
+        response = backend.get(
+            f"/admin/sessions/{session_id}", 
+            headers=auth_headers(user_state)
         )
         response.raise_for_status()
         session_data = response.json()
@@ -697,6 +769,8 @@ def create_interface():
         }
         """
     ) as interface:
+        # 当前浏览器会话的登录信息和会话缓存，每个用户一份
+        user_state_gr = gr.State(new_user_state())
         
         # ===== 登录和注册界面 =====
         with gr.Row(visible=True, elem_classes=["login-content"]) as login_row:
@@ -716,7 +790,7 @@ def create_interface():
         
         # ===== 主聊天界面 =====
         with gr.Row(scale=8, elem_classes=["main-content"], visible=False) as main_row:
-            current_session_id_state_gr = gr.State(current_session_id_state)
+            current_session_id_state_gr = gr.State(None)
             uploaded_files_state_gr = gr.State([])
             
             with gr.Column(elem_classes=["left-panel"]):
@@ -724,21 +798,21 @@ def create_interface():
                 new_session_btn = gr.Button("新建会话", variant="primary", elem_classes=["new-session-btn"])
 
                 with gr.Column(scale=1, elem_classes=["session-list"]):
-                    today_sessions, yesterday_sessions, older_sessions = get_session_lists()
+                    # 会话列表在登录后按用户加载
                     today_radio = gr.Radio(
-                        choices=[s[0] for s in today_sessions],
+                        choices=[],
                         label="今天",
                         show_label=True,
                         elem_classes=["radio-group"]
                     )
                     yesterday_radio = gr.Radio(
-                        choices=[s[0] for s in yesterday_sessions],
+                        choices=[],
                         label="昨天",
                         show_label=True,
                         elem_classes=['radio-group']
                     )
                     older_radio = gr.Radio(
-                        choices=[s[0] for s in older_sessions],
+                        choices=[],
                         label="更早",
                         show_label=True,
                         elem_classes=['radio-group']
@@ -833,21 +907,20 @@ def create_interface():
         # ----------------- 登录/注册逻辑 -----------------
         login_btn.click(
             login_handler,
-            inputs=[login_username_input, login_password_input],
-            outputs=[login_row, main_row, admin_row]
+            inputs=[login_username_input, login_password_input, user_state_gr],
+            outputs=[login_row, main_row, admin_row, user_state_gr]
         ).then(
-            lambda: post_login_init_user_view() if current_user_role != 'admin' else (
-                gr.update(visible=False), [], "", "", [], gr.update(choices=[]), gr.update(choices=[]), gr.update(choices=[])
-            ),
-            inputs=None,
-            outputs=[main_row, chatbot_ui, uploaded_files_md, session_status, uploaded_files_state_gr, today_radio, yesterday_radio, older_radio]
+            post_login_init_user_view,
+            inputs=[user_state_gr],
+            outputs=[main_row, chatbot_ui, uploaded_files_md, session_status, uploaded_files_state_gr, today_radio, yesterday_radio, older_radio,
+                     current_session_id_state_gr, user_state_gr]
         ).then(
-            lambda: get_all_users_for_admin() if current_user_role == 'admin' else pd.DataFrame(),
-            inputs=None,
+            get_all_users_for_admin,
+            inputs=[user_state_gr],
             outputs=[users_df]
         ).then(
-            lambda: get_all_sessions_for_admin() if current_user_role == 'admin' else (gr.update(choices=[]), gr.update(choices=[]), {}, gr.update(value="")),
-            inputs=None,
+            get_all_sessions_for_admin,
+            inputs=[user_state_gr],
             outputs=[user_dropdown, session_dropdown, all_sessions_dict_state, chat_history_viewer]
         )
 
@@ -870,7 +943,7 @@ def create_interface():
         # ----------------- 主页面事件绑定 -----------------
         new_session_btn.click(
             create_new_session_handler,
-            inputs=[],
+            inputs=[user_state_gr],
             outputs=[
                 current_session_id_state_gr,
                 chatbot_ui,
@@ -881,19 +954,20 @@ def create_interface():
                 yesterday_radio,
                 older_radio,
                 recommended_questions_ui,
+                user_state_gr,
             ]
         )
         
         upload_btn.upload(
             handle_file_upload_handler,
-            inputs=[upload_btn, current_session_id_state_gr],
+            inputs=[upload_btn, current_session_id_state_gr, user_state_gr],
             outputs=[upload_status, uploaded_files_state_gr, uploaded_files_md]
         )
 
         send_btn.click(
             process_message_handler,
-            inputs=[msg_input, chatbot_ui, current_session_id_state_gr],
-            outputs=[chatbot_ui, msg_input, recommended_questions_ui]
+            inputs=[msg_input, chatbot_ui, current_session_id_state_gr, user_state_gr],
+            outputs=[chatbot_ui, msg_input, recommended_questions_ui, user_state_gr]
         )
         
         recommended_questions_ui.change(
@@ -905,8 +979,9 @@ def create_interface():
         for radio in [today_radio, yesterday_radio, older_radio]:
             radio.change(
                 select_session_handler,
-                inputs=[radio],
-                outputs=[current_session_id_state_gr, chatbot_ui, uploaded_files_md, session_status, uploaded_files_state_gr, recommended_questions_ui]
+                inputs=[radio, current_session_id_state_gr, user_state_gr],
+                outputs=[current_session_id_state_gr, chatbot_ui, uploaded_files_md, session_status, uploaded_files_state_gr, recommended_questions_ui,
+                         user_state_gr]
             )
         
         clear_btn.click(
@@ -918,38 +993,38 @@ def create_interface():
         # 管理员面板事件绑定
         refresh_users_btn.click(
             get_all_users_for_admin,
-            inputs=None,
+            inputs=[user_state_gr],
             outputs=[users_df]
         )
 
         update_role_btn.click(
             update_user_role_for_admin,
-            inputs=[user_id_input, role_input],
+            inputs=[user_id_input, role_input, user_state_gr],
             outputs=[users_df]
         )
 
         # 聊天记录管理 - 修复后的事件绑定
         refresh_sessions_btn.click(
             get_all_sessions_for_admin,
-            inputs=None,
+            inputs=[user_state_gr],
             outputs=[user_dropdown, session_dropdown, all_sessions_dict_state, chat_history_viewer]
         )
 
         user_dropdown.change(
             filter_sessions_by_user,
-            inputs=[user_dropdown, all_sessions_dict_state],
+            inputs=[user_dropdown, all_sessions_dict_state, user_state_gr],
             outputs=[session_dropdown, chat_history_viewer]
         )
 
         session_dropdown.change(
             get_admin_session_history,
-            inputs=[session_dropdown, all_sessions_dict_state, user_dropdown],
+            inputs=[session_dropdown, all_sessions_dict_state, user_dropdown, user_state_gr],
             outputs=[chat_history_viewer]
         )
 
         view_chat_btn.click(
             get_admin_session_history,
-            inputs=[session_dropdown, all_sessions_dict_state, user_dropdown],
+            inputs=[session_dropdown, all_sessions_dict_state, user_dropdown, user_state_gr],
             outputs=[chat_history_viewer]
         )
 
@@ -957,8 +1032,11 @@ def create_interface():
 
 if __name__ == "__main__":
     app = create_interface()
+    # 所有事件经队列处理：每个事件最多同时执行 FRONTEND_CONCURRENCY_LIMIT 个，其余排队
+    app.queue(default_concurrency_limit=FRONTEND_CONCURRENCY_LIMIT, max_size=FRONTEND_QUEUE_MAX_SIZE)
     app.launch(
         server_name="127.0.0.1",
-        server_port=7860,
-        share=False
+        server_port=FRONTEND_PORT,
+        share=False,
+        max_threads=FRONTEND_MAX_THREADS,
     )
\ No newline at end of file
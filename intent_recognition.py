@@ -1,6 +1,8 @@
 import re
 import json
-from RAG_system import chatbot
+from RAG_system import get_chatbot
+from llm_scheduler import LLMOverloaded
+from llm_resilience import LLMUnavailable
 
 def extract_json_from_text(text):
     """
@@ -50,7 +52,7 @@ def identify_intent(user_message: str) -> str:
     prompt = intent_prompt_template.format(user_message=user_message)
     
     try:
-        response_text = chatbot.chat(prompt, history=[])
+        response_text = get_chatbot().chat(prompt, history=[], stage="llm_intent")
         
         print(f"DEBUG: LLM的原始响应是: {response_text}")
         
@@ -65,6 +67,9 @@ def identify_intent(user_message: str) -> str:
             print("警告: 无法在LLM响应中找到有效的JSON。")
             return "GENERAL_QA"
             
+    except (LLMOverloaded, LLMUnavailable):
+        # 排队超时、限流或上游不可用时直接返回 429/503，回退到通用问答只会再排一次队
+        raise
     except Exception as e:
         print(f"意图识别失败，回退到通用问答。错误: {e}")
         return "GENERAL_QA"
\ No newline at end of file
@@ -0,0 +1,251 @@
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Any, Optional
+
+import requests
+from fastapi import HTTPException
+from requests.adapters import HTTPAdapter
+
+from tracing import METRICS, set_span_attributes
+
+# 连接 / 读取超时（秒）；读取超时按最长回答的生成时间设置，避免卡死的连接占用线程 200 秒
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+# 网络错误、429、5xx 时的重试次数；聊天补全没有副作用，可以安全重试
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+# 指数退避：第 n 次重试前等待 [0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2^n)] 之间的随机时间
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+# 连续失败多少次后熔断，熔断后多少秒放行一次探测请求
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+# 对冲请求：超过近期 p95 延迟仍未返回时再发一份相同请求，取先返回的结果（会增加少量上游调用）
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "0") == "1"
+LLM_HEDGE_MIN_SECONDS = float(os.getenv("LLM_HEDGE_MIN_SECONDS", "1"))
+
+RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+METRICS.describe("llm_attempts_total", "发往上游的 LLM 请求次数，按结果统计")
+METRICS.describe("llm_retries_total", "LLM 请求重试次数，按原因统计")
+METRICS.describe("llm_hedged_total", "发出的对冲请求数，按哪一份先返回统计")
+METRICS.describe("llm_circuit_open", "LLM 熔断器是否处于打开状态")
+METRICS.describe("llm_circuit_rejected_total", "熔断期间直接拒绝的 LLM 调用数")
+
+
+class LLMUnavailable(HTTPException):
+    """上游持续失败或处于熔断期，返回 503 并给出 Retry-After"""
+
+    def __init__(self, retry_after: float, detail: str = "AI服务暂时不可用，请稍后再试"):
+        super().__init__(status_code=503, detail=detail, headers={"Retry-After": str(max(1, int(retry_after + 0.999)))})
+
+
+class CircuitBreaker:
+    """
+    连续失败 failure_threshold 次后打开，期间直接拒绝调用；
+    reset_seconds 后进入半开状态，只放行一个探测请求，成功则关闭，失败则重新计时。
+    """
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES, reset_seconds: float = LLM_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "closed":
+                return
+            remaining = self.opened_at + self.reset_seconds - time.monotonic()
+            if remaining <= 0 and not self._probing:
+                self.state = "half_open"
+                self._probing = True
+                return
+        METRICS.inc("llm_circuit_rejected_total")
+        raise LLMUnavailable(max(remaining, 1.0))
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state != "closed":
+                logging.info("LLM 熔断器关闭，上游已恢复")
+            self.state = "closed"
+            METRICS.set("llm_circuit_open", 0)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logging.warning(f"LLM 熔断器打开：连续失败 {self.failures} 次，{self.reset_seconds} 秒后重试")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                METRICS.set("llm_circuit_open", 1)
+
+
+class LatencyWindow:
+    """最近若干次成功请求的耗时，用于估计对冲请求的触发延迟"""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self._values = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.min_samples = min_samples
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._values.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self._values) < self.min_samples:
+                return None
+            values = sorted(self._values)
+        return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def parse_retry_after(response: requests.Response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        # HTTP 日期格式不常见，按普通退避处理
+        return None
+
+
+class ResilientLLMClient:
+    """
+    DeepSeek 接口的 HTTP 客户端：连接池 + 超时 + 带抖动的指数退避重试（遵守 Retry-After）
+    + 熔断 + 可选的对冲请求。全进程一个实例，多线程共用。
+    """
+
+    def __init__(self, retries: int = LLM_RETRIES, connect_timeout: float = LLM_CONNECT_TIMEOUT,
+                 read_timeout: float = LLM_READ_TIMEOUT, backoff_base: float = LLM_BACKOFF_BASE,
+                 backoff_max: float = LLM_BACKOFF_MAX, hedge: bool = LLM_HEDGE_ENABLED,
+                 hedge_min_seconds: float = LLM_HEDGE_MIN_SECONDS, breaker: Optional[CircuitBreaker] = None,
+                 pool_size: int = 64):
+        self.retries = retries
+        self.timeout = (connect_timeout, read_timeout)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_min_seconds = hedge_min_seconds
+        self.breaker = breaker or CircuitBreaker()
+        self.latencies = LatencyWindow()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._hedge_pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="llm-hedge") if hedge else None
+
+    def backoff(self, attempt: int) -> float:
+        # full jitter：多个请求同时失败时不会在同一时刻一起重试
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _send_once(self, url: str, **kwargs) -> requests.Response:
+        start = time.perf_counter()
+        response = self.session.post(url, timeout=self.timeout, **kwargs)
+        if response.status_code < 400:
+            self.latencies.add(time.perf_counter() - start)
+        return response
+
+    def _send(self, url: str, **kwargs) -> requests.Response:
+        """发送一次请求；开启对冲时，超过近期 p95 延迟仍未返回则再发一份，取先成功的结果"""
+        delay = self.latencies.percentile(0.95) if self.hedge else None
+        if delay is None:
+            return self._send_once(url, **kwargs)
+        primary = self._hedge_pool.submit(self._send_once, url, **kwargs)
+        done, _ = wait([primary], timeout=max(delay, self.hedge_min_seconds))
+        if done:
+            return primary.result()
+        hedged = self._hedge_pool.submit(self._send_once, url, **kwargs)
+        set_span_attributes(hedged=True)
+        pending = {primary, hedged}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except requests.exceptions.RequestException as e:
+                    first_error = first_error or e
+                    continue
+                if response.status_code < 400 or not pending:
+                    METRICS.inc("llm_hedged_total", winner="hedge" if future is hedged else "primary")
+                    # 较慢的一份在后台自然结束，结果丢弃
+                    return response
+        raise first_error
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """
+        发送聊天补全请求，参数同 requests.post（超时由客户端统一设置）。
+        网络错误、429、5xx 按退避重试；重试用尽或熔断中抛出 LLMUnavailable，
+        其他 4xx（如鉴权失败）直接返回响应，由调用方处理。
+        """
+        self.breaker.before_call()
+        succeeded = False
+        try:
+            response = self._post_with_retries(url, **kwargs)
+            succeeded = True
+            return response
+        finally:
+            # 每次调用都记录结果（同时结束半开状态的探测）：拿到非重试类响应（包括 4xx）说明上游可达，算成功；
+            # 抛出任何异常都算失败，否则探测请求以异常结束时熔断器会一直停在半开状态
+            if succeeded:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+
+    def _post_with_retries(self, url: str, **kwargs) -> requests.Response:
+        attempts = 0
+        while True:
+            attempts += 1
+            wait_seconds = None
+            try:
+                response = self._send(url, **kwargs)
+                if response.status_code not in RETRYABLE_STATUS:
+                    METRICS.inc("llm_attempts_total", outcome="ok" if response.status_code < 400 else "client_error")
+                    set_span_attributes(attempts=attempts)
+                    return response
+                reason = str(response.status_code)
+                wait_seconds = parse_retry_after(response)
+            except requests.exceptions.Timeout:
+                reason = "timeout"
+            except requests.exceptions.ConnectionError:
+                reason = "connection"
+            except requests.exceptions.RequestException:
+                # 其他请求错误（如无效的 URL）重试无意义
+                METRICS.inc("llm_attempts_total", outcome="error")
+                set_span_attributes(attempts=attempts, error="error")
+                raise
+            METRICS.inc("llm_attempts_total", outcome=reason)
+
+            if attempts > self.retries:
+                set_span_attributes(attempts=attempts, error=reason)
+                raise LLMUnavailable(wait_seconds or self.backoff_base * 2 ** attempts)
+            backoff = self.backoff(attempts - 1)
+            if wait_seconds is not None:
+                # 服务端要求的等待时间超过退避上限时不再重试，直接把 Retry-After 交给客户端
+                if wait_seconds > self.backoff_max:
+                    set_span_attributes(attempts=attempts, error=reason)
+                    raise LLMUnavailable(wait_seconds, detail="AI服务繁忙，请稍后再试")
+                backoff = max(backoff, wait_seconds)
+            METRICS.inc("llm_retries_total", reason=reason)
+            logging.warning(f"LLM 请求失败（{reason}），{backoff:.2f} 秒后第 {attempts} 次重试")
+            time.sleep(backoff)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "latency_p95_seconds": self.latencies.percentile(0.95),
+            "hedge": self.hedge,
+        }
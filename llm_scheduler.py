@@ -0,0 +1,209 @@
+import os
+import time
+import heapq
+import math
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Optional, List, Tuple
+
+from fastapi import HTTPException
+
+from tracing import METRICS, span, set_span_attributes
+
+# 同时在途的 DeepSeek 请求数上限（全进程），0 表示不限制
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# 每名用户每分钟可发起的 LLM 调用数（令牌桶补充速率），0 表示不限制；一条消息通常需要 2~3 次调用
+LLM_USER_RATE_PER_MINUTE = float(os.getenv("LLM_USER_RATE_PER_MINUTE", "60"))
+# 令牌桶容量，即允许的突发调用数
+LLM_USER_BURST = float(os.getenv("LLM_USER_BURST", "20"))
+# 用户超出限额时最多延后多久（秒）等待令牌补充，需要等更久则立即返回 429，不占用线程空等
+LLM_USER_MAX_DELAY_SECONDS = float(os.getenv("LLM_USER_MAX_DELAY_SECONDS", "2"))
+# 交互请求（意图识别、回答生成）等待全局并发名额的最长时间（秒），超过则放弃并返回 503
+LLM_MAX_WAIT_SECONDS = float(os.getenv("LLM_MAX_WAIT_SECONDS", "30"))
+# 后台请求（推荐问题、预取答案）等待全局并发名额的最长时间，超过则直接丢弃
+LLM_BACKGROUND_MAX_WAIT_SECONDS = float(os.getenv("LLM_BACKGROUND_MAX_WAIT_SECONDS", "5"))
+
+# 优先级，数值越小越先执行
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BACKGROUND = "background"
+PRIORITY_RANK = {PRIORITY_INTERACTIVE: 0, PRIORITY_BACKGROUND: 1}
+# 这些阶段的结果不影响当前回答，按后台优先级排队
+BACKGROUND_STAGES = frozenset({"llm_recommend"})
+
+# 当前请求的用户（令牌桶按用户计）和是否为后台任务，由 llm_call_context 设置，随线程池调用传递
+_llm_user: ContextVar[Optional[str]] = ContextVar("llm_user", default=None)
+_llm_background: ContextVar[bool] = ContextVar("llm_background", default=False)
+
+METRICS.describe("llm_queue_depth", "等待全局并发名额的 LLM 调用数，按优先级统计")
+METRICS.describe("llm_in_flight", "正在进行的 LLM 调用数")
+METRICS.describe("llm_queue_wait_seconds", "LLM 调用排队时间（限流等待 + 并发名额等待），按优先级统计")
+METRICS.describe("llm_shed_total", "因排队过久或超出用户限额被放弃的 LLM 调用数，按原因和优先级统计")
+
+
+class LLMOverloaded(HTTPException):
+    """LLM 调用被限流或排队超时；作为 HTTPException 直接返回给客户端，带 Retry-After"""
+
+    def __init__(self, reason: str, priority: str, retry_after: float):
+        if reason == "rate_limited":
+            status_code, detail = 429, "提问过于频繁，请稍后再试"
+        else:
+            status_code, detail = 503, "当前提问人数较多，请稍后再试"
+        super().__init__(status_code=status_code, detail=detail,
+                         headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+        self.reason = reason
+        self.priority = priority
+
+
+@contextmanager
+def llm_call_context(user_id: Optional[str] = None, background: bool = False):
+    """在此范围内（包括 run_in_threadpool 调用的函数）发起的 LLM 调用计入 user_id 的限额；background=True 时按后台优先级排队"""
+    user_token = _llm_user.set(user_id)
+    background_token = _llm_background.set(background)
+    try:
+        yield
+    finally:
+        _llm_background.reset(background_token)
+        _llm_user.reset(user_token)
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float, max_wait: float) -> Optional[float]:
+        """预定一个令牌，返回需要等待的秒数；等待超过 max_wait 时不预定，返回 None"""
+        self.refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        if wait > max_wait:
+            return None
+        # 令牌可以透支，后到的调用排在已预定的调用之后
+        self.tokens -= 1
+        return wait
+
+
+class LLMScheduler:
+    """
+    出站 LLM 调用调度（线程安全，调用方为线程池中的阻塞请求）：
+    1. 每名用户一个令牌桶，单个用户高频调用只会让自己排队或被拒绝，不会耗尽全班共用的上游额度；
+    2. 全局并发上限，名额按优先级分配：交互请求先于后台请求，同优先级先到先得；
+    3. 排队超过该优先级的最长等待时间即放弃（LLMOverloaded），不无限堆积。
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, rate_per_minute: float = LLM_USER_RATE_PER_MINUTE,
+                 burst: float = LLM_USER_BURST, max_delay: float = LLM_USER_MAX_DELAY_SECONDS,
+                 max_wait: float = LLM_MAX_WAIT_SECONDS, background_max_wait: float = LLM_BACKGROUND_MAX_WAIT_SECONDS):
+        self.max_concurrency = max_concurrency
+        self.rate_per_second = rate_per_minute / 60
+        self.burst = max(1.0, burst)
+        self.max_delay = max_delay
+        self.max_wait = {PRIORITY_INTERACTIVE: max_wait, PRIORITY_BACKGROUND: background_max_wait}
+        self._cond = threading.Condition()
+        self._buckets: Dict[str, TokenBucket] = {}
+        # 等待全局名额的调用：(优先级, 到达序号)
+        self._queue: List[Tuple[int, int]] = []
+        self._seq = 0
+        self._running = 0
+        self._waiting = {PRIORITY_INTERACTIVE: 0, PRIORITY_BACKGROUND: 0}
+        self.shed = {}
+
+    def _shed(self, reason: str, priority: str, retry_after: float):
+        self.shed[(reason, priority)] = self.shed.get((reason, priority), 0) + 1
+        METRICS.inc("llm_shed_total", reason=reason, priority=priority)
+        raise LLMOverloaded(reason, priority, retry_after)
+
+    def _reserve_token(self, user_id: str, priority: str, now: float) -> float:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            # 桶已补满的用户与新用户等价，用户数较多时回收，避免无限增长
+            if len(self._buckets) >= 4096:
+                for key in [k for k, b in self._buckets.items() if b.tokens + (now - b.updated) * b.rate >= b.capacity]:
+                    del self._buckets[key]
+            bucket = self._buckets[user_id] = TokenBucket(self.rate_per_second, self.burst)
+        wait = bucket.reserve(now, min(self.max_delay, self.max_wait[priority]))
+        if wait is None:
+            self._shed("rate_limited", priority, (1 - bucket.tokens) / bucket.rate)
+        return wait
+
+    def _update_gauges(self):
+        METRICS.set("llm_in_flight", self._running)
+        for priority, count in self._waiting.items():
+            METRICS.set("llm_queue_depth", count, priority=priority)
+
+    def acquire(self, priority: str, user_id: Optional[str] = None):
+        start = time.monotonic()
+        with self._cond:
+            if user_id and self.rate_per_second > 0:
+                delay = self._reserve_token(user_id, priority, start)
+            else:
+                delay = 0.0
+        if delay > 0:
+            time.sleep(delay)
+        deadline = time.monotonic() + self.max_wait[priority]
+        if self.max_concurrency > 0:
+            with self._cond:
+                entry = (PRIORITY_RANK[priority], self._seq)
+                self._seq += 1
+                heapq.heappush(self._queue, entry)
+                self._waiting[priority] += 1
+                self._update_gauges()
+                try:
+                    while not (self._running < self.max_concurrency and self._queue[0] == entry):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._queue.remove(entry)
+                            heapq.heapify(self._queue)
+                            # 队首可能变化，唤醒其他等待者
+                            self._cond.notify_all()
+                            self._shed("queue_timeout", priority, self.max_wait[priority])
+                        self._cond.wait(remaining)
+                    heapq.heappop(self._queue)
+                    self._running += 1
+                    # 还有空闲名额时让下一个等待者继续检查
+                    self._cond.notify_all()
+                finally:
+                    self._waiting[priority] -= 1
+                    self._update_gauges()
+        wait_seconds = time.monotonic() - start
+        METRICS.observe("llm_queue_wait_seconds", wait_seconds, priority=priority)
+        return wait_seconds
+
+    def release(self):
+        if self.max_concurrency > 0:
+            with self._cond:
+                self._running -= 1
+                self._update_gauges()
+                self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, stage: str):
+        """包住一次 LLM 调用；用户和优先级取自 llm_call_context，排队时间记入 llm_queue 阶段"""
+        priority = PRIORITY_BACKGROUND if _llm_background.get() or stage in BACKGROUND_STAGES else PRIORITY_INTERACTIVE
+        with span("llm_queue", priority=priority):
+            wait_seconds = self.acquire(priority, _llm_user.get())
+            set_span_attributes(wait_ms=round(wait_seconds * 1000, 1))
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self._running,
+                "waiting": dict(self._waiting),
+                "users_tracked": len(self._buckets),
+                "shed": {f"{reason}/{priority}": count for (reason, priority), count in self.shed.items()},
+            }
+
+
+# 全进程共享一个调度器
+LLM_SCHEDULER = LLMScheduler()
@@ -0,0 +1,107 @@
+import time
+import logging
+import importlib
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+# 组件加载状态
+STATE_PENDING = "pending"
+STATE_LOADING = "loading"
+STATE_READY = "ready"
+STATE_FAILED = "failed"
+
+
+class _Component:
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.name = name
+        self.factory = factory
+        self.instance: Any = None
+        self.state = STATE_PENDING
+        self.error: Optional[str] = None
+        self.import_seconds = 0.0
+        self.load_seconds: Optional[float] = None
+        self.lock = threading.Lock()
+
+
+class ComponentRegistry:
+    """
+    模型 / 向量库等重量级组件的共享注册表。
+    组件在第一次 get() 时才创建，全进程只创建一次；加载耗时和状态可通过 status() 查询。
+    """
+
+    def __init__(self):
+        self._components: Dict[str, _Component] = {}
+        self._loading = threading.local()
+
+    def register(self, name: str, factory: Callable[[], Any]):
+        self._components[name] = _Component(name, factory)
+
+    def get(self, name: str) -> Any:
+        component = self._components[name]
+        if component.state == STATE_READY:
+            return component.instance
+        with component.lock:
+            if component.state == STATE_READY:
+                return component.instance
+            component.state = STATE_LOADING
+            component.error = None
+            component.import_seconds = 0.0
+            parent = getattr(self._loading, "current", None)
+            self._loading.current = component
+            start = time.perf_counter()
+            try:
+                component.instance = component.factory()
+            except Exception as e:
+                component.state = STATE_FAILED
+                component.error = str(e)
+                logging.error(f"组件 {name} 加载失败: {e}")
+                raise
+            finally:
+                self._loading.current = parent
+                component.load_seconds = time.perf_counter() - start
+            component.state = STATE_READY
+            logging.info(f"组件 {name} 加载完成，耗时 {component.load_seconds:.2f}s")
+            return component.instance
+
+    def timed_import(self, module_name: str):
+        """在组件工厂中导入重量级模块，并把导入耗时记到当前加载的组件上"""
+        start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        component = getattr(self._loading, "current", None)
+        if component is not None:
+            component.import_seconds += time.perf_counter() - start
+        return module
+
+    def is_ready(self, names: Optional[List[str]] = None) -> bool:
+        names = names or list(self._components)
+        return all(self._components[name].state == STATE_READY for name in names)
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {
+                "state": c.state,
+                "import_seconds": round(c.import_seconds, 3),
+                "load_seconds": round(c.load_seconds, 3) if c.load_seconds is not None else None,
+                "error": c.error,
+            }
+            for name, c in self._components.items()
+        }
+
+    def warm_up(self, names: Optional[List[str]] = None) -> threading.Thread:
+        """在后台线程中依次加载组件，加载失败的组件只记录状态，不影响其余组件"""
+        names = names or list(self._components)
+
+        def _run():
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception:
+                    continue
+
+        thread = threading.Thread(target=_run, name="component-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+
+# 全局注册表
+registry = ComponentRegistry()
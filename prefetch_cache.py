@@ -0,0 +1,142 @@
+import os
+import time
+import logging
+import threading
+from typing import List, Dict, Any, Optional
+
+from embedding_backends import normalize_query
+from RAG_system import RAG_ERROR_ANSWER
+from tracing import start_trace
+from llm_scheduler import llm_call_context
+
+# 预取结果的有效期（秒）
+PREFETCH_TTL_SECONDS = int(os.getenv("PREFETCH_TTL_SECONDS", "300"))
+# 每轮最多预先生成完整答案的推荐问题数量，0 表示只预取检索结果
+PREFETCH_ANSWER_BUDGET = int(os.getenv("PREFETCH_ANSWER_BUDGET", "0"))
+
+
+class PrefetchEntry:
+    def __init__(self, question: str, history_len: int):
+        self.question = question
+        # 预取时会话的消息数，点击时会话未再变化才能复用预生成的答案
+        self.history_len = history_len
+        self.created_at = time.time()
+        self.docs: Optional[List[Any]] = None
+        self.answer: Optional[str] = None
+        self.recommended_questions: List[str] = []
+        self.cost_seconds = 0.0
+        self.used = False
+
+
+class PrefetchCache:
+    """
+    推荐问题的按会话预取缓存。
+    每轮回答后为推荐问题预先执行检索（可选预生成答案），
+    用户点击推荐问题时直接复用；未被使用的预取计入浪费的开销。
+    """
+
+    def __init__(self, ttl_seconds: int = PREFETCH_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._sessions: Dict[str, Dict[str, PrefetchEntry]] = {}
+        self._lock = threading.Lock()
+        self.prefetched = 0
+        self.hits = 0
+        self.misses = 0
+        self.wasted = 0
+        self.wasted_answers = 0
+        self.wasted_seconds = 0.0
+
+    def _discard(self, entry: PrefetchEntry):
+        if not entry.used and entry.docs is not None:
+            self.wasted += 1
+            self.wasted_seconds += entry.cost_seconds
+            if entry.answer is not None:
+                self.wasted_answers += 1
+
+    def start_session_round(self, session_id: str, questions: List[str], history_len: int) -> List[PrefetchEntry]:
+        """新一轮推荐问题替换该会话旧的预取结果"""
+        entries = {}
+        for question in questions:
+            key = normalize_query(question)
+            if key:
+                entries[key] = PrefetchEntry(question, history_len)
+        with self._lock:
+            for old in self._sessions.pop(session_id, {}).values():
+                self._discard(old)
+            self._sessions[session_id] = entries
+        return list(entries.values())
+
+    def complete(self, entry: PrefetchEntry, docs: List[Any], cost_seconds: float,
+                 answer: Optional[str] = None, recommended_questions: Optional[List[str]] = None):
+        with self._lock:
+            entry.docs = docs
+            entry.answer = answer
+            entry.recommended_questions = recommended_questions or []
+            entry.cost_seconds += cost_seconds
+            self.prefetched += 1
+
+    def pop(self, session_id: str, question: str) -> Optional[PrefetchEntry]:
+        """取出已完成的预取结果；未预取、仍在进行或已过期时返回 None"""
+        key = normalize_query(question)
+        now = time.time()
+        with self._lock:
+            entries = self._sessions.get(session_id, {})
+            entry = entries.get(key)
+            if entry is None:
+                return None
+            # 点击了推荐问题，但预取尚未完成或已过期
+            if entry.docs is None or now - entry.created_at > self.ttl_seconds:
+                self.misses += 1
+                return None
+            del entries[key]
+            entry.used = True
+            self.hits += 1
+            return entry
+
+    def evict_expired(self):
+        now = time.time()
+        with self._lock:
+            for session_id in list(self._sessions):
+                entries = self._sessions[session_id]
+                for key in [k for k, e in entries.items() if now - e.created_at > self.ttl_seconds]:
+                    self._discard(entries.pop(key))
+                if not entries:
+                    del self._sessions[session_id]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "prefetched": self.prefetched,
+                "hits": self.hits,
+                "misses": self.misses,
+                # 预取结果中最终被点击使用的比例
+                "hit_rate": round(self.hits / self.prefetched, 4) if self.prefetched else 0.0,
+                "wasted": self.wasted,
+                "wasted_answers": self.wasted_answers,
+                "wasted_seconds": round(self.wasted_seconds, 3),
+            }
+
+
+def run_prefetch(cache: PrefetchCache, rag_system: Any, session_id: str, questions: List[str],
+                 history: List[Dict[str, Any]], answer_budget: int = PREFETCH_ANSWER_BUDGET,
+                 user_id: Optional[str] = None):
+    """后台任务：对推荐问题执行检索，并在预算内预生成答案"""
+    cache.evict_expired()
+    entries = cache.start_session_round(session_id, questions, len(history))
+    # 后台任务在响应发送后执行，使用独立的追踪上下文，不计入原请求的耗时分解；
+    # 预生成答案的 LLM 调用计入该用户的限额，并按后台优先级排在交互请求之后
+    with start_trace("prefetch", session_id=session_id), llm_call_context(user_id=user_id, background=True):
+        for index, entry in enumerate(entries):
+            start = time.perf_counter()
+            try:
+                docs = rag_system.retrieve(entry.question)
+                answer, recommended = None, None
+                if index < answer_budget:
+                    history_with_question = history + [{"role": "user", "content": entry.question}]
+                    # 引用来源在使用时由 entry.docs 生成
+                    answer, recommended, _ = rag_system.rag_qa(entry.question, history_with_question, docs=docs)
+                    if answer == RAG_ERROR_ANSWER:
+                        answer, recommended = None, None
+                cache.complete(entry, docs, time.perf_counter() - start, answer, recommended)
+            except Exception as e:
+                logging.warning(f"推荐问题预取失败: {e}")
@@ -0,0 +1,52 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Any
+
+from tracing import span
+
+
+class SessionLocks:
+    """
+    按会话 ID 分配的 asyncio 锁，只在事件循环线程中使用。
+    同一会话的写请求按到达顺序依次执行（asyncio.Lock 先到先得），
+    不同会话的锁互不相关，可以完全并行；没有请求持有或等待的锁立即回收，不随会话数增长。
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # 每个会话正在持有或等待锁的请求数
+        self._users: Dict[str, int] = {}
+        self.acquired = 0
+        # 到达时锁已被占用、需要排队的次数
+        self.contended = 0
+
+    @asynccontextmanager
+    async def hold(self, session_id: str):
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        self._users[session_id] = self._users.get(session_id, 0) + 1
+        if lock.locked():
+            self.contended += 1
+        try:
+            # 排队等待的时间记入请求耗时分解的 session_lock 阶段
+            with span("session_lock"):
+                await lock.acquire()
+            self.acquired += 1
+            try:
+                yield
+            finally:
+                lock.release()
+        finally:
+            self._users[session_id] -= 1
+            if self._users[session_id] == 0:
+                del self._users[session_id]
+                del self._locks[session_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active_sessions": len(self._locks),
+            "waiting": sum(self._users.values()) - sum(1 for lock in self._locks.values() if lock.locked()),
+            "acquired": self.acquired,
+            "contended": self.contended,
+        }
@@ -0,0 +1,73 @@
+import threading
+from contextlib import nullcontext
+from typing import Any, Callable, ContextManager, Dict, Optional, Tuple
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    相同 key 的并发调用合并为一次（线程安全）：第一个调用执行函数，
+    执行期间到达的相同调用等待并共享其结果或异常；执行结束后 key 立即移除，不做缓存。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], Any],
+           wait_context: Optional[Callable[[], ContextManager]] = None,
+           share_error: Optional[Callable[[BaseException], bool]] = None) -> Tuple[Any, bool]:
+        """
+        返回 (结果, 是否复用了其他调用的结果)。
+        wait_context 包住合并调用的等待过程（如记录耗时的 span）；
+        首个调用的异常只与首个调用自身有关时（share_error 返回 False），等待的调用改为自己执行 fn。
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            with (wait_context or nullcontext)():
+                call.done.wait()
+            if call.error is not None:
+                if share_error is not None and not share_error(call.error):
+                    with self._lock:
+                        self.coalesced -= 1
+                        self.executed += 1
+                    return fn(), False
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.executed + self.coalesced
+            return {
+                "in_flight": len(self._calls),
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                # 被合并、没有发往上游的调用占比
+                "coalesced_rate": round(self.coalesced / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,97 @@
+import os
+import json
+import logging
+from typing import List, Dict, Any, Optional, Tuple
+
+from RAG_system import get_chatbot
+
+# 路由方式：intent 先单独调用一次 LLM 识别意图再回答；
+# tools 用一次带工具定义的调用同时完成路由和回答（通用问答只需一次调用，需要检索时模型调用检索工具）
+LLM_ROUTING_MODE = os.getenv("LLM_ROUTING_MODE", "intent")
+
+# 系统操作只能通过界面按钮完成，工具参数取以下值之一
+SYSTEM_ACTIONS = ["new_session", "upload_file", "clear_history", "other"]
+
+ROUTING_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "search_course_docs",
+            "description": "在用户上传的课程资料（讲义、实验指导书、PDF 等）中检索。"
+                           "问题涉及资料中的具体内容、细节，或用户要求根据文件回答时调用。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string", "description": "用于检索的问题，结合对话历史补全指代"},
+                },
+                "required": ["query"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "lookup_course_info",
+            "description": "查询课程、模块、项目进度或作业安排等结构化课程信息，例如“第三周的核心模块是什么？”。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string", "description": "要查询的课程信息"},
+                },
+                "required": ["query"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "system_action",
+            "description": "用户要求执行系统操作，例如新建会话、上传文件、清空聊天记录。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "action": {"type": "string", "enum": SYSTEM_ACTIONS},
+                },
+                "required": ["action"],
+            },
+        },
+    },
+]
+
+# 工具对应的意图，与 identify_intent 的意图名一致，耗时分解和用量统计按意图归类
+TOOL_INTENTS = {
+    "search_course_docs": "RAG_QA",
+    "lookup_course_info": "COURSE_MANAGEMENT",
+    "system_action": "SYSTEM_ACTION",
+}
+
+
+def route_message(user_message: str, history: List[Dict[str, Any]]) -> Tuple[str, Optional[str], Dict[str, Any]]:
+    """
+    带工具定义调用一次 LLM，由模型决定路由。history 为本轮之前的对话。
+    返回 (意图, 回答, 工具参数)：模型直接回答时为 ("GENERAL_QA", 回答, {})，
+    调用工具时为 (工具对应的意图, None, 工具参数)，由调用方执行相应的处理。
+    """
+    chatbot = get_chatbot()
+    # 系统提示和历史的排列与回答调用一致，前缀可以命中上游缓存
+    messages = [{"role": "system", "content": chatbot.system_message}]
+    messages.extend({"role": m["role"], "content": m["content"]} for m in history)
+    messages.append({"role": "user", "content": user_message})
+    reply = chatbot.chat_messages(messages, tools=ROUTING_TOOLS, stage="llm_route")
+
+    for tool_call in reply.get("tool_calls") or []:
+        function = tool_call.get("function", {})
+        intent = TOOL_INTENTS.get(function.get("name"))
+        if intent is None:
+            logging.warning(f"模型调用了未定义的工具: {function.get('name')}")
+            continue
+        try:
+            arguments = json.loads(function.get("arguments") or "{}")
+        except json.JSONDecodeError:
+            arguments = {}
+        return intent, None, arguments if isinstance(arguments, dict) else {}
+
+    if reply.get("content"):
+        return "GENERAL_QA", reply["content"], {}
+    # 只调用了未定义的工具且没有回答，按通用问答重新回答
+    return "GENERAL_QA", None, {}
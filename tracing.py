@@ -0,0 +1,238 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Dict, Any, Optional, Tuple
+
+# 是否把每个请求的耗时分解以 JSON 日志输出
+TRACE_LOG_ENABLED = os.getenv("TRACE_LOG", "1") == "1"
+# 延迟直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+trace_logger = logging.getLogger("trace")
+
+
+class Span:
+    def __init__(self, name: str, parent: Optional[str], offset_ms: float, attributes: Dict[str, Any]):
+        self.name = name
+        self.parent = parent
+        self.offset_ms = offset_ms
+        self.duration_ms = 0.0
+        self.attributes = attributes
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {"name": self.name, "offset_ms": round(self.offset_ms, 2), "duration_ms": round(self.duration_ms, 2)}
+        if self.parent:
+            data["parent"] = self.parent
+        if self.attributes:
+            data["attributes"] = self.attributes
+        return data
+
+
+class Trace:
+    """一次请求的耗时分解：按顺序记录各阶段 span，可嵌套"""
+
+    def __init__(self, name: str, **attributes):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attributes: Dict[str, Any] = dict(attributes)
+        self.spans: List[Span] = []
+        self._open: List[Span] = []
+        self._start = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._start) * 1000
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self) -> float:
+        if self.duration_ms is None:
+            self.duration_ms = self.elapsed_ms()
+        return self.duration_ms
+
+    def stage_totals(self) -> Dict[str, float]:
+        """同名 span 的耗时相加（例如一次请求内多次调用 LLM）"""
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration_ms
+        return totals
+
+    def server_timing(self) -> str:
+        """生成 Server-Timing 响应头，浏览器开发者工具可直接展示"""
+        parts = [f"{name};dur={duration:.1f}" for name, duration in self.stage_totals().items()]
+        parts.append(f"total;dur={self.finish():.1f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "duration_ms": round(self.finish(), 2),
+            "attributes": self.attributes,
+            "spans": [span.to_dict() for span in self.spans],
+        }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def set_trace_attributes(**attributes):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.set(**attributes)
+
+
+def set_span_attributes(**attributes):
+    """给当前最内层的 span 添加属性（如 token 数、缓存是否命中）"""
+    trace = _current_trace.get()
+    if trace is not None and trace._open:
+        trace._open[-1].attributes.update(attributes)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """记录一个阶段的耗时；不在请求追踪上下文中（如后台线程）时不做任何事"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    parent = trace._open[-1].name if trace._open else None
+    current = Span(name, parent, trace.elapsed_ms(), dict(attributes))
+    trace.spans.append(current)
+    trace._open.append(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.duration_ms = (time.perf_counter() - start) * 1000
+        trace._open.pop()
+
+
+@contextmanager
+def start_trace(name: str, **attributes):
+    trace = Trace(name, **attributes)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        trace.finish()
+        _current_trace.reset(token)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in items]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class MetricsRegistry:
+    """进程内指标，按 Prometheus 文本格式导出（直方图、计数器与瞬时值）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[Tuple[Tuple[str, str], ...], Histogram]] = {}
+        self._counters: Dict[str, Dict[Tuple[Tuple[str, str], ...], float]] = {}
+        self._gauges: Dict[str, Dict[Tuple[Tuple[str, str], ...], float]] = {}
+        self._help: Dict[str, str] = {}
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """设置瞬时值（如队列长度）"""
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = value
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._gauges.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} gauge")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            for name, series in sorted(self._counters.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels, ('le', f'{bound:g}'))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+METRICS.describe("chat_requests_total", "消息请求数，按意图统计")
+METRICS.describe("chat_request_duration_seconds", "消息请求总耗时，按意图统计")
+METRICS.describe("chat_stage_duration_seconds", "消息处理各阶段耗时，按阶段和意图统计")
+METRICS.describe("llm_tokens_total", "LLM 调用消耗的 token 数，按阶段和类型统计")
+METRICS.describe("llm_coalesced_total", "与内容相同的在途请求合并、未发往上游的 LLM 调用数，按阶段统计")
+
+
+def record_trace(trace: Trace):
+    """请求结束时调用：输出 JSON 日志，并把各阶段耗时和 token 数计入指标"""
+    duration_ms = trace.finish()
+    intent = trace.attributes.get("intent", "unknown")
+    METRICS.inc("chat_requests_total", intent=intent)
+    METRICS.observe("chat_request_duration_seconds", duration_ms / 1000, intent=intent)
+    for span_item in trace.spans:
+        METRICS.observe("chat_stage_duration_seconds", span_item.duration_ms / 1000, stage=span_item.name, intent=intent)
+        for kind in ("prompt_tokens", "completion_tokens", "prompt_cache_hit_tokens", "prompt_cache_miss_tokens"):
+            if kind in span_item.attributes:
+                METRICS.inc("llm_tokens_total", span_item.attributes[kind], stage=span_item.name, type=kind)
+    if TRACE_LOG_ENABLED:
+        trace_logger.info(json.dumps(trace.to_dict(), ensure_ascii=False))
@@ -0,0 +1,193 @@
+import os
+import json
+import logging
+import datetime
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Optional, List, Tuple
+
+from tracing import METRICS
+
+# 每名用户每天的 token 额度（输入 + 输出），0 表示不限制；超出后降级回答而不是拒绝
+USER_DAILY_TOKEN_QUOTA = int(os.getenv("USER_DAILY_TOKEN_QUOTA", "0"))
+# 降级后检索的文档块数，以及随问题发给模型的最近历史消息条数
+QUOTA_DEGRADED_TOP_K = int(os.getenv("QUOTA_DEGRADED_TOP_K", "2"))
+QUOTA_DEGRADED_HISTORY_MESSAGES = int(os.getenv("QUOTA_DEGRADED_HISTORY_MESSAGES", "4"))
+
+USAGE_FIELDS = ("calls", "prompt_tokens", "completion_tokens", "prompt_cache_hit_tokens", "total_tokens")
+
+# 当前请求收集 LLM 用量的列表，由 collect_usage 设置，随线程池调用传递
+_usage_records: ContextVar[Optional[List[Tuple[str, Dict[str, Any]]]]] = ContextVar("usage_records", default=None)
+
+METRICS.describe("usage_quota_degraded_total", "用户超出每日 token 额度后降级处理的消息数")
+
+
+@contextmanager
+def collect_usage():
+    """收集此范围内（包括 run_in_threadpool 调用的函数）每次 LLM 调用返回的 usage，产出 [(stage, usage), ...]"""
+    records: List[Tuple[str, Dict[str, Any]]] = []
+    token = _usage_records.set(records)
+    try:
+        yield records
+    finally:
+        _usage_records.reset(token)
+
+
+def add_llm_usage(stage: str, usage: Dict[str, Any]):
+    """记录一次 LLM 调用的 usage；不在 collect_usage 范围内时忽略。被合并的调用没有发往上游，不会记录"""
+    records = _usage_records.get()
+    if records is not None:
+        records.append((stage, usage))
+
+
+def empty_usage() -> Dict[str, int]:
+    return {field: 0 for field in USAGE_FIELDS}
+
+
+def add_usage(target: Dict[str, int], usage: Dict[str, int]):
+    for field in USAGE_FIELDS:
+        target[field] = target.get(field, 0) + usage.get(field, 0)
+
+
+def summarize(records: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, int]:
+    totals = empty_usage()
+    for _, usage in records:
+        totals["calls"] += 1
+        for field in USAGE_FIELDS[1:]:
+            value = usage.get(field)
+            if isinstance(value, int):
+                totals[field] += value
+        if not isinstance(usage.get("total_tokens"), int):
+            totals["total_tokens"] += usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
+    return totals
+
+
+def today() -> str:
+    return datetime.date.today().isoformat()
+
+
+def empty_session_usage() -> Dict[str, Any]:
+    return {"total": empty_usage(), "by_intent": {}, "daily": {}}
+
+
+class UsageLedger:
+    """
+    按会话累计的 LLM token 用量，保存在会话存储中（会话的 usage 字段：总计、按意图、按日期），
+    另在内存中维护每名用户每天的用量，用于判断是否超出每日额度。
+    每次记录同时追加到 ledger_path（JSON Lines），会话存储只在部分操作时保存，
+    启动时以追加日志为准重建用量，重启后额度不会被重置。
+    """
+
+    def __init__(self, sessions: Dict[str, Any], ledger_path: Optional[str] = None,
+                 daily_quota: int = USER_DAILY_TOKEN_QUOTA):
+        self.sessions = sessions
+        self.ledger_path = ledger_path
+        self.daily_quota = daily_quota
+        self._lock = threading.Lock()
+        self._daily: Dict[Tuple[str, str], int] = {}
+        if ledger_path and os.path.exists(ledger_path):
+            self._replay(ledger_path)
+        else:
+            for session_data in sessions.values():
+                for day, tokens in session_data.get("usage", {}).get("daily", {}).items():
+                    key = (session_data["user_id"], day)
+                    self._daily[key] = self._daily.get(key, 0) + tokens
+            if ledger_path:
+                # 首次启用追加日志：把会话存储中已有的用量写成快照，之后的记录在此基础上累加
+                for session_id, session_data in sessions.items():
+                    if session_data.get("usage"):
+                        self._append({"session_id": session_id, "user_id": session_data["user_id"],
+                                      "snapshot": session_data["usage"]})
+
+    def _replay(self, ledger_path: str):
+        for session_data in self.sessions.values():
+            session_data["usage"] = empty_session_usage()
+        with open(ledger_path, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # 写到一半的最后一行（进程被强制结束）
+                    logging.warning(f"用量日志第 {line_number} 行格式错误，已跳过")
+                    continue
+                session_data = self.sessions.get(entry["session_id"])
+                if "snapshot" in entry:
+                    for day, tokens in entry["snapshot"].get("daily", {}).items():
+                        key = (entry["user_id"], day)
+                        self._daily[key] = self._daily.get(key, 0) + tokens
+                    if session_data is not None:
+                        session_data["usage"] = entry["snapshot"]
+                    continue
+                # 会话已删除时仍计入用户当天的用量
+                key = (entry["user_id"], entry["day"])
+                self._daily[key] = self._daily.get(key, 0) + entry["usage"]["total_tokens"]
+                if session_data is not None:
+                    self._apply(session_data["usage"], entry["intent"], entry["day"], entry["usage"])
+
+    def _append(self, entry: Dict[str, Any]):
+        with open(self.ledger_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    @staticmethod
+    def _apply(usage: Dict[str, Any], intent: str, day: str, totals: Dict[str, int]):
+        add_usage(usage["total"], totals)
+        add_usage(usage["by_intent"].setdefault(intent, empty_usage()), totals)
+        usage["daily"][day] = usage["daily"].get(day, 0) + totals["total_tokens"]
+
+    def record(self, session_data: Dict[str, Any], intent: str, records: List[Tuple[str, Dict[str, Any]]]):
+        """把一次请求（或后台任务）的 LLM 用量计入会话和用户当天的用量，并追加到用量日志"""
+        if not records:
+            return
+        totals = summarize(records)
+        day = today()
+        with self._lock:
+            self._apply(session_data.setdefault("usage", empty_session_usage()), intent, day, totals)
+            key = (session_data["user_id"], day)
+            self._daily[key] = self._daily.get(key, 0) + totals["total_tokens"]
+            if self.ledger_path:
+                self._append({"session_id": session_data["id"], "user_id": session_data["user_id"],
+                              "day": day, "intent": intent, "usage": totals})
+
+    def tokens_today(self, user_id: str) -> int:
+        with self._lock:
+            return self._daily.get((user_id, today()), 0)
+
+    def over_quota(self, user_id: str) -> bool:
+        return self.daily_quota > 0 and self.tokens_today(user_id) >= self.daily_quota
+
+    def user_sessions(self, user_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {"session_id": session_id, "title": data.get("title", ""),
+                 "usage": data.get("usage", empty_session_usage())}
+                for session_id, data in list(self.sessions.items()) if data.get("user_id") == user_id
+            ]
+
+    def report(self) -> Dict[str, Any]:
+        """全部用户的用量汇总：按意图的总计，以及每名用户的总计和当天用量"""
+        day = today()
+        by_intent: Dict[str, Dict[str, int]] = {}
+        users: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for data in list(self.sessions.values()):
+                usage = data.get("usage")
+                if not usage:
+                    continue
+                user = users.setdefault(data["user_id"], {"user_id": data["user_id"], "sessions": 0,
+                                                          "total": empty_usage(), "by_intent": {}})
+                user["sessions"] += 1
+                add_usage(user["total"], usage["total"])
+                for intent, intent_usage in usage["by_intent"].items():
+                    add_usage(by_intent.setdefault(intent, empty_usage()), intent_usage)
+                    add_usage(user["by_intent"].setdefault(intent, empty_usage()), intent_usage)
+            for user in users.values():
+                user["today_tokens"] = self._daily.get((user["user_id"], day), 0)
+        for user in users.values():
+            user["over_quota"] = self.daily_quota > 0 and user["today_tokens"] >= self.daily_quota
+        return {
+            "day": day,
+            "daily_quota": self.daily_quota,
+            "by_intent": by_intent,
+            "users": sorted(users.values(), key=lambda u: u["today_tokens"], reverse=True),
+        }
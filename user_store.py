@@ -0,0 +1,117 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+from typing import List, Dict, Any, Optional
+
+# 用户数据库默认路径
+USER_DB_PATH = "users.db"
+
+
+class UserStore:
+    """
+    基于 SQLite 的用户仓库。
+    username 为唯一索引，id 为主键，注册和角色更新均为单行写入，
+    不再整体重写 users.json。
+    """
+
+    def __init__(self, db_path: str = USER_DB_PATH):
+        self.db_path = db_path
+        # 同一连接在多线程间共享，写操作由锁串行化
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS users (
+                    id TEXT PRIMARY KEY,
+                    username TEXT NOT NULL UNIQUE,
+                    hashed_password TEXT NOT NULL,
+                    role TEXT NOT NULL DEFAULT 'user'
+                )
+                """
+            )
+
+    @staticmethod
+    def _row_to_dict(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        return dict(row) if row else None
+
+    def get_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+        return self._row_to_dict(row)
+
+    def get_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+        return self._row_to_dict(row)
+
+    def add_user(self, user: Dict[str, Any]) -> bool:
+        """插入新用户，用户名或ID已存在时返回 False（并发注册时由唯一约束保证只有一个成功）"""
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT INTO users (id, username, hashed_password, role) VALUES (?, ?, ?, ?)",
+                    (user["id"], user["username"], user["hashed_password"], user.get("role", "user")),
+                )
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def update_role(self, user_id: str, role: str) -> Optional[Dict[str, Any]]:
+        """按ID更新角色，用户不存在时返回 None"""
+        with self._lock:
+            cursor = self._conn.execute("UPDATE users SET role = ? WHERE id = ?", (role, user_id))
+            if cursor.rowcount == 0:
+                return None
+            row = self._conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+        return self._row_to_dict(row)
+
+    def list_users(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM users ORDER BY rowid").fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def import_json(self, json_path: str) -> int:
+        """从旧版 users.json 导入用户，已存在的用户名会被跳过，返回导入数量"""
+        if not os.path.exists(json_path):
+            return 0
+        with open(json_path, "r", encoding="utf-8") as f:
+            try:
+                users = json.load(f)
+            except json.JSONDecodeError:
+                logging.warning(f"警告： 用户文件 {json_path} 格式错误，跳过导入。")
+                return 0
+
+        rows = [
+            (data["id"], username, data["hashed_password"], data.get("role", "user"))
+            for username, data in users.items()
+        ]
+        with self._lock:
+            before = self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO users (id, username, hashed_password, role) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            after = self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        imported = after - before
+        logging.info(f"已从 {json_path} 导入 {imported} 个用户。")
+        return imported
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
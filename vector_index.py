@@ -0,0 +1,559 @@
+import os
+import json
+import uuid
+import shutil
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Tuple, Iterable
+
+import numpy as np
+from langchain_core.documents import Document
+
+from model_registry import registry
+
+# 向量索引类型：
+#   chroma    - Chroma（SQLite + HNSW，默认）
+#   numpy     - 进程内 float32 内存映射矩阵，精确 top-k，适合中小规模语料
+#   quantized - 与 numpy 相同，但向量以 VECTOR_QUANTIZATION 精度存储
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "chroma")
+# quantized 索引的存储精度：float16 / int8
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "int8")
+
+
+@dataclass
+class HNSWParams:
+    """Chroma HNSW 索引参数，默认值与 Chroma 一致"""
+    space: str = "l2"
+    M: int = 16
+    ef_construction: int = 100
+    ef_search: int = 10
+
+    @classmethod
+    def from_env(cls) -> "HNSWParams":
+        return cls(
+            space=os.getenv("HNSW_SPACE", "l2"),
+            M=int(os.getenv("HNSW_M", "16")),
+            ef_construction=int(os.getenv("HNSW_EF_CONSTRUCTION", "100")),
+            ef_search=int(os.getenv("HNSW_EF_SEARCH", "10")),
+        )
+
+    def to_collection_metadata(self) -> Dict[str, Any]:
+        return {
+            "hnsw:space": self.space,
+            "hnsw:M": self.M,
+            "hnsw:construction_ef": self.ef_construction,
+            "hnsw:search_ef": self.ef_search,
+        }
+
+
+@dataclass
+class VectorIndexConfig:
+    kind: str = VECTOR_INDEX
+    quantization: str = VECTOR_QUANTIZATION
+    hnsw: HNSWParams = field(default_factory=HNSWParams.from_env)
+
+
+class VectorStoreBackend(ABC):
+    """RAGSystem.vectorstore 需要的最小接口，Chroma（LangChain VectorStore）天然满足"""
+
+    @abstractmethod
+    def add_documents(self, documents: List[Document]) -> List[str]:
+        ...
+
+    @abstractmethod
+    def similarity_search_with_score(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        ...
+
+    @abstractmethod
+    def delete(self, ids: Optional[List[str]] = None) -> Optional[bool]:
+        ...
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def similarity_search_with_relevance_scores(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        # 与 LangChain 的约定一致：分数越大越相关；子类返回的是余弦相似度，可直接使用
+        return self.similarity_search_with_score(query, k)
+
+
+class NumpyVectorStore(VectorStoreBackend):
+    """
+    纯 NumPy 进程内向量库。
+    向量保存在磁盘上的连续矩阵文件中并以内存映射方式访问，文档与元数据按行号对齐追加到 jsonl；
+    查询是一次矩阵-向量乘法（BLAS）加 argpartition 的精确 top-k。
+    precision 为 float16 / int8 时按行量化存储（int8 带逐行缩放系数），内存约为 float32 的 1/2 或 1/4。
+    """
+
+    META_FILE = "index.json"
+    VECTORS_FILE = "vectors.bin"
+    SCALES_FILE = "scales.bin"
+    DOCS_FILE = "documents.jsonl"
+    DELETED_FILE = "deleted.txt"
+    MIN_CAPACITY = 1024
+    # 低精度矩阵分块反量化，避免一次性生成整块 float32 副本
+    SEARCH_BLOCK_ROWS = 65536
+
+    def __init__(self, persist_directory: str, embedding_function: Any, precision: str = "float32"):
+        if precision not in ("float32", "float16", "int8"):
+            raise ValueError(f"不支持的向量精度: {precision}")
+        self.persist_directory = persist_directory
+        self.embedding_function = embedding_function
+        self.precision = precision
+        self._dtype = np.dtype(precision)
+        self.dim: Optional[int] = None
+        self.count = 0
+        self.capacity = 0
+        self._vectors: Optional[np.memmap] = None
+        self._scales: Optional[np.memmap] = None
+        self._docs: List[Dict[str, Any]] = []
+        self._row_by_id: Dict[str, int] = {}
+        self._alive = np.zeros(0, dtype=bool)
+        self._lock = threading.Lock()
+        self._load()
+
+    @classmethod
+    def exists(cls, persist_directory: str) -> bool:
+        return os.path.exists(os.path.join(persist_directory, cls.META_FILE))
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.persist_directory, name)
+
+    def _load(self):
+        if not self.exists(self.persist_directory):
+            return
+        with open(self._path(self.META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["precision"] != self.precision:
+            raise ValueError(f"已存在的向量库精度为 {meta['precision']}，与配置 {self.precision} 不一致")
+        self.dim, self.count, self.capacity = meta["dim"], meta["count"], meta["capacity"]
+        self._map_files()
+
+        with open(self._path(self.DOCS_FILE), "r", encoding="utf-8") as f:
+            docs = [json.loads(line) for line in f if line.strip()]
+        # 元数据文件可能比 count 多出未提交的行（写入中途退出），以 count 为准并截掉多余行
+        self._docs = docs[:self.count]
+        if len(docs) > self.count:
+            with open(self._path(self.DOCS_FILE), "w", encoding="utf-8") as f:
+                for doc in self._docs:
+                    f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+        self._row_by_id = {doc["id"]: row for row, doc in enumerate(self._docs)}
+        self._alive = np.ones(self.capacity, dtype=bool)
+        self._alive[self.count:] = False
+        if os.path.exists(self._path(self.DELETED_FILE)):
+            with open(self._path(self.DELETED_FILE), "r", encoding="utf-8") as f:
+                for line in f:
+                    row = self._row_by_id.get(line.strip())
+                    if row is not None:
+                        self._alive[row] = False
+
+    def _map_files(self):
+        self._vectors = np.memmap(self._path(self.VECTORS_FILE), dtype=self._dtype, mode="r+",
+                                  shape=(self.capacity, self.dim))
+        self._scales = np.memmap(self._path(self.SCALES_FILE), dtype=np.float32, mode="r+",
+                                 shape=(self.capacity,))
+
+    def _write_meta(self):
+        tmp_path = self._path(self.META_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "count": self.count, "capacity": self.capacity,
+                       "precision": self.precision}, f)
+        os.replace(tmp_path, self._path(self.META_FILE))
+
+    def _ensure_capacity(self, extra: int):
+        needed = self.count + extra
+        if needed <= self.capacity:
+            return
+        new_capacity = max(needed, self.capacity * 2, self.MIN_CAPACITY)
+        os.makedirs(self.persist_directory, exist_ok=True)
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._scales.flush()
+        # 扩展文件长度后重新映射，已写入的数据保持不变
+        for name, itemsize in ((self.VECTORS_FILE, self._dtype.itemsize * self.dim), (self.SCALES_FILE, 4)):
+            with open(self._path(name), "ab") as f:
+                f.truncate(new_capacity * itemsize)
+        self.capacity = new_capacity
+        self._map_files()
+        alive = np.zeros(new_capacity, dtype=bool)
+        alive[:len(self._alive)] = self._alive
+        self._alive = alive
+
+    def _encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors = vectors / norms
+        if self.precision == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+            return quantized, scales.astype(np.float32)
+        return vectors.astype(self._dtype), np.ones(len(vectors), dtype=np.float32)
+
+    def add_documents(self, documents: List[Document]) -> List[str]:
+        if not documents:
+            return []
+        vectors = np.asarray(
+            self.embedding_function.embed_documents([d.page_content for d in documents]), dtype=np.float32
+        )
+        encoded, scales = self._encode(vectors)
+        new_docs = [
+            {"id": str(uuid.uuid4()), "page_content": d.page_content, "metadata": d.metadata}
+            for d in documents
+        ]
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"向量维度 {vectors.shape[1]} 与已有向量库维度 {self.dim} 不一致")
+            self._ensure_capacity(len(documents))
+            start, end = self.count, self.count + len(documents)
+            self._vectors[start:end] = encoded
+            self._scales[start:end] = scales
+            self._vectors.flush()
+            self._scales.flush()
+            with open(self._path(self.DOCS_FILE), "a", encoding="utf-8") as f:
+                for doc in new_docs:
+                    f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+            for row, doc in enumerate(new_docs, start=start):
+                self._row_by_id[doc["id"]] = row
+            self._docs.extend(new_docs)
+            self._alive[start:end] = True
+            # 最后更新 count，中途失败时已写入的行不会被当作有效数据
+            self.count = end
+            self._write_meta()
+        return [d["id"] for d in new_docs]
+
+    @classmethod
+    def from_documents(cls, documents: List[Document], embedding: Any, persist_directory: str,
+                       precision: str = "float32") -> "NumpyVectorStore":
+        store = cls(persist_directory, embedding, precision)
+        store.add_documents(documents)
+        return store
+
+    def delete(self, ids: Optional[List[str]] = None) -> Optional[bool]:
+        """按ID删除（逻辑删除，写入墓碑文件），返回是否删除了任何向量"""
+        if not ids:
+            return False
+        with self._lock:
+            removed = []
+            for doc_id in ids:
+                row = self._row_by_id.get(doc_id)
+                if row is not None and self._alive[row]:
+                    self._alive[row] = False
+                    removed.append(doc_id)
+            if removed:
+                with open(self._path(self.DELETED_FILE), "a", encoding="utf-8") as f:
+                    f.write("\n".join(removed) + "\n")
+        return bool(removed)
+
+    def ids_where(self, metadata_filter: Dict[str, Any]) -> List[str]:
+        """返回元数据全部匹配 metadata_filter 的有效文档ID"""
+        with self._lock:
+            return [
+                doc["id"] for row, doc in enumerate(self._docs)
+                if self._alive[row] and all(doc["metadata"].get(k) == v for k, v in metadata_filter.items())
+            ]
+
+    def __len__(self) -> int:
+        return int(self._alive[:self.count].sum())
+
+    def similarity_search_by_vector_with_score(self, embedding: Iterable[float], k: int = 4) -> List[Tuple[Document, float]]:
+        with self._lock:
+            count, vectors, scales, docs = self.count, self._vectors, self._scales, self._docs
+            alive = self._alive[:count].copy()
+        if count == 0 or not alive.any():
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        if self.precision == "float32":
+            scores = vectors[:count] @ query
+        else:
+            scores = np.empty(count, dtype=np.float32)
+            for start in range(0, count, self.SEARCH_BLOCK_ROWS):
+                block = np.asarray(vectors[start:min(start + self.SEARCH_BLOCK_ROWS, count)], dtype=np.float32)
+                scores[start:start + len(block)] = block @ query
+            scores *= scales[:count]
+        scores[~alive] = -np.inf
+
+        k = min(k, int(alive.sum()))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (Document(page_content=docs[i]["page_content"], metadata=docs[i]["metadata"]), float(scores[i]))
+            for i in top
+        ]
+
+    def similarity_search_with_score(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        """返回 (文档, 余弦相似度)，相似度越大越相关"""
+        return self.similarity_search_by_vector_with_score(self.embedding_function.embed_query(query), k)
+
+    def memory_bytes(self) -> int:
+        """有效行占用的向量字节数（映射文件按需换入内存）"""
+        if self.dim is None:
+            return 0
+        return int(self.count * (self.dim * self._dtype.itemsize + 4))
+
+    def compact(self):
+        """重写向量文件和元数据，去掉已删除的行并收缩文件容量"""
+        with self._lock:
+            if self.dim is None:
+                return
+            rows = np.flatnonzero(self._alive[:self.count])
+            tmp_dir = self.persist_directory.rstrip("/\\") + ".compact"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+
+            capacity = max(len(rows), self.MIN_CAPACITY)
+            vectors = np.memmap(os.path.join(tmp_dir, self.VECTORS_FILE), dtype=self._dtype, mode="w+",
+                                shape=(capacity, self.dim))
+            scales = np.memmap(os.path.join(tmp_dir, self.SCALES_FILE), dtype=np.float32, mode="w+",
+                               shape=(capacity,))
+            for start in range(0, len(rows), self.SEARCH_BLOCK_ROWS):
+                block = rows[start:start + self.SEARCH_BLOCK_ROWS]
+                vectors[start:start + len(block)] = self._vectors[block]
+                scales[start:start + len(block)] = self._scales[block]
+            vectors.flush()
+            scales.flush()
+            del vectors, scales
+            with open(os.path.join(tmp_dir, self.DOCS_FILE), "w", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(self._docs[row], ensure_ascii=False) + "\n")
+            with open(os.path.join(tmp_dir, self.META_FILE), "w", encoding="utf-8") as f:
+                json.dump({"dim": self.dim, "count": len(rows), "capacity": capacity,
+                           "precision": self.precision}, f)
+
+            # 先释放旧的内存映射，再用新文件替换
+            self._vectors = self._scales = None
+            for name in (self.VECTORS_FILE, self.SCALES_FILE, self.DOCS_FILE, self.META_FILE):
+                os.replace(os.path.join(tmp_dir, name), self._path(name))
+            if os.path.exists(self._path(self.DELETED_FILE)):
+                os.remove(self._path(self.DELETED_FILE))
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            self._load()
+
+
+def _numpy_directory(persist_directory: str, precision: str) -> str:
+    return os.path.join(persist_directory, f"numpy_index_{precision}")
+
+
+def _numpy_precision(config: "VectorIndexConfig") -> str:
+    return config.quantization if config.kind == "quantized" else "float32"
+
+
+def _chroma_search_ef(collection: Any) -> Optional[int]:
+    return ((collection.configuration or {}).get("hnsw") or {}).get("ef_search")
+
+
+def _tune_chroma_search_ef(vectorstore: Any, hnsw: HNSWParams):
+    """
+    HNSW 的 M / ef_construction 只在建库时生效，ef_search 可以对已有集合调整。
+    Chroma 1.x 不允许通过 metadata 修改（会连同 hnsw:space 一起被拒绝，只传 hnsw:search_ef 则被忽略），
+    需要修改集合的 configuration；修改后重新读取集合确认已保存。
+    """
+    collection = vectorstore._collection
+    if _chroma_search_ef(collection) == hnsw.ef_search:
+        return
+    collection.modify(configuration={"hnsw": {"ef_search": hnsw.ef_search}})
+    stored = _chroma_search_ef(vectorstore._client.get_collection(collection.name, embedding_function=None))
+    if stored != hnsw.ef_search:
+        raise RuntimeError(f"集合 {collection.name} 的 ef_search 未能更新为 {hnsw.ef_search}（当前为 {stored}）")
+    logging.info(f"已将集合 {collection.name} 的 ef_search 调整为 {hnsw.ef_search}")
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                continue
+    return total
+
+
+def delete_where(vectorstore: Any, metadata_filter: Dict[str, Any]) -> int:
+    """按元数据删除文档块，返回删除的数量"""
+    if isinstance(vectorstore, NumpyVectorStore):
+        ids = vectorstore.ids_where(metadata_filter)
+    else:
+        if len(metadata_filter) > 1:
+            where = {"$and": [{key: value} for key, value in metadata_filter.items()]}
+        else:
+            where = metadata_filter
+        ids = vectorstore.get(where=where, include=[])["ids"]
+    if ids:
+        vectorstore.delete(ids)
+    return len(ids)
+
+
+COMPACT_COLLECTION_SUFFIX = "_compact"
+
+
+class ReadWriteLock:
+    """
+    检索与压缩切换集合之间的读写锁：检索持有读锁可以并发执行，切换集合时持有写锁，等待进行中的检索结束。
+    有写者等待时新的读者排队，切换不会被持续到达的检索饿死。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+def _rebuild_chroma(vectorstore: Any, swap_lock: Optional[ReadWriteLock] = None, batch_size: int = 5000):
+    """
+    Chroma 删除只在 HNSW 中打标记，不会回收空间。
+    分页读出向量，在临时名称的新集合中重建，使 HNSW 图只包含有效向量；新集合完整写入后才替换旧集合，
+    重建期间检索仍使用旧集合，中途出错时旧集合保持不变。最后 VACUUM 回收 SQLite 空间。
+    调用方需持有知识库写锁，保证重建期间没有上传或删除（分页偏移不会变化）；
+    swap_lock 为检索使用的读写锁，切换集合时等待仍在旧集合上执行的检索结束。
+    """
+    client = vectorstore._client
+    collection = vectorstore._collection
+    name = collection.name
+    tmp_name = name + COMPACT_COLLECTION_SUFFIX
+    total = collection.count()
+
+    # 上次压缩中途失败留下的临时集合
+    if tmp_name in [c.name for c in client.list_collections()]:
+        client.delete_collection(tmp_name)
+    # 沿用旧集合的 HNSW 配置（包括调整过的 ef_search）
+    new_collection = client.create_collection(
+        tmp_name, metadata=collection.metadata, embedding_function=None,
+        configuration={"hnsw": dict((collection.configuration or {}).get("hnsw") or {})},
+    )
+    try:
+        # 逐页读取并写入，内存中只保留一页向量
+        for start in range(0, total, batch_size):
+            page = collection.get(limit=batch_size, offset=start,
+                                  include=["embeddings", "documents", "metadatas"])
+            if not page["ids"]:
+                break
+            new_collection.add(
+                ids=page["ids"],
+                embeddings=page["embeddings"],
+                documents=page["documents"],
+                metadatas=page["metadatas"],
+            )
+        if new_collection.count() != total:
+            raise RuntimeError(f"重建的集合只有 {new_collection.count()} 个向量，应为 {total} 个")
+    except Exception:
+        client.delete_collection(tmp_name)
+        raise
+
+    # 等待旧集合上的检索结束后切换集合，再删除旧集合并把新集合改回原名（集合对象按 ID 访问，改名不影响使用）
+    with swap_lock.write() if swap_lock else nullcontext():
+        vectorstore._collection = new_collection
+        client.delete_collection(name)
+        new_collection.modify(name=name)
+
+    sqlite_path = os.path.join(vectorstore._persist_directory or "", "chroma.sqlite3")
+    if os.path.exists(sqlite_path):
+        conn = sqlite3.connect(sqlite_path)
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+
+def _recover_chroma_compaction(vectorstore: Any):
+    """压缩在删除旧集合后、改名前中断时，启动时把临时集合改回原名"""
+    client = vectorstore._client
+    name = vectorstore._collection.name
+    tmp_name = name + COMPACT_COLLECTION_SUFFIX
+    if tmp_name not in [c.name for c in client.list_collections()]:
+        return
+    tmp_collection = client.get_collection(tmp_name, embedding_function=None)
+    if vectorstore._collection.count() == 0 and tmp_collection.count() > 0:
+        logging.warning(f"发现未完成的知识库压缩，使用临时集合 {tmp_name} 恢复")
+        client.delete_collection(name)
+        tmp_collection.modify(name=name)
+        vectorstore._collection = tmp_collection
+    else:
+        client.delete_collection(tmp_name)
+
+
+def compact_vectorstore(vectorstore: Any, swap_lock: Optional[ReadWriteLock] = None):
+    """压缩向量库：NumPy 后端重写文件，Chroma 重建集合并 VACUUM（swap_lock 见 _rebuild_chroma）"""
+    if isinstance(vectorstore, NumpyVectorStore):
+        vectorstore.compact()
+    else:
+        _rebuild_chroma(vectorstore, swap_lock)
+
+
+def load_vectorstore(persist_directory: str, embeddings: Any, config: VectorIndexConfig) -> Optional[Any]:
+    """加载已有的向量库，不存在时返回 None"""
+    if config.kind in ("numpy", "quantized"):
+        precision = _numpy_precision(config)
+        directory = _numpy_directory(persist_directory, precision)
+        if not NumpyVectorStore.exists(directory):
+            return None
+        return NumpyVectorStore(directory, embeddings, precision)
+
+    if config.kind != "chroma":
+        raise ValueError(f"未知的向量索引类型: {config.kind}")
+    if not (os.path.exists(persist_directory) and os.listdir(persist_directory)):
+        return None
+    Chroma = registry.timed_import("langchain_community.vectorstores").Chroma
+    vectorstore = Chroma(
+        persist_directory=persist_directory,
+        embedding_function=embeddings,
+        collection_metadata=config.hnsw.to_collection_metadata(),
+    )
+    _recover_chroma_compaction(vectorstore)
+    _tune_chroma_search_ef(vectorstore, config.hnsw)
+    return vectorstore
+
+
+def create_vectorstore(documents: List[Document], persist_directory: str, embeddings: Any,
+                       config: VectorIndexConfig) -> Any:
+    """用第一批文档创建向量库"""
+    if config.kind in ("numpy", "quantized"):
+        precision = _numpy_precision(config)
+        return NumpyVectorStore.from_documents(
+            documents, embeddings, _numpy_directory(persist_directory, precision), precision
+        )
+
+    from langchain_community.vectorstores import Chroma
+    return Chroma.from_documents(
+        documents=documents,
+        embedding=embeddings,
+        persist_directory=persist_directory,
+        collection_metadata=config.hnsw.to_collection_metadata(),
+    )